@@ -0,0 +1,101 @@
+import os
+
+DB_Host = "localhost"
+DB_User = "stu"
+DB_Password = "123456"
+DB_Name = "bookstore_lx"
+
+# 表结构迁移由 python -m be.migrate 完成，后端启动时只检查版本
+Auto_Migrate = False
+
+# 连接池
+Pool_Min_Size = 2
+Pool_Max_Size = 32
+Pool_Timeout = 10  # 借出连接的最长等待时间（秒）
+Pool_Max_Lifetime = 1800  # 物理连接的最长存活时间（秒）
+Pool_Ping_On_Borrow = True
+
+# 读写分离：只读请求路由到副本，如 [{"host": "localhost", "port": 3307}]
+# 未给出的连接参数沿用主库配置
+DB_Replicas = []
+Replica_Max_Lag = 2  # 副本延迟超过该值（秒）时回退到主库
+Replica_Lag_Check_Interval = 1
+Read_Your_Writes_Seconds = 5  # 用户写入后该时间内的读取仍走主库
+
+# 订单 ID 生成器的节点号（0-1023），多个后端进程必须各不相同，可用环境变量 BOOKSTORE_NODE_ID 指定；
+# 启动时以 MySQL 命名锁占用该节点号，已被其他进程占用时拒绝启动
+Node_Id = int(os.environ.get("BOOKSTORE_NODE_ID", "0"))
+
+# 未支付订单的超时时间（秒），超时后订单取消、预留的库存归还
+Unpaid_Order_Timeout = 10
+Expiry_Batch_Size = 500  # 每个事务最多取消的订单数
+Expiry_Resync_Interval = 60  # 从数据库重新加载未支付订单截止时间的周期（秒）
+
+# orders 按月分区（预先建好的月数）；已完成 / 已取消超过指定天数的订单移入归档表
+Order_Partition_Months_Ahead = 3
+Order_Archive_After_Days = 30
+Order_Archive_Batch = 500
+Order_Archive_Interval = 3600  # 秒
+
+# 卖家收入账本合并进 users.balance 的周期（秒）与每批行数
+Credit_Fold_Interval = 1
+Credit_Fold_Batch = 1000
+
+# 支付实现："python" 逐条执行 SQL，"procedure" 调用存储过程 pay_order（一次往返）
+# 可通过 POST /admin/payment_engine 在运行时切换
+Payment_Engine = "python"
+
+# Idempotency-Key：响应保存时长（秒）、进程内缓存条数
+Idempotency_Key_TTL = 86400
+# 未完成的请求在此时长（秒）内返回 409，之后可被同一个 key 重新占用；
+# 须大于最慢请求的耗时（含 Group_Commit_Timeout），否则仍在执行的请求可能被重复执行
+Idempotency_Pending_Timeout = 300
+Idempotency_Cache_Size = 10000
+
+# new_order 组提交：窗口内（或攒满一批）的下单请求合并为一个事务提交
+Order_Group_Commit = False
+Group_Commit_Window_Ms = 2
+Group_Commit_Max_Batch = 64
+Group_Commit_Timeout = 30  # 请求等待写入结果的最长时间（秒）
+
+# 库存读改写的并发控制，按操作选择："optimistic" 按 version 比较交换并重试，
+# "pessimistic" 使用 SELECT ... FOR UPDATE；可通过 POST /admin/inventory_concurrency 切换。
+# new_order 不在此列：它用一条带 stock_quantity >= 数量 条件的 UPDATE 扣减库存，
+# 没有先读后写，只顺带递增 version
+Inventory_Concurrency = {
+    "add_stock_level": "optimistic",
+    "change_book_price": "optimistic",
+}
+Inventory_Cas_Retries = 5
+
+# 进程内库存缓存（价格与库存），写入提交后失效；多个后端进程之间只靠 TTL（秒）收敛
+Inventory_Cache_Enabled = True
+Inventory_Cache_TTL = 5
+Inventory_Cache_Size = 10000
+
+# search_books 总数缓存（秒 / 条数）；count="approx" 时最多数到该上限，超过显示为 "上限+"
+Search_Count_TTL = 30
+Search_Count_Cache_Size = 10000
+Search_Count_Cap = 1000
+
+# 多进程部署时后台任务的 leader 选举（MySQL GET_LOCK），心跳周期（秒）；
+# 心跳超过 3 个周期未更新的 leader 在 /admin/leader 中显示为失效
+Leader_Election = True
+Leader_Heartbeat_Interval = 2
+
+# 后台任务运行器：工作线程数、关闭时等待调度线程退出的最长时间（秒）
+Job_Workers = 4
+Job_Stop_Timeout = 30
+
+# /admin 下修改运行时配置的 POST 接口需要在 Admin-Token 请求头中带上该值；为空时禁止修改
+Admin_Token = ""
+
+# SQL 统计与慢查询日志
+Sql_Stats_Enabled = True
+Slow_Query_Ms = 200
+
+# 死锁 / 锁等待超时自动重试
+Tx_Max_Attempts = 4
+Tx_Backoff_Base = 0.01  # 秒，第 n 次重试最多等待 base * 2^n
+Tx_Backoff_Max = 0.5
+Tx_Retry_Budget_Ratio = 0.2  # 重试次数最多约为事务数的该比例
@@ -0,0 +1,213 @@
+"""Background job runtime: periodic and deadline jobs on a bounded worker pool.
+
+A job is a function returning the number of rows it affected. Periodic
+jobs run every `interval` seconds; deadline jobs also pass next_delay(),
+asked after every run for the seconds until the job has work again, and
+can be woken early with wake(). Jobs marked leader_only run only on the
+process leading them (see be.model.leader).
+"""
+import bisect
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from be import conf
+from be.model import leader
+
+# 运行耗时直方图的上界（秒），最后一档为无穷大；导出的计数是累计的（耗时 <= 上界的次数）
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+
+
+class Job:
+    def __init__(self, name: str, func, interval: float, next_delay=None,
+                 leader_only: bool = True, on_standby=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_delay = next_delay
+        self.leader_only = leader_only
+        self.on_standby = on_standby
+
+
+class JobStats:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.standby = 0
+        self.rows = 0
+        self.last_run_at = None
+        self.last_duration = None
+        self.last_rows = None
+        self.last_error = None
+        self.durations = [0] * (len(DURATION_BUCKETS) + 1)
+
+    def record(self, started_at: float, duration: float, rows=None, error=None):
+        self.runs += 1
+        self.last_run_at = started_at
+        self.last_duration = duration
+        self.last_rows = rows
+        self.last_error = error
+        self.durations[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+        if error is not None:
+            self.failures += 1
+        elif rows:
+            self.rows += rows
+
+    def snapshot(self) -> dict:
+        labels = [f"le_{bound}" for bound in DURATION_BUCKETS] + ["le_inf"]
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "standby": self.standby,
+            "rows": self.rows,
+            "last_run_at": self.last_run_at,
+            "last_duration": self.last_duration,
+            "last_rows": self.last_rows,
+            "last_error": self.last_error,
+            "duration_histogram": dict(zip(labels, itertools.accumulate(self.durations))),
+        }
+
+
+class JobRunner:
+    """Runs registered jobs when due; a job never overlaps with itself."""
+
+    def __init__(self, workers=None):
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._stats = {}
+        self._due = []
+        self._busy = set()
+        self._woken = {}
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=workers or conf.Job_Workers,
+                                            thread_name_prefix="job")
+        self._thread = threading.Thread(target=self._loop, name="JobRunner", daemon=True)
+
+    def register(self, job: Job, delay: float = 0.0):
+        with self._cond:
+            self._jobs[job.name] = job
+            self._stats[job.name] = JobStats()
+            heapq.heappush(self._due, (time.monotonic() + delay, job.name))
+            self._cond.notify()
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping
+
+    def stop(self, timeout=None):
+        """Stop scheduling and wait for runs in progress to finish."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout if timeout is not None else conf.Job_Stop_Timeout)
+        self._executor.shutdown(wait=True)
+
+    def wake(self, name: str, delay: float = 0.0):
+        """Run job name within delay seconds, unless it is already due sooner."""
+        with self._cond:
+            if name not in self._jobs or self._stopping:
+                return
+            at = time.monotonic() + max(0.0, delay)
+            for index, (when, queued) in enumerate(self._due):
+                if queued == name:
+                    if when <= at:
+                        return
+                    self._due[index] = (at, name)
+                    heapq.heapify(self._due)
+                    break
+            else:
+                if name in self._busy:
+                    # 正在运行，结束后再按唤醒时间排队
+                    self._woken[name] = min(at, self._woken.get(name, at))
+                    return
+                heapq.heappush(self._due, (at, name))
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            next_runs = {name: when - time.monotonic() for when, name in self._due}
+            return {
+                name: dict(stats.snapshot(), running=name in self._busy,
+                           next_run_in=next_runs.get(name))
+                for name, stats in sorted(self._stats.items())
+            }
+
+    def _loop(self):
+        logging.info("JobRunner thread started")
+        while True:
+            with self._cond:
+                if self._stopping:
+                    break
+                now = time.monotonic()
+                if not self._due or self._due[0][0] > now:
+                    self._cond.wait(self._due[0][0] - now if self._due else None)
+                    continue
+                _, name = heapq.heappop(self._due)
+                job = self._jobs[name]
+                self._busy.add(name)
+            self._executor.submit(self._execute, job)
+        logging.info("JobRunner thread stopped")
+
+    def _execute(self, job: Job):
+        stats = self._stats[job.name]
+        delay = job.interval
+        try:
+            if job.leader_only and not leader.confirm_leader(job.name):
+                stats.standby += 1
+                if job.on_standby is not None:
+                    job.on_standby()
+                delay = min(job.interval, conf.Leader_Heartbeat_Interval)
+                return
+            started_at, start = time.time(), time.perf_counter()
+            try:
+                rows = job.func()
+            except Exception as e:
+                stats.record(started_at, time.perf_counter() - start, error=str(e))
+                logging.error(f"[JobRunner] {job.name} failed: {str(e)}", exc_info=True)
+                return
+            stats.record(started_at, time.perf_counter() - start, rows)
+            if job.next_delay is not None:
+                next_delay = job.next_delay()
+                if next_delay is not None:
+                    delay = min(delay, next_delay)
+        finally:
+            with self._cond:
+                self._busy.discard(job.name)
+                at = time.monotonic() + delay
+                at = min(at, self._woken.pop(job.name, at))
+                if not self._stopping:
+                    heapq.heappush(self._due, (at, job.name))
+                    self._cond.notify()
+
+
+runner = None
+
+
+def start_runner(jobs) -> JobRunner:
+    global runner
+    job_runner = JobRunner()
+    for job in jobs:
+        job_runner.register(job)
+    job_runner.start()
+    runner = job_runner
+    return job_runner
+
+
+def wake(name: str, delay: float = 0.0):
+    if runner is not None:
+        runner.wake(name, delay)
+
+
+def stopping() -> bool:
+    """True once the runner is shutting down; long job bodies should return early."""
+    return runner is not None and runner.stopping
+
+
+def stop_runner():
+    if runner is not None:
+        runner.stop()
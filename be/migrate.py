@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Apply pending schema migrations: python -m be.migrate [--status] [--sizes]"""
+import argparse
+import logging
+import mysql.connector
+from contextlib import closing
+from be import conf
+from be.model import schema
+
+
+def connect():
+    return mysql.connector.connect(
+        host=conf.DB_Host,
+        user=conf.DB_User,
+        password=conf.DB_Password,
+    )
+
+
+def status() -> int:
+    with closing(connect()) as conn:
+        with closing(conn.cursor()) as cursor:
+            try:
+                cursor.execute(f"USE {conf.DB_Name}")
+            except mysql.connector.Error:
+                return 0
+            return schema.current_version(cursor)
+
+
+def sizes() -> list:
+    with closing(connect()) as conn:
+        with closing(conn.cursor()) as cursor:
+            return schema.table_sizes(cursor, conf.DB_Name)
+
+
+def print_sizes():
+    print(f"{'table':<24} {'rows':>10} {'data_mb':>9} {'index_mb':>9}")
+    for table, rows, data, index in sizes():
+        print(f"{table:<24} {rows or 0:>10} {(data or 0) / 2**20:>9.2f} {(index or 0) / 2**20:>9.2f}")
+
+
+def upgrade() -> list:
+    with closing(connect()) as conn:
+        return schema.upgrade(conn, conf.DB_Name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--status", action="store_true", help="只显示当前版本，不执行迁移")
+    parser.add_argument("--sizes", action="store_true", help="显示各表的行数、数据和索引大小")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.sizes:
+        print_sizes()
+        return
+    if args.status:
+        print(f"schema version {status()} (latest {schema.LATEST_VERSION})")
+        return
+    applied = upgrade()
+    if applied:
+        print(f"applied migrations {applied}, now at version {schema.LATEST_VERSION}")
+    else:
+        print(f"schema already at version {schema.LATEST_VERSION}")
+
+
+if __name__ == "__main__":
+    main()
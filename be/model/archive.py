@@ -0,0 +1,126 @@
+import logging
+from datetime import date
+from be import conf
+from be import jobs
+from be.model import db_conn
+from be.model import order_keys
+from be.model import schema
+
+# 已完成 / 已取消超过 conf.Order_Archive_After_Days 天的订单连同明细移入 *_archive 表，
+# orders 只保留近期和仍在流转中的订单；按月分区随时间追加，已清空的旧分区直接删除
+
+ORDER_COLUMNS = ("order_key, order_id, user_id, store_id, order_status, create_time, "
+                 "total_amount, ship_time, receive_time")
+DETAIL_COLUMNS = "detail_id, order_key, book_id, quantity, unit_price"
+
+
+def archive_orders(conn, after_days: int, batch_size: int) -> int:
+    """Move the oldest batch_size archivable orders and their details.
+
+    Returns the number of orders moved; copying and deleting commit
+    together, so an order is always in exactly one of the two tables.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT order_key, UNIX_TIMESTAMP(create_time) FROM orders "
+            "WHERE order_status IN ('completed', 'cancelled') "
+            "AND create_time < NOW() - INTERVAL %s DAY "
+            "ORDER BY create_time LIMIT %s FOR UPDATE SKIP LOCKED",
+            (after_days, batch_size)
+        )
+        pks = cursor.fetchall()
+        if not pks:
+            conn.commit()
+            return 0
+
+        keys = tuple(order_key for order_key, _ in pks)
+        placeholders = ", ".join(["%s"] * len(keys))
+        # orders 按完整主键访问，只触及各订单所在的分区
+        by_pk = order_keys.pk_condition(len(pks))
+        pk_params = [value for pk in pks for value in pk]
+        cursor.execute(
+            f"INSERT INTO orders_archive ({ORDER_COLUMNS}) "
+            f"SELECT {ORDER_COLUMNS} FROM orders WHERE {by_pk}",
+            pk_params
+        )
+        cursor.execute(
+            f"INSERT INTO order_details_archive ({DETAIL_COLUMNS}) "
+            f"SELECT {DETAIL_COLUMNS} FROM order_details WHERE order_key IN ({placeholders})",
+            keys
+        )
+        cursor.execute(f"DELETE FROM order_details WHERE order_key IN ({placeholders})", keys)
+        cursor.execute(f"DELETE FROM orders WHERE {by_pk}", pk_params)
+        conn.commit()
+        return len(keys)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def maintain_partitions(conn, database: str, months_ahead: int, after_days: int) -> (int, int):
+    """Add monthly partitions up to months_ahead and drop emptied old ones.
+
+    Returns (added, dropped). Does nothing if orders is not partitioned.
+    """
+    cursor = conn.cursor()
+    try:
+        names = [name for name in schema.order_partitions(cursor, database) if name != "pmax"]
+        if not names:
+            return 0, 0
+
+        today = date.today()
+        wanted = schema.month_range(date(today.year, today.month, 1), months_ahead + 1)
+        latest = max(names)
+        missing = [(year, month) for year, month in wanted if f"p{year:04d}{month:02d}" > latest]
+        if missing:
+            cursor.execute(
+                "ALTER TABLE orders REORGANIZE PARTITION pmax INTO ("
+                + ", ".join(schema.month_partition(year, month) for year, month in missing)
+                + ", PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            )
+
+        # 整月都早于归档线的分区里只剩未归档的订单（未完成的），为空即可删除；
+        # 至少保留一个按月的分区
+        cutoff = date.fromordinal(today.toordinal() - after_days)
+        dropped = 0
+        for name in names[:-1]:
+            year, month = int(name[1:5]), int(name[5:7])
+            if (year, month) >= (cutoff.year, cutoff.month):
+                break
+            cursor.execute(f"SELECT 1 FROM orders PARTITION ({name}) LIMIT 1")
+            if cursor.fetchall():
+                continue
+            cursor.execute(f"ALTER TABLE orders DROP PARTITION {name}")
+            dropped += 1
+        return len(missing), dropped
+    finally:
+        cursor.close()
+
+
+ARCHIVE_JOB = "order_archive"
+
+
+def archive_old_orders() -> int:
+    """Job body: archive everything due, then add and drop partitions."""
+    db = db_conn.DBConn()
+    try:
+        archived = 0
+        while not jobs.stopping():
+            count = archive_orders(db.conn, conf.Order_Archive_After_Days, conf.Order_Archive_Batch)
+            archived += count
+            if count < conf.Order_Archive_Batch:
+                break
+        added, dropped = maintain_partitions(
+            db.conn, conf.DB_Name, conf.Order_Partition_Months_Ahead, conf.Order_Archive_After_Days)
+        if added or dropped:
+            logging.info(f"[{ARCHIVE_JOB}] added {added} and dropped {dropped} order partitions")
+        return archived
+    finally:
+        db.close()
+
+
+def archive_job() -> jobs.Job:
+    return jobs.Job(ARCHIVE_JOB, archive_old_orders, conf.Order_Archive_Interval)
@@ -1,119 +1,356 @@
-import uuid
 import json
+import base64
+import hashlib
 import logging
+import mysql.connector
+from be import conf
+from be import jobs
 from be.model import db_conn
 from be.model import error
+from be.model import leader
+from be.model import ledger
+from be.model import order_keys
+from be.model import statements
+from be.model import snowflake
+from be.model.inventory_cache import inventory_cache
+from be.model.search_count import COUNT_MODES, search_counts
 import threading
+import queue
+import functools
+import heapq
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 import time
-from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Tuple
 from decimal import Decimal
-from be.model.store import get_db_conn
+
+_FIND_UNPAID_ORDER = statements.register(
+    "buyer.find_unpaid_order",
+    "SELECT order_id, order_key, UNIX_TIMESTAMP(create_time) FROM orders "
+    "WHERE user_id = %s AND store_id = %s AND order_status = 'unpaid' FOR UPDATE")
+_INSERT_ORDER_ID = statements.register(
+    "buyer.insert_order_id",
+    "INSERT INTO order_ids (order_key, order_id, create_time) VALUES (%s, %s, FROM_UNIXTIME(%s))")
+_INSERT_ORDER = statements.register(
+    "buyer.insert_order",
+    "INSERT INTO orders (order_key, order_id, user_id, store_id, order_status, total_amount, create_time) "
+    "VALUES (%s, %s, %s, %s, 'unpaid', 0, FROM_UNIXTIME(%s))")
+_ADD_ORDER_TOTAL = statements.register(
+    "buyer.add_order_total",
+    "UPDATE orders SET total_amount = total_amount + %s WHERE " + order_keys.PK_CONDITION)
+_LOCK_ORDER = statements.register(
+    "buyer.lock_order",
+    "SELECT user_id, store_id, order_status FROM orders WHERE " + order_keys.PK_CONDITION + " FOR UPDATE")
+_SUM_ORDER_DETAILS = statements.register(
+    "buyer.sum_order_details",
+    "SELECT SUM(quantity * unit_price) FROM order_details WHERE order_key = %s")
+_LOCK_BUYER = statements.register(
+    "buyer.lock_buyer",
+    "SELECT balance, password_hash FROM users WHERE user_id = %s FOR UPDATE")
+_FIND_STORE_OWNER = statements.register(
+    "buyer.find_store_owner",
+    "SELECT user_id FROM stores WHERE store_id = %s")
+_DEBIT_BUYER = statements.register(
+    "buyer.debit_buyer",
+    "UPDATE users SET balance = balance - %s WHERE user_id = %s AND balance >= %s")
+_MARK_ORDER_PAID = statements.register(
+    "buyer.mark_order_paid",
+    "UPDATE orders SET order_status = 'paid', total_amount = %s WHERE " + order_keys.PK_CONDITION)
+_SELL_RESERVATIONS = statements.register(
+    "buyer.sell_reservations",
+    "UPDATE stock_reservations SET status = 'sold' WHERE order_id = %s AND status = 'held'")
+
+_order_keys = snowflake.SnowflakeGenerator(conf.Node_Id)
+
+
+PAYMENT_ENGINES = ("python", "procedure")
+
+
+def _pay_order_result(code, user_id, order_id, store_id) -> Tuple[int, str]:
+    """Translate the status code returned by the pay_order procedure."""
+    if code == 200:
+        return 200, "ok"
+    if code == 401:
+        return error.error_authorization_fail()
+    if code == 511:
+        return error.error_non_exist_user_id(user_id)
+    if code == 513:
+        return error.error_non_exist_store_id(store_id)
+    if code == 518:
+        return error.error_invalid_order_id(order_id)
+    if code == 519:
+        return error.error_not_sufficient_funds(order_id)
+    if code == 531:
+        return error.error_order_status(order_id)
+    return 530, f"Internal error: pay_order returned {code}"
+
+
+def _search_fingerprint(query, search_field, store_id) -> str:
+    key = json.dumps([query, search_field, store_id], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_search_cursor(fingerprint: str, score: float, store_id: str, book_id: str) -> str:
+    """Opaque position after (score, store_id, book_id) in one search's result order."""
+    raw = json.dumps([fingerprint, score, store_id, book_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_search_cursor(cursor: str, fingerprint: str):
+    """Return (score, store_id, book_id), or None if cursor is not from this search."""
+    try:
+        cursor_fingerprint, score, store_id, book_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    if cursor_fingerprint != fingerprint or not isinstance(score, (int, float)):
+        return None
+    return float(score), store_id, book_id
+
+
+def release_reservations(cursor, order_ids) -> list:
+    """Return the stock held by the given unpaid orders to inventory.
+
+    The caller must hold the order rows locked. Returns the (store_id,
+    book_id) pairs whose stock changed, to be passed to
+    inventory_cache.invalidate() after commit.
+    """
+    if not order_ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(order_ids))
+    cursor.execute(
+        "SELECT DISTINCT store_id, book_id FROM stock_reservations "
+        f"WHERE order_id IN ({placeholders}) AND status = 'held'",
+        tuple(order_ids)
+    )
+    keys = cursor.fetchall()
+    if not keys:
+        return []
+    # 多表 UPDATE 中同一库存行只会被更新一次，先按书汇总
+    cursor.execute(
+        "UPDATE store_inventory s JOIN ("
+        "   SELECT store_id, book_id, SUM(quantity) AS quantity FROM stock_reservations "
+        f"  WHERE order_id IN ({placeholders}) AND status = 'held' "
+        "   GROUP BY store_id, book_id"
+        ") r ON s.store_id = r.store_id AND s.book_id = r.book_id "
+        "SET s.stock_quantity = s.stock_quantity + r.quantity, s.version = s.version + 1",
+        tuple(order_ids)
+    )
+    cursor.execute(
+        "UPDATE stock_reservations SET status = 'released' "
+        f"WHERE order_id IN ({placeholders}) AND status = 'held'",
+        tuple(order_ids)
+    )
+    return keys
+
+
+def cancel_unpaid_orders(cursor, orders: dict) -> list:
+    """Cancel the given orders and release their stock, skipping any that are no longer unpaid.
+
+    orders maps order ids to their primary key, as returned by
+    order_keys.primary_keys(). The caller must hold the order rows
+    locked. Returns the inventory keys to invalidate after commit, like
+    release_reservations().
+    """
+    if not orders:
+        return []
+    released = release_reservations(cursor, list(orders))
+    cursor.execute(
+        "UPDATE orders SET order_status = 'cancelled' "
+        f"WHERE ({order_keys.pk_condition(len(orders))}) AND order_status = 'unpaid'",
+        [value for pk in orders.values() for value in pk]
+    )
+    return released
+
+
+def cancel_expired_orders(conn, chunk_size: int) -> int:
+    """Cancel every unpaid order past its deadline, chunk_size orders per transaction.
+
+    Rows locked by a concurrent payment are skipped (SKIP LOCKED) and left
+    to the next run; each chunk takes two set-based statements for stock
+    and one for the statuses. Returns the number of orders cancelled.
+    """
+    cancelled = 0
+    with conn.cursor() as cursor:
+        while True:
+            cursor.execute(
+                "SELECT order_id, order_key, UNIX_TIMESTAMP(create_time) FROM orders "
+                "WHERE order_status = 'unpaid' AND create_time <= NOW() - INTERVAL %s SECOND "
+                "ORDER BY create_time LIMIT %s FOR UPDATE SKIP LOCKED",
+                (conf.Unpaid_Order_Timeout, chunk_size)
+            )
+            orders = {order_id: (order_key, created) for order_id, order_key, created in cursor.fetchall()}
+            released = cancel_unpaid_orders(cursor, orders)
+            conn.commit()
+            inventory_cache.invalidate(released)
+            cancelled += len(orders)
+            if len(orders) < chunk_size:
+                return cancelled
+
 
 class Buyer(db_conn.DBConn):
     def __init__(self):
         db_conn.DBConn.__init__(self)
 
+    @db_conn.writes()
     def new_order(self, user_id: str, store_id: str, id_and_count: List[Tuple[str, int]]) -> Tuple[int, str, str]:
-        order_id = ""
+        if order_writer is not None:
+            return order_writer.submit(user_id, store_id, id_and_count)
+        return self.new_order_now(user_id, store_id, id_and_count)
+
+    @db_conn.transactional("")
+    def new_order_now(self, user_id: str, store_id: str, id_and_count: List[Tuple[str, int]]) -> Tuple[int, str, str]:
+        """new_order in its own transaction, bypassing the order writer."""
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id) + (order_id,)
-            if not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id) + (order_id,)
+            result = self._place_order(user_id, store_id, id_and_count, self.conn.rollback)
+            if result[0] == 200:
+                self.conn.commit()
+            return result
 
+        except Exception as e:
+            self.conn.rollback()
+            if db_conn.is_retryable(e):
+                raise
+            logging.error(f"Failed to create or update order: {str(e)}", exc_info=True)
+            return 530, f"Internal error: {str(e)}", ""
+
+    def _place_order(self, user_id: str, store_id: str, id_and_count: List[Tuple[str, int]],
+                     undo) -> Tuple[int, str, str]:
+        """Write an order without committing.
+
+        undo() discards what this call wrote; it is called before the
+        failure is diagnosed, and callers must still undo on any non-200.
+        """
+        order_id = ""
+        code, message = self.check_preconditions(user_id, store_id)
+        if code != 200:
+            return code, message, order_id
+
+        # 同一本书可能出现多次，先合并数量；dict 保留请求中的顺序用于报错
+        counts = {}
+        for book_id, count in id_and_count:
+            counts[book_id] = counts.get(book_id, 0) + count
+        counts = {book_id: count for book_id, count in counts.items() if count}
+
+        # 缓存的库存已不足时直接拒绝，不必加锁；缓存未命中的书交给条件扣减判断
+        for book_id, count in counts.items():
+            cached = inventory_cache.peek(store_id, book_id)
+            if cached is not None and cached[0] < count:
+                inventory_cache.count_precheck_reject()
+                return error.error_stock_level_low(book_id) + (order_id,)
+
+        # Step 1: 查找是否有该用户在该店铺下的未支付订单
+        existing_order = self.fetch_prepared(_FIND_UNPAID_ORDER, (user_id, store_id))
+
+        if existing_order:
+            order_id, order_key, created = existing_order[0]
+        else:
+            # 创建新订单：主键为 64 位时间序 ID，对外的 order_id 为其十进制字符串
+            order_key = _order_keys.next_id()
+            order_id = str(order_key)
+            # create_time 取 ID 中的时间（秒）；orders 分区后无法建 order_id 唯一索引，
+            # 由 order_ids 保证不重复，并记下完整主键供之后按主键加锁
+            created = snowflake.timestamp_ms(order_key) // 1000
+            self.execute_prepared(_INSERT_ORDER_ID, (order_key, order_id, created))
+            self.execute_prepared(_INSERT_ORDER, (order_key, order_id, user_id, store_id, created))
+
+        total_price = Decimal('0.00')
+        if counts:
+            placeholders = ", ".join(["%s"] * len(counts))
             with self.conn.cursor() as cursor:
-                # Step 1: 查找是否有该用户在该店铺下的未支付订单
+                # 单表条件扣减：库存不足的行不会被更新，不需要先加锁读取再写回；
+                # ORDER BY book_id 让并发下单按 (store_id, book_id) 索引顺序加锁
+                quantity = "CASE book_id " + " ".join(["WHEN %s THEN %s"] * len(counts)) + " END"
+                quantity_params = [value for item in counts.items() for value in item]
                 cursor.execute(
-                    "SELECT order_id FROM orders "
-                    "WHERE user_id = %s AND store_id = %s AND order_status = 'unpaid' FOR UPDATE",
-                    (user_id, store_id)
+                    f"UPDATE store_inventory SET stock_quantity = stock_quantity - {quantity}, "
+                    "version = version + 1 "
+                    f"WHERE store_id = %s AND book_id IN ({placeholders}) "
+                    f"AND stock_quantity >= {quantity} "
+                    "ORDER BY book_id",
+                    quantity_params + [store_id, *counts] + quantity_params
                 )
-                existing_order = cursor.fetchone()
-
-                if existing_order:
-                    order_id = existing_order[0]
-                else:
-                    # 创建新订单
-                    order_id = f"{user_id}_{store_id}_{uuid.uuid1()}"
-                    cursor.execute(
-                        "INSERT INTO orders (order_id, user_id, store_id, order_status, total_amount) "
-                        "VALUES (%s, %s, %s, 'unpaid', 0)",
-                        (order_id, user_id, store_id)
-                    )
-
-                total_price = Decimal('0.00')
-
-                for book_id, count in id_and_count:
-                    cursor.execute(
-                        "SELECT stock_quantity, book_price FROM store_inventory "
-                        "WHERE store_id = %s AND book_id = %s FOR UPDATE",
-                        (store_id, book_id))
-                    book = cursor.fetchone()
-                    if not book:
-                        self.conn.rollback()
-                        return error.error_non_exist_book_id(book_id) + (order_id,)
-
-                    stock, price = book
-                    if stock < count:
-                        self.conn.rollback()
-                        return error.error_stock_level_low(book_id) + (order_id,)
-
-                    # 检查该订单中是否已有该书籍
-                    cursor.execute(
-                        "SELECT quantity FROM order_details "
-                        "WHERE order_id = %s AND book_id = %s",
-                        (order_id, book_id)
-                    )
-                    existing_detail = cursor.fetchone()
+                if cursor.rowcount != len(counts):
+                    undo()
+                    return self._reservation_failure(cursor, store_id, counts) + (order_id,)
+                self.conn.after_commit(
+                    inventory_cache.invalidate, [(store_id, book_id) for book_id in counts])
 
-                    if existing_detail:
-                        new_count = existing_detail[0] + count
-                        # 更新已有明细
-                        cursor.execute(
-                            "UPDATE order_details SET quantity = %s WHERE order_id = %s AND book_id = %s",
-                            (new_count, order_id, book_id)
-                        )
-                    else:
-                        # 插入新明细
-                        cursor.execute(
-                            "INSERT INTO order_details (order_id, book_id, quantity, unit_price) "
-                            "VALUES (%s, %s, %s, %s)",
-                            (order_id, book_id, count, price)
-                        )
+                # 这些行已被本事务锁定，普通读取即可拿到下单时的单价
+                cursor.execute(
+                    "SELECT book_id, book_price FROM store_inventory "
+                    f"WHERE store_id = %s AND book_id IN ({placeholders})",
+                    (store_id, *counts)
+                )
+                prices = dict(cursor.fetchall())
 
-                    total_price += price * Decimal(count)
+                rows = []
+                for book_id, count in counts.items():
+                    rows.append((order_key, book_id, count, prices[book_id]))
+                    total_price += prices[book_id] * Decimal(count)
 
-                # 更新订单总价
+                # 已有明细只累加数量，单价保持下单时的价格
                 cursor.execute(
-                    "UPDATE orders SET total_amount = total_amount + %s WHERE order_id = %s",
-                    (total_price, order_id)
+                    "INSERT INTO order_details (order_key, book_id, quantity, unit_price) VALUES "
+                    + ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+                    + " ON DUPLICATE KEY UPDATE quantity = quantity + VALUES(quantity)",
+                    [value for row in rows for value in row]
                 )
 
-                self.conn.commit()
-                return 200, "ok", order_id
-
-        except Exception as e:
-            self.conn.rollback()
-            logging.error(f"Failed to create or update order: {str(e)}", exc_info=True)
-            return 530, f"Internal error: {str(e)}", ""
-    
+                cursor.execute(
+                    "INSERT INTO stock_reservations (order_id, store_id, book_id, quantity, expires_at) VALUES "
+                    + ", ".join(["(%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)"] * len(counts))
+                    + " ON DUPLICATE KEY UPDATE "
+                    "quantity = IF(status = 'held', quantity + VALUES(quantity), VALUES(quantity)), "
+                    "status = 'held'",
+                    [value for book_id, count in counts.items()
+                     for value in (order_id, store_id, book_id, count, conf.Unpaid_Order_Timeout)]
+                )
 
+        # 更新订单总价
+        self.execute_prepared(_ADD_ORDER_TOTAL, (total_price, order_key, created))
+        if not existing_order:
+            self.conn.after_commit(schedule_order_expiry, order_id)
+        return 200, "ok", order_id
+
+    def _reservation_failure(self, cursor, store_id, counts) -> Tuple[int, str]:
+        """Work out which book made the conditional stock update fail."""
+        placeholders = ", ".join(["%s"] * len(counts))
+        cursor.execute(
+            "SELECT book_id, stock_quantity FROM store_inventory "
+            f"WHERE store_id = %s AND book_id IN ({placeholders})",
+            (store_id, *counts)
+        )
+        stock = dict(cursor.fetchall())
+        for book_id, count in counts.items():
+            if book_id not in stock:
+                return error.error_non_exist_book_id(book_id)
+            if stock[book_id] < count:
+                return error.error_stock_level_low(book_id)
+        # 两次查询之间库存被其他事务补足，按库存不足处理，客户端可重试
+        return error.error_stock_level_low(next(iter(counts)))
+
+
+    @db_conn.writes()
+    @db_conn.transactional()
     def reduce_order_item(self, user_id: str, order_id: str, book_id: str, delta: int) -> Tuple[int, str]:
         try:
             with self.conn.cursor() as cursor:
-                # Step 1: 获取订单信息并加锁
-                cursor.execute(
-                    "SELECT o.user_id, o.store_id, o.order_status, d.quantity, d.unit_price "
-                    "FROM orders o "
-                    "JOIN order_details d ON o.order_id = d.order_id "
-                    "WHERE o.order_id = %s AND d.book_id = %s FOR UPDATE",
-                    (order_id, book_id)
-                )
-                result = cursor.fetchone()
+                # Step 1: 获取订单信息并按主键加锁
+                pk = order_keys.primary_keys(cursor, [order_id]).get(order_id)
+                result = None
+                if pk is not None:
+                    cursor.execute(
+                        "SELECT o.user_id, o.store_id, o.order_status, d.quantity, d.unit_price "
+                        "FROM orders o "
+                        "JOIN order_details d ON o.order_key = d.order_key "
+                        f"WHERE {order_keys.pk_condition(1, 'o')} AND d.book_id = %s FOR UPDATE",
+                        (*pk, book_id)
+                    )
+                    result = cursor.fetchone()
                 if not result:
                     return error.error_invalid_order_id(order_id)
 
+                order_key = pk[0]
                 buyer_id, store_id, status, count, price = result
 
                 # Step 2: 校验用户权限和订单状态
@@ -128,39 +365,47 @@ class Buyer(db_conn.DBConn):
                     return 520, "Reduced quantity exceeds current amount"
 
                 if new_count == 0:
-                    # Step 4: 删除该条目并返还全部库存
+                    # Step 4: 删除该条目并释放全部预留库存
                     cursor.execute(
-                        "UPDATE store_inventory SET stock_quantity = stock_quantity + %s "
-                        "WHERE store_id = %s AND book_id = %s",
-                        (count, store_id, book_id)
+                        "UPDATE store_inventory s JOIN stock_reservations r "
+                        "ON s.store_id = r.store_id AND s.book_id = r.book_id "
+                        "SET s.stock_quantity = s.stock_quantity + r.quantity, s.version = s.version + 1, "
+                        "r.status = 'released' "
+                        "WHERE r.order_id = %s AND r.book_id = %s AND r.status = 'held'",
+                        (order_id, book_id)
                     )
 
                     cursor.execute(
-                        "DELETE FROM order_details WHERE order_id = %s AND book_id = %s",
-                        (order_id, book_id)
+                        "DELETE FROM order_details WHERE order_key = %s AND book_id = %s",
+                        (order_key, book_id)
                     )
 
                 else:
-                    # Step 5: 更新数量并返还部分库存
+                    # Step 5: 更新数量并释放部分预留库存
                     cursor.execute(
-                        "UPDATE store_inventory SET stock_quantity = stock_quantity + %s "
-                        "WHERE store_id = %s AND book_id = %s",
-                        (delta, store_id, book_id)
+                        "UPDATE store_inventory s JOIN stock_reservations r "
+                        "ON s.store_id = r.store_id AND s.book_id = r.book_id "
+                        "SET s.stock_quantity = s.stock_quantity + %s, s.version = s.version + 1, "
+                        "r.quantity = r.quantity - %s "
+                        "WHERE r.order_id = %s AND r.book_id = %s AND r.status = 'held'",
+                        (delta, delta, order_id, book_id)
                     )
 
                     cursor.execute(
                         "UPDATE order_details SET quantity = %s "
-                        "WHERE order_id = %s AND book_id = %s",
-                        (new_count, order_id, book_id)
+                        "WHERE order_key = %s AND book_id = %s",
+                        (new_count, order_key, book_id)
                     )
 
+                self.conn.after_commit(inventory_cache.invalidate, [(store_id, book_id)])
+
                 # Step 6: 更新订单总价（重新计算）
                 cursor.execute(
                     "UPDATE orders o SET total_amount = ("
                     "   SELECT COALESCE(SUM(quantity * unit_price), 0) "
-                    "   FROM order_details d WHERE d.order_id = o.order_id"
-                    ") WHERE o.order_id = %s",
-                    (order_id,)
+                    "   FROM order_details d WHERE d.order_key = o.order_key"
+                    f") WHERE {order_keys.pk_condition(1, 'o')}",
+                    pk
                 )
 
                 self.conn.commit()
@@ -168,110 +413,237 @@ class Buyer(db_conn.DBConn):
 
         except Exception as e:
             self.conn.rollback()
+            if db_conn.is_retryable(e):
+                raise
             logging.error(f"Failed to reduce order item: {str(e)}")
             return 530, f"Internal error: {str(e)}"
         
+    @db_conn.writes()
+    @db_conn.transactional()
     def payment(self, user_id: str, password: str, order_id: str) -> Tuple[int, str]:
         try:
-            with self.conn.cursor() as cursor:
-                # 获取订单信息并加锁
-                cursor.execute(
-                    "SELECT user_id, store_id, order_status FROM orders WHERE order_id = %s FOR UPDATE",
-                    (order_id,)
-                )
-                order = cursor.fetchone()
-                if not order:
-                    return error.error_invalid_order_id(order_id)
+            if conf.Payment_Engine == "procedure":
+                result = self._pay_with_procedure(user_id, password, order_id)
+                if result is not None:
+                    return result
 
-                buyer_id, store_id, status = order
+            # 获取订单信息并按主键加锁
+            pk = self.fetch_prepared(order_keys.FIND_ORDER_PK, (order_id,))
+            order = self.fetch_prepared(_LOCK_ORDER, pk[0]) if pk else None
+            if not order:
+                return error.error_invalid_order_id(order_id)
 
-                if buyer_id != user_id:
-                    return error.error_authorization_fail()
-                if status != 'unpaid':
-                    return error.error_order_status(order_id)
+            order_key = pk[0][0]
+            buyer_id, store_id, status = order[0]
 
-                # 新增：从 order_details 重新计算总价
-                cursor.execute(
-                    "SELECT SUM(quantity * unit_price) FROM order_details WHERE order_id = %s",
-                    (order_id,)
-                )
-                calculated_total = cursor.fetchone()[0]
+            if buyer_id != user_id:
+                return error.error_authorization_fail()
+            if status != 'unpaid':
+                return error.error_order_status(order_id)
 
-                if calculated_total is None:
-                    calculated_total = Decimal('0.00')
+            # 新增：从 order_details 重新计算总价
+            calculated_total = self.fetch_prepared(_SUM_ORDER_DETAILS, (order_key,))[0][0]
 
-                # 获取买家账户信息
-                cursor.execute(
-                    "SELECT balance, password_hash FROM users WHERE user_id = %s FOR UPDATE",
-                    (buyer_id,)
-                )
-                user = cursor.fetchone()
-                if not user:
-                    return error.error_non_exist_user_id(buyer_id)
+            if calculated_total is None:
+                calculated_total = Decimal('0.00')
 
-                balance, pwd = user
-                if password != pwd:
-                    return error.error_authorization_fail()
+            # 获取买家账户信息
+            user = self.fetch_prepared(_LOCK_BUYER, (buyer_id,))
+            if not user:
+                return error.error_non_exist_user_id(buyer_id)
 
-                # 获取卖家账户
-                cursor.execute(
-                    "SELECT user_id FROM stores WHERE store_id = %s",
-                    (store_id,)
-                )
-                seller = cursor.fetchone()
-                if not seller:
-                    return error.error_non_exist_store_id(store_id)
-                seller_id = seller[0]
+            balance, pwd = user[0]
+            if password != pwd:
+                return error.error_authorization_fail()
 
-                # 判断余额是否足够
-                if balance < calculated_total:
-                    return error.error_not_sufficient_funds(order_id)
+            # 获取卖家账户
+            seller = self.fetch_prepared(_FIND_STORE_OWNER, (store_id,))
+            if not seller:
+                return error.error_non_exist_store_id(store_id)
+            seller_id = seller[0][0]
 
-                # 扣款和付款
-                cursor.execute(
-                    "UPDATE users SET balance = balance - %s WHERE user_id = %s AND balance >= %s",
-                    (calculated_total, buyer_id, calculated_total)
-                )
-                if cursor.rowcount == 0:
-                    return error.error_not_sufficient_funds(order_id)
+            # 判断余额是否足够
+            if balance < calculated_total:
+                return error.error_not_sufficient_funds(order_id)
 
-                cursor.execute(
-                    "UPDATE users SET balance = balance + %s WHERE user_id = %s",
-                    (calculated_total, seller_id)
-                )
+            # 扣款和付款
+            if self.execute_prepared(_DEBIT_BUYER, (calculated_total, buyer_id, calculated_total)) == 0:
+                return error.error_not_sufficient_funds(order_id)
 
-                # 更新订单状态为已支付
-                cursor.execute(
-                    "UPDATE orders SET order_status = 'paid', total_amount = %s WHERE order_id = %s",
-                    (calculated_total, order_id)
-                )
+            # 卖家收入写入账本，由后台合并，避免热门店铺的支付在卖家行上排队
+            self.execute_prepared(ledger.INSERT_CREDIT, (seller_id, order_id, calculated_total))
 
-                # 减少库存
-                cursor.execute(
-                    "UPDATE store_inventory s "
-                    "JOIN order_details d ON s.book_id = d.book_id AND s.store_id = %s "
-                    "SET s.stock_quantity = s.stock_quantity - d.quantity "
-                    "WHERE d.order_id = %s",
-                    (store_id, order_id)
-                )
+            # 更新订单状态为已支付
+            self.execute_prepared(_MARK_ORDER_PAID, (calculated_total, *pk[0]))
 
-                self.conn.commit()
-                return 200, "ok"
+            # 预留的库存转为售出，库存已在下单时扣减
+            self.execute_prepared(_SELL_RESERVATIONS, (order_id,))
+
+            self.conn.commit()
+            return 200, "ok"
 
         except Exception as e:
             self.conn.rollback()
+            if db_conn.is_retryable(e):
+                raise
             logging.error(f"Payment failed: {str(e)}")
             return 530, f"Internal error: {str(e)}"
 
-    def cancel_order(self, user_id: str, order_id: str) -> Tuple[int, str]:
+    @db_conn.writes()
+    @db_conn.transactional([])
+    def batch_payment(self, user_id: str, password: str, order_ids: List[str]) -> Tuple[int, str, list]:
+        """Pay several orders of one buyer in a single transaction.
+
+        Orders are checked like payment() does and paid in request order
+        while the balance lasts; the buyer row is locked and debited once.
+        Returns one {"order_id", "code", "message"} entry per order.
+        """
         try:
+            order_ids = list(dict.fromkeys(order_ids))
+            if not order_ids:
+                return 200, "ok", []
+            results = {}
+
             with self.conn.cursor() as cursor:
+                # 按主键加锁，按 order_key 排序与并发的批量支付保持一致
+                pks = order_keys.primary_keys(cursor, order_ids)
+                orders = {}
+                if pks:
+                    cursor.execute(
+                        "SELECT order_id, order_key, user_id, store_id, order_status FROM orders "
+                        f"WHERE {order_keys.pk_condition(len(pks))} ORDER BY order_key FOR UPDATE",
+                        [value for pk in pks.values() for value in pk]
+                    )
+                    orders = {row[0]: row[1:] for row in cursor.fetchall()}
+                order_ids_by_key = {row[0]: order_id for order_id, row in orders.items()}
+
+                for order_id in order_ids:
+                    if order_id not in orders:
+                        results[order_id] = error.error_invalid_order_id(order_id)
+                        continue
+                    _, buyer_id, store_id, status = orders[order_id]
+                    if buyer_id != user_id:
+                        results[order_id] = error.error_authorization_fail()
+                    elif status != 'unpaid':
+                        results[order_id] = error.error_order_status(order_id)
+                payable = [order_id for order_id in order_ids if order_id not in results]
+
+                totals, sellers = {}, {}
+                if payable:
+                    placeholders = ", ".join(["%s"] * len(payable))
+                    cursor.execute(
+                        "SELECT order_key, SUM(quantity * unit_price) FROM order_details "
+                        f"WHERE order_key IN ({placeholders}) GROUP BY order_key",
+                        tuple(orders[order_id][0] for order_id in payable)
+                    )
+                    totals = {order_ids_by_key[order_key]: total for order_key, total in cursor.fetchall()}
+
+                    store_ids = sorted({orders[order_id][2] for order_id in payable})
+                    cursor.execute(
+                        "SELECT store_id, user_id FROM stores WHERE store_id IN ({})".format(
+                            ", ".join(["%s"] * len(store_ids))),
+                        tuple(store_ids)
+                    )
+                    sellers = dict(cursor.fetchall())
+
+                user = self.fetch_prepared(_LOCK_BUYER, (user_id,))
+                if not user:
+                    return error.error_non_exist_user_id(user_id) + ([],)
+                balance, pwd = user[0]
+                if password != pwd:
+                    return error.error_authorization_fail() + ([],)
+
+                paid = []
+                for order_id in payable:
+                    store_id = orders[order_id][2]
+                    total = totals.get(order_id) or Decimal('0.00')
+                    if store_id not in sellers:
+                        results[order_id] = error.error_non_exist_store_id(store_id)
+                    elif balance < total:
+                        results[order_id] = error.error_not_sufficient_funds(order_id)
+                    else:
+                        balance -= total
+                        paid.append((order_id, sellers[store_id], total))
+                        results[order_id] = (200, "ok")
+
+                if paid:
+                    debit = sum(total for _, _, total in paid)
+                    if self.execute_prepared(_DEBIT_BUYER, (debit, user_id, debit)) == 0 and debit:
+                        self.conn.rollback()
+                        return error.error_not_sufficient_funds(paid[0][0]) + ([],)
+
+                    cursor.execute(
+                        "INSERT INTO seller_credits (seller_id, order_id, amount) VALUES "
+                        + ", ".join(["(%s, %s, %s)"] * len(paid)),
+                        [value for order_id, seller_id, total in paid
+                         for value in (seller_id, order_id, total)]
+                    )
+
+                    placeholders = ", ".join(["%s"] * len(paid))
+                    paid_ids = tuple(order_id for order_id, _, _ in paid)
+                    cursor.execute(
+                        "UPDATE orders o SET order_status = 'paid', total_amount = ("
+                        "   SELECT COALESCE(SUM(quantity * unit_price), 0) "
+                        "   FROM order_details d WHERE d.order_key = o.order_key"
+                        f") WHERE {order_keys.pk_condition(len(paid_ids), 'o')}",
+                        [value for order_id in paid_ids for value in pks[order_id]]
+                    )
+                    cursor.execute(
+                        "UPDATE stock_reservations SET status = 'sold' "
+                        f"WHERE order_id IN ({placeholders}) AND status = 'held'",
+                        paid_ids
+                    )
+
+                self.conn.commit()
+
+            return 200, "ok", [
+                {"order_id": order_id, "code": results[order_id][0], "message": results[order_id][1]}
+                for order_id in order_ids
+            ]
+
+        except Exception as e:
+            self.conn.rollback()
+            if db_conn.is_retryable(e):
+                raise
+            logging.error(f"Batch payment failed: {str(e)}")
+            return 530, f"Internal error: {str(e)}", []
+
+    def _pay_with_procedure(self, user_id: str, password: str, order_id: str):
+        """Run payment through the pay_order procedure, None if it is not installed."""
+        with self.conn.cursor() as cursor:
+            try:
                 cursor.execute(
-                    "SELECT user_id, store_id, order_status "
-                    "FROM orders WHERE order_id = %s FOR UPDATE",
-                    (order_id,)
+                    "CALL pay_order(%s, %s, %s, @pay_order_code, @pay_order_store)",
+                    (user_id, password, order_id)
                 )
-                order = cursor.fetchone()
+            except mysql.connector.Error as e:
+                if e.errno != 1305:  # ER_SP_DOES_NOT_EXIST
+                    raise
+                logging.warning("pay_order procedure missing, falling back to python payment")
+                return None
+            cursor.execute("SELECT @pay_order_code, @pay_order_store")
+            code, store_id = cursor.fetchone()
+
+        if code == 200:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        return _pay_order_result(code, user_id, order_id, store_id)
+
+    @db_conn.writes()
+    @db_conn.transactional()
+    def cancel_order(self, user_id: str, order_id: str) -> Tuple[int, str]:
+        try:
+            with self.conn.cursor() as cursor:
+                pk = order_keys.primary_keys(cursor, [order_id]).get(order_id)
+                order = None
+                if pk is not None:
+                    cursor.execute(
+                        "SELECT user_id, store_id, order_status "
+                        f"FROM orders WHERE {order_keys.PK_CONDITION} FOR UPDATE",
+                        pk
+                    )
+                    order = cursor.fetchone()
                 if not order:
                     return error.error_invalid_order_id(order_id)
                 
@@ -282,23 +654,13 @@ class Buyer(db_conn.DBConn):
                 if status != 'unpaid':
                     return error.error_order_status(order_id)
                 
-                cursor.execute(
-                    "SELECT book_id, quantity FROM order_details WHERE order_id = %s",
-                    (order_id,)
-                )
-                details = cursor.fetchall()
-                
-                for book_id, count in details:
-                    cursor.execute(
-                        "UPDATE store_inventory SET stock_quantity = stock_quantity + %s "
-                        "WHERE store_id = %s AND book_id = %s",
-                        (count, store_id, book_id)
-                    )
+                released = release_reservations(cursor, [order_id])
+                self.conn.after_commit(inventory_cache.invalidate, released)
                 
                 cursor.execute(
                     "UPDATE orders SET order_status = 'cancelled' "
-                    "WHERE order_id = %s",
-                    (order_id,)
+                    f"WHERE {order_keys.PK_CONDITION}",
+                    pk
                 )
                 
                 self.conn.commit()
@@ -306,8 +668,11 @@ class Buyer(db_conn.DBConn):
                 
         except Exception as e:
             self.conn.rollback()
+            if db_conn.is_retryable(e):
+                raise
             return 530, f"Internal error: {str(e)}"
 
+    @db_conn.writes()
     def add_funds(self, user_id: str, password: str, add_value: float) -> Tuple[int, str]:
         try:
             with self.conn.cursor() as cursor:
@@ -339,14 +704,18 @@ class Buyer(db_conn.DBConn):
             logging.error(f"Error in add_funds: {str(e)}", exc_info=True)
             return 530, f"Internal error: {str(e)}"
         
+    @db_conn.writes()
     def receive_order(self, user_id: str, order_id: str) -> Tuple[int, str]:
             try:
                 with self.conn.cursor() as cursor:
-                    cursor.execute(
-                        "SELECT user_id, order_status FROM orders WHERE order_id = %s FOR UPDATE",
-                        (order_id,)
-                    )
-                    order = cursor.fetchone()
+                    pk = order_keys.primary_keys(cursor, [order_id]).get(order_id)
+                    order = None
+                    if pk is not None:
+                        cursor.execute(
+                            f"SELECT user_id, order_status FROM orders WHERE {order_keys.PK_CONDITION} FOR UPDATE",
+                            pk
+                        )
+                        order = cursor.fetchone()
                     if not order:
                         return error.error_invalid_order_id(order_id)
                     
@@ -359,8 +728,8 @@ class Buyer(db_conn.DBConn):
                     
                     cursor.execute(
                         "UPDATE orders SET order_status = 'completed', receive_time = CURRENT_TIMESTAMP "
-                        "WHERE order_id = %s",
-                        (order_id,)
+                        f"WHERE {order_keys.PK_CONDITION}",
+                        pk
                     )
                     
                     self.conn.commit()
@@ -370,12 +739,16 @@ class Buyer(db_conn.DBConn):
                 self.conn.rollback()
                 return 530, f"Internal error: {str(e)}"
 
+    @db_conn.read_only()
     def get_order_status(self, user_id: str, order_id: str) -> Tuple[int, str, str]:
         try:
             with self.conn.cursor() as cursor:
+                # 已归档的订单从 orders_archive 中读取
                 cursor.execute(
-                    "SELECT user_id, order_status FROM orders WHERE order_id = %s",
-                    (order_id,)
+                    "SELECT user_id, order_status FROM orders WHERE order_id = %s "
+                    "UNION ALL "
+                    "SELECT user_id, order_status FROM orders_archive WHERE order_id = %s",
+                    (order_id, order_id)
                 )
                 order = cursor.fetchone()
                 
@@ -395,31 +768,47 @@ class Buyer(db_conn.DBConn):
 
 
 
+    @db_conn.read_only()
     def get_order_history(self, user_id: str) -> Tuple[int, str, list]:
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id) + ([],)
+            code, message = self.check_preconditions(user_id, store_exists=None)
+            if code != 200:
+                return code, message, []
                 
             with self.conn.cursor(dictionary=True) as cursor:
 
+                # 近期订单在 orders，较早的已完成 / 已取消订单在 orders_archive
                 cursor.execute(
-                    "SELECT order_id, store_id, order_status, create_time, total_amount "
-                    "FROM orders WHERE user_id = %s ORDER BY create_time DESC",
-                    (user_id,)
+                    "SELECT order_key, order_id, store_id, order_status, create_time, total_amount, 0 AS archived "
+                    "FROM orders WHERE user_id = %s "
+                    "UNION ALL "
+                    "SELECT order_key, order_id, store_id, order_status, create_time, total_amount, 1 "
+                    "FROM orders_archive WHERE user_id = %s "
+                    "ORDER BY create_time DESC",
+                    (user_id, user_id)
                 )
-                orders = []
-                
-                for order in cursor.fetchall():
-                    order_id = order['order_id']
-                    
+                rows = cursor.fetchall()
+
+                details = {}
+                for archived, table in ((0, "order_details"), (1, "order_details_archive")):
+                    keys = [order['order_key'] for order in rows if order['archived'] == archived]
+                    if not keys:
+                        continue
+                    placeholders = ", ".join(["%s"] * len(keys))
                     cursor.execute(
-                        "SELECT book_id, quantity, unit_price "
-                        "FROM order_details WHERE order_id = %s",
-                        (order_id,)
+                        "SELECT order_key, book_id, quantity, unit_price "
+                        f"FROM {table} WHERE order_key IN ({placeholders})",
+                        tuple(keys)
                     )
+                    for detail in cursor.fetchall():
+                        details.setdefault(detail['order_key'], []).append(detail)
+
+                orders = []
+                for order in rows:
+                    order_id = order['order_id']
                     items = []
                     
-                    for detail in cursor.fetchall():
+                    for detail in details.get(order['order_key'], []):
                         unit_price = float(detail['unit_price']) if isinstance(detail['unit_price'], Decimal) else detail['unit_price']
                         quantity = detail['quantity']
                         items.append({
@@ -447,21 +836,54 @@ class Buyer(db_conn.DBConn):
             return 530, f"Internal error: {str(e)}", []
 
 
+    @db_conn.read_only()
     def search_books(self, user_id: str, query: str, search_field: str = 'all',
-                    store_id: str = None, page: int = 1, per_page: int = 10) -> Tuple[int, str, Dict]:
+                    store_id: str = None, page: int = 1, per_page: int = 10,
+                    cursor: str = None, count: str = 'exact') -> Tuple[int, str, Dict]:
+        """Search books ordered by relevance, then store_id and book_id.
+
+        Pass the next_cursor of a result as cursor to get the following
+        rows without scanning the skipped ones; page (OFFSET) is kept for
+        older clients.
+
+        count selects how total is produced: "exact", "approx" (stops at
+        conf.Search_Count_Cap and reports total_exact=False) or "none".
+        Totals are cached per search, so later pages do not count again.
+        """
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id) + (None,)
-            if store_id and not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id) + (None,)
-
+            code, message = self.check_preconditions(
+                user_id, store_id, store_exists=True if store_id else None)
+            if code != 200:
+                return code, message, None
+
+            if count not in COUNT_MODES:
+                return 400, f"Invalid count: {count}", None
+            fingerprint = _search_fingerprint(query, search_field, store_id)
+            after = None
+            if cursor:
+                after = decode_search_cursor(cursor, fingerprint)
+                if after is None:
+                    return 400, "Invalid cursor", None
             offset = (page - 1) * per_page
 
-            with self.conn.cursor(dictionary=True) as cursor:
-                base_query = """
+            # 排序键：相关度（非全文检索时为 0），再按 store_id、book_id 保证顺序稳定
+            if search_field == 'all':
+                score_sql = ("MATCH(b.title, b.author, b.publisher, b.book_intro, b.content) "
+                             "AGAINST (%s IN NATURAL LANGUAGE MODE)")
+                score_params = [query]
+            elif search_field in ('author', 'book_intro', 'content'):
+                score_sql = f"MATCH(b.{search_field}) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+                score_params = [query]
+            else:
+                score_sql, score_params = "0", []
+
+            with self.conn.cursor(dictionary=True) as db_cursor:
+                select = f"""
                     SELECT si.store_id, si.book_id, b.title, b.author, b.publisher, 
                         si.book_price AS price, si.stock_quantity AS stock,
-                        GROUP_CONCAT(t.name) AS tags
+                        GROUP_CONCAT(t.name) AS tags, MAX({score_sql}) AS score
+                """
+                base_query = """
                     FROM store_inventory si
                     JOIN books b ON si.book_id = b.id
                     LEFT JOIN book_tags bt ON bt.book_id = b.id
@@ -514,25 +936,61 @@ class Buyer(db_conn.DBConn):
                         params.append(query)
 
 
-                if where_clauses:
-                    base_query += " WHERE " + " AND ".join(where_clauses)
-
-                base_query += """
+                group_by = """
                     GROUP BY si.store_id, si.book_id, b.title, b.author, b.publisher, si.book_price, si.stock_quantity
                 """
 
-                # 查询总数
-                count_query = f"SELECT COUNT(*) AS total FROM ({base_query}) AS subquery"
-                cursor.execute(count_query, params)
-                total = cursor.fetchone()['total']
+                count_query = "SELECT si.store_id " + base_query
+                if where_clauses:
+                    count_query += " WHERE " + " AND ".join(where_clauses)
+                count_query += group_by
+                count_params = list(params)
+
+                if after is not None:
+                    # 从上一页最后一行之后继续，不再扫描并丢弃前面的行
+                    where_clauses.append(
+                        f"(({score_sql}) < %s OR (({score_sql}) = %s AND (si.store_id, si.book_id) > (%s, %s)))")
+                    params.extend(score_params + [after[0]] + score_params + list(after))
+                if where_clauses:
+                    base_query += " WHERE " + " AND ".join(where_clauses)
 
-                # 添加分页限制
-                base_query += " LIMIT %s OFFSET %s"
-                params.extend([per_page, offset])
-                cursor.execute(base_query, params)
+                # 多取一行判断是否还有下一页
+                page_query = select + base_query + group_by + \
+                    " ORDER BY score DESC, si.store_id, si.book_id LIMIT %s"
+                page_params = score_params + params + [per_page + 1]
+                if after is None:
+                    page_query += " OFFSET %s"
+                    page_params.append(offset)
+                db_cursor.execute(page_query, page_params)
+                rows = db_cursor.fetchall()
+
+                next_cursor = None
+                has_more = len(rows) > per_page
+                if has_more:
+                    rows = rows[:per_page]
+                    last = rows[-1]
+                    next_cursor = encode_search_cursor(
+                        fingerprint, float(last['score'] or 0), last['store_id'], last['book_id'])
+
+                total, total_exact = None, None
+                if count == 'none':
+                    search_counts.count("skipped")
+                elif after is None and not has_more and (rows or offset == 0):
+                    # 最后一页已经给出了总数，不必再查
+                    total, total_exact = offset + len(rows), True
+                    search_counts.count("from_page")
+                    search_counts.put(fingerprint, (total, True))
+                else:
+                    cached = search_counts.get(fingerprint)
+                    if cached is not None and (cached[1] or count == 'approx'):
+                        total, total_exact = cached
+                    else:
+                        total, total_exact = self._count_search(
+                            db_cursor, count_query, count_params, count == 'approx')
+                        search_counts.put(fingerprint, (total, total_exact))
 
                 books = []
-                for row in cursor.fetchall():
+                for row in rows:
                     tags_str = row.get('tags')
                     tags_list = tags_str.split(',') if tags_str else []
 
@@ -550,127 +1008,396 @@ class Buyer(db_conn.DBConn):
                 return 200, "ok", {
                     "books": books,
                     "total": total,
-                    "page": page,
+                    "total_exact": total_exact,
+                    "page": page if after is None else None,
                     "per_page": per_page,
-                    "total_pages": max(1, (total + per_page - 1) // per_page)
+                    "total_pages": None if total is None else max(1, (total + per_page - 1) // per_page),
+                    "next_cursor": next_cursor
                 }
 
         except Exception as e:
             logging.error(f"Search error: {str(e)}", exc_info=True)
             return 500, f"Internal error: {str(e)}", None
+
+    @staticmethod
+    def _count_search(cursor, count_query: str, params: list, approx: bool) -> Tuple[int, bool]:
+        """Return (total, exact); approx stops counting past conf.Search_Count_Cap."""
+        if not approx:
+            cursor.execute(f"SELECT COUNT(*) AS total FROM ({count_query}) AS subquery", params)
+            search_counts.count("counted")
+            return cursor.fetchone()['total'], True
+        cap = conf.Search_Count_Cap
+        cursor.execute(
+            f"SELECT COUNT(*) AS total FROM ({count_query} LIMIT %s) AS subquery", params + [cap + 1])
+        total = cursor.fetchone()['total']
+        if total > cap:
+            search_counts.count("capped")
+            return cap, False
+        search_counts.count("counted")
+        return total, True
  
-class OrderCleaner(threading.Thread):
-    def __init__(self, interval_seconds=30):
-        super().__init__()
-        self.interval_seconds = interval_seconds
+class CommitOutcomeUnknown(Exception):
+    """COMMIT was sent but failed; the transaction may or may not have committed."""
+
+
+class OrderWriter(threading.Thread):
+    """Group commit for new_order.
+
+    Requests arriving within window_ms (up to max_batch of them) are
+    written in one transaction, each under its own savepoint so a failed
+    order is rolled back alone, and share a single commit. If the batch
+    fails before COMMIT, or the COMMIT fails with a deadlock or lock wait
+    timeout, the batch is known to be rolled back and every request is
+    retried on its own through Buyer.new_order_now. Any other COMMIT
+    failure leaves the outcome unknown; retrying could write the orders
+    twice, so those requests get error 521 instead.
+    """
+
+    def __init__(self, window_ms=None, max_batch=None):
+        super().__init__(name="OrderWriter")
+        self.window = (window_ms or conf.Group_Commit_Window_Ms) / 1000
+        self.max_batch = max_batch or conf.Group_Commit_Max_Batch
         self.daemon = True
-        self.timeout_seconds = 10  # 订单超时时间（秒）
         self.running = True
-        logging.info(f"OrderCleaner initialized with {self.timeout_seconds}s timeout")
-
-    def stop(self):
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.orders = 0
+        self.fallbacks = 0
+        self.unknown_outcomes = 0
+
+    def stop(self, timeout=None):
+        """Stop batching; requests already queued are still written."""
         self.running = False
+        if self.is_alive():
+            self.join(timeout if timeout is not None else conf.Group_Commit_Timeout)
+
+    def submit(self, user_id: str, store_id: str, id_and_count) -> Tuple[int, str, str]:
+        if not self.running:
+            return self._write_one(user_id, store_id, id_and_count)
+        future = Future()
+        self.queue.put((user_id, store_id, id_and_count, future))
+        try:
+            return future.result(timeout=conf.Group_Commit_Timeout)
+        except FutureTimeout:
+            # 还没进入批次的请求可以撤回，之后就不能确定订单是否已写入
+            if future.cancel():
+                return 530, "Internal error: order writer timed out", ""
+            return error.error_order_outcome_unknown() + ("",)
+        except Exception as e:
+            logging.error(f"[OrderWriter] order write failed: {str(e)}")
+            return error.error_order_outcome_unknown() + ("",)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "orders": self.orders,
+            "avg_batch": self.orders / self.batches if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+            "unknown_outcomes": self.unknown_outcomes,
+            "queued": self.queue.qsize(),
+        }
 
     def run(self):
-        logging.info("OrderCleaner thread started")
-        while self.running:
+        logging.info("OrderWriter thread started")
+        while self.running or not self.queue.empty():
+            batch = []
             try:
-                db = db_conn.DBConn()
-                conn = db.conn
-                cursor = conn.cursor()
-
-                # 计算超时时间点（UTC时间）
-                timeout_threshold = datetime.now(timezone.utc) - timedelta(seconds=self.timeout_seconds)
-                
-                # 将时间阈值转换为字符串以便记录
-                logging.info(f"[OrderCleaner] Checking orders before {timeout_threshold} (UTC)")
-
-                # 查询需要取消的超时订单
-                cursor.execute("""
-                    SELECT order_id, store_id, create_time 
-                    FROM orders 
-                    WHERE order_status = 'unpaid' 
-                    AND create_time <= %s
-                """, (timeout_threshold,))
-                orders_to_cancel = cursor.fetchall()
-
-                if not orders_to_cancel:
-                    logging.info("[OrderCleaner] No unpaid orders to cancel")
-                    time.sleep(self.interval_seconds)
-                    continue
-
-                logging.info(f"[OrderCleaner] Found {len(orders_to_cancel)} orders to cancel")
-
-                for order in orders_to_cancel:
-                    order_id, store_id, create_time = order
-                    try:
-                        # 记录一下这个订单的创建时间和当前时间，用于调试
-                        now_utc = datetime.now(timezone.utc)
-                        logging.info(f"[OrderCleaner] Processing order {order_id}, created at {create_time} (UTC), now is {now_utc} (UTC)")
-                        
-                        # 恢复库存
-                        cursor.execute("""
-                            SELECT od.book_id, od.quantity
-                            FROM order_details od
-                            WHERE od.order_id = %s
-                        """, (order_id,))
-                        items = cursor.fetchall()
-                        
-                        for book_id, quantity in items:
-                            cursor.execute("""
-                                UPDATE store_inventory 
-                                SET stock_quantity = stock_quantity + %s 
-                                WHERE store_id = %s AND book_id = %s
-                            """, (quantity, store_id, book_id))
-                        
-                        # 更新订单状态
-                        cursor.execute("""
-                            UPDATE orders 
-                            SET order_status = 'cancelled' 
-                            WHERE order_id = %s
-                        """, (order_id,))
-                        
-                        conn.commit()
-                        logging.info(f"[OrderCleaner] Successfully cancelled order {order_id}")
-
-                    except Exception as e:
-                        conn.rollback()
-                        logging.error(f"[OrderCleaner] Failed to cancel order {order_id}: {str(e)}", exc_info=True)
-
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
             except Exception as e:
-                logging.error(f"[OrderCleaner] Critical error: {str(e)}", exc_info=True)
+                # 线程退出后所有下单请求都会超时，这里只记录错误
+                logging.error(f"[OrderWriter] batch of {len(batch)} failed: {str(e)}", exc_info=True)
             finally:
-                time.sleep(self.interval_seconds)
+                for request in batch:
+                    if not request[3].done():
+                        request[3].set_exception(RuntimeError("order writer failed"))
+        logging.info("OrderWriter thread stopped")
+
+    def _next_batch(self) -> list:
+        """Requests arriving within the window; cancelled ones are dropped."""
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch:
+            if deadline is None:
+                timeout = 0.5
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            # 标记为执行中后 submit() 就不能再撤回该请求
+            if request[3].set_running_or_notify_cancel():
+                batch.append(request)
+                if deadline is None:
+                    deadline = time.monotonic() + self.window
+        return batch
+
+    def _write(self, batch):
+        try:
+            results = self._write_batch(batch)
+        except CommitOutcomeUnknown as e:
+            logging.error(f"[OrderWriter] commit of {len(batch)} orders failed, outcome unknown: {str(e)}")
+            self.unknown_outcomes += len(batch)
+            results = [error.error_order_outcome_unknown() + ("",)] * len(batch)
+        except Exception as e:
+            logging.warning(f"[OrderWriter] batch of {len(batch)} failed, writing one by one: {str(e)}")
+            self.fallbacks += 1
+            results = [self._write_one(*request[:3]) for request in batch]
+        self.batches += 1
+        self.orders += len(batch)
+        for request, result in zip(batch, results):
+            request[3].set_result(result)
+
+    @staticmethod
+    def _write_batch(batch) -> list:
+        buyer = Buyer()
+        try:
+            results = []
+            with buyer.conn.cursor() as cursor:
+                for i, (user_id, store_id, id_and_count, _) in enumerate(batch):
+                    savepoint = f"order_{i}"
+                    cursor.execute(f"SAVEPOINT {savepoint}")
+                    undo = functools.partial(cursor.execute, f"ROLLBACK TO SAVEPOINT {savepoint}")
+                    try:
+                        result = buyer._place_order(user_id, store_id, id_and_count, undo)
+                    except mysql.connector.Error as e:
+                        # 死锁会回滚整个事务，保存点随之失效，只能整批重做
+                        if db_conn.is_retryable(e):
+                            raise
+                        logging.error(f"Failed to create or update order: {str(e)}", exc_info=True)
+                        result = (530, f"Internal error: {str(e)}", "")
+                    if result[0] != 200:
+                        undo()
+                    cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+                    results.append(result)
+            try:
+                buyer.conn.commit()
+            except Exception as e:
+                # 死锁或锁等待超时时服务器已回滚整个事务，可以逐个重做；
+                # 其他错误（如连接中断）时 COMMIT 可能已经生效，重做会重复下单
+                if db_conn.is_retryable(e):
+                    raise
+                raise CommitOutcomeUnknown(str(e)) from e
+            return results
+        except Exception:
+            try:
+                buyer.conn.rollback()
+            except Exception as e:
+                # 连接已断开时服务器会回滚未提交的事务
+                logging.error(f"[OrderWriter] rollback failed: {str(e)}")
+            raise
+        finally:
+            buyer.close()
+
+    @staticmethod
+    def _write_one(user_id, store_id, id_and_count) -> Tuple[int, str, str]:
+        buyer = Buyer()
+        try:
+            return buyer.new_order_now(user_id, store_id, id_and_count)
+        except Exception as e:
+            # 如借不到连接或回滚失败，new_order_now 来不及提交
+            logging.error(f"[OrderWriter] order write failed: {str(e)}", exc_info=True)
+            return 530, f"Internal error: {str(e)}", ""
+        finally:
+            buyer.close()
 
-        logging.info("OrderCleaner thread stopped")
 
-AUTO_CANCEL_SECONDS = 20
+order_writer = None
 
-def auto_cancel_unpaid_orders():
-    def cancel_loop():
-        while True:
-            try:
-                conn = get_db_conn()
-                cursor = conn.cursor()
-
-                time_threshold = datetime.now() - timedelta(seconds=AUTO_CANCEL_SECONDS)
-                time_str = time_threshold.strftime("%Y-%m-%d %H:%M:%S")
-                print(f"[DEBUG] Cancelling orders before {time_str}")
-
-                sql = """
-                    UPDATE orders
-                    SET order_status = 'cancelled'
-                    WHERE order_status = 'unpaid'
-                      AND create_time < %s
-                """
-                cursor.execute(sql, (time_str,))
-                conn.commit()
-                cursor.close()
-                conn.close()
-            except Exception as e:
-                print(f"[auto_cancel_unpaid_orders] Error: {e}")
 
-            time.sleep(5)
+def start_order_writer() -> OrderWriter:
+    global order_writer
+    writer = OrderWriter()
+    writer.start()
+    order_writer = writer
+    return writer
+
+
+class OrderExpiry:
+    """Cancels unpaid orders when their payment deadline passes.
+
+    Deadlines (create_time + conf.Unpaid_Order_Timeout) are kept in a heap
+    in monotonic time. run() is the body of the JOB deadline job in
+    be.jobs: on its first run and every conf.Expiry_Resync_Interval
+    seconds it bulk-cancels whatever has already expired (after an outage
+    that can be a large backlog) and loads the remaining deadlines, which
+    also picks up orders placed through other backend processes; every
+    run then cancels what is due in batches of conf.Expiry_Batch_Size.
+    new_order adds its own orders as they commit and wakes the job when
+    the new deadline comes first.
 
-    thread = threading.Thread(target=cancel_loop, daemon=True)
-    thread.start()
+    With several backend processes only the leader of JOB keeps deadlines;
+    standby() drops them on the others, whose new orders are left to the
+    leader's next resync.
+    """
+
+    JOB = "order_expiry"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._scheduled = set()
+        self._next_resync = 0.0
+        self.batches = 0
+        self.cancelled = 0
+        self.skipped = 0
+        self.swept = 0
+        self.failures = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.last_resync = None
+
+    def job(self) -> jobs.Job:
+        return jobs.Job(self.JOB, self.run, conf.Expiry_Resync_Interval,
+                        next_delay=self.next_delay, on_standby=self.standby)
+
+    def schedule(self, order_id: str, delay: float):
+        """Cancel order_id in delay seconds unless it is paid or cancelled first."""
+        if not leader.is_leader(self.JOB):
+            return
+        deadline = time.monotonic() + max(0.0, delay)
+        with self._lock:
+            if order_id in self._scheduled:
+                return
+            self._scheduled.add(order_id)
+            heapq.heappush(self._heap, (deadline, order_id))
+            first = self._heap[0][1] == order_id
+        if first:
+            jobs.wake(self.JOB, delay)
+
+    def standby(self):
+        with self._lock:
+            self._heap, self._scheduled = [], set()
+            # 成为 leader 后第一次运行立即从数据库加载
+            self._next_resync = 0.0
+
+    def next_delay(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            delay = self._next_resync - now
+            if self._heap:
+                delay = min(delay, self._heap[0][0] - now)
+        return max(0.0, delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = len(self._heap)
+            next_due = self._heap[0][0] - time.monotonic() if self._heap else None
+        return {
+            "queued": queued,
+            "next_due_in": next_due,
+            "batches": self.batches,
+            "cancelled": self.cancelled,
+            "skipped": self.skipped,
+            "swept": self.swept,
+            "failures": self.failures,
+            "lag_avg": self.lag_total / self.cancelled if self.cancelled else 0.0,
+            "lag_max": self.lag_max,
+            "last_resync_ago": time.monotonic() - self.last_resync if self.last_resync else None,
+        }
+
+    def run(self) -> int:
+        """Resync if it is time, then cancel everything due; returns orders cancelled."""
+        cancelled = 0
+        if time.monotonic() >= self._next_resync:
+            cancelled += self._resync()
+            self._next_resync = time.monotonic() + conf.Expiry_Resync_Interval
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now and len(due) < conf.Expiry_Batch_Size:
+                    deadline, order_id = heapq.heappop(self._heap)
+                    self._scheduled.discard(order_id)
+                    due.append((deadline, order_id))
+            if not due:
+                return cancelled
+            cancelled += self._cancel(due)
+
+    def _resync(self) -> int:
+        db = db_conn.DBConn()
+        try:
+            swept = cancel_expired_orders(db.conn, conf.Expiry_Batch_Size)
+            with db.conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT order_id, TIMESTAMPDIFF(MICROSECOND, NOW(), create_time + INTERVAL %s SECOND) "
+                    "FROM orders WHERE order_status = 'unpaid'",
+                    (conf.Unpaid_Order_Timeout,)
+                )
+                rows = cursor.fetchall()
+            db.conn.commit()
+        except Exception:
+            db.conn.rollback()
+            raise
+        finally:
+            db.close()
+        for order_id, remaining in rows:
+            self.schedule(order_id, remaining / 1e6)
+        self.swept += swept
+        self.last_resync = time.monotonic()
+        return swept
+
+    def _cancel(self, due) -> int:
+        """Cancel the due orders that are still unpaid in one transaction."""
+        order_ids = [order_id for _, order_id in due]
+        db = db_conn.DBConn()
+        conn = db.conn
+        rows = []
+        try:
+            with conn.cursor() as cursor:
+                # 按主键加锁后复查状态与截止时间（以数据库时钟为准），已支付或已取消的订单跳过
+                pks = order_keys.primary_keys(cursor, order_ids)
+                if pks:
+                    cursor.execute(
+                        "SELECT order_id, TIMESTAMPDIFF(MICROSECOND, NOW(), create_time + INTERVAL %s SECOND) "
+                        f"FROM orders WHERE ({order_keys.pk_condition(len(pks))}) AND order_status = 'unpaid' "
+                        "FOR UPDATE",
+                        [conf.Unpaid_Order_Timeout] + [value for pk in pks.values() for value in pk]
+                    )
+                    rows = cursor.fetchall()
+                expired = {order_id: pks[order_id] for order_id, remaining in rows if remaining <= 0}
+                early = [(order_id, remaining / 1e6) for order_id, remaining in rows if remaining > 0]
+                conn.after_commit(inventory_cache.invalidate, cancel_unpaid_orders(cursor, expired))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self.failures += 1
+            logging.error(f"[OrderExpiry] failed to cancel {len(order_ids)} orders: {str(e)}")
+            for order_id in order_ids:
+                self.schedule(order_id, 1)
+            return 0
+        finally:
+            db.close()
+
+        now = time.monotonic()
+        deadlines = dict((order_id, deadline) for deadline, order_id in due)
+        for order_id in expired:
+            lag = now - deadlines[order_id]
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+        self.batches += 1
+        self.cancelled += len(expired)
+        self.skipped += len(order_ids) - len(rows)
+        # 本地时钟比数据库快时会提前醒来，按数据库给出的剩余时间重新排队
+        for order_id, remaining in early:
+            self.schedule(order_id, remaining)
+        return len(expired)
+
+
+order_expiry = None
+
+
+def create_order_expiry() -> OrderExpiry:
+    global order_expiry
+    order_expiry = OrderExpiry()
+    return order_expiry
+
+
+def schedule_order_expiry(order_id: str):
+    if order_expiry is not None:
+        order_expiry.schedule(order_id, conf.Unpaid_Order_Timeout)
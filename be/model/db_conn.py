@@ -1,32 +1,562 @@
+#!/usr/bin/env python3
+import collections
+import functools
+import inspect
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import mysql.connector
+from flask import g, has_app_context, has_request_context, request
+from be import conf
 from be.model import store
+from be.model import statements
+from be.model import error
+
+_USER_EXISTS = statements.register(
+    "user_exists", "SELECT 1 FROM users WHERE user_id = %s")
+_BOOK_EXISTS = statements.register(
+    "book_exists", "SELECT 1 FROM store_inventory WHERE store_id = %s AND book_id = %s")
+_STORE_EXISTS = statements.register(
+    "store_exists", "SELECT 1 FROM stores WHERE store_id = %s")
+_STORE_OWNER = statements.register(
+    "store_owner", "SELECT 1 FROM stores WHERE store_id = %s AND user_id = %s")
+_PRECONDITIONS = statements.register(
+    "preconditions",
+    "SELECT "
+    "EXISTS(SELECT 1 FROM users WHERE user_id = %s), "
+    "EXISTS(SELECT 1 FROM stores WHERE store_id = %s), "
+    "EXISTS(SELECT 1 FROM stores WHERE store_id = %s AND user_id = %s), "
+    "EXISTS(SELECT 1 FROM store_inventory WHERE store_id = %s AND book_id = %s)")
+
+
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"(\((?:%s, )*%s\))(?:, \((?:%s, )*%s\))+")
+
+
+def normalize_sql(sql) -> str:
+    """Collapse whitespace and variable-length parameter lists."""
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode("utf-8", "replace")
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _VALUES_LIST.sub(r"\1, ...", sql)
+
+
+def _calling_method() -> str:
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    code = frame.f_code
+    return getattr(code, "co_qualname", code.co_name)
+
+
+class SqlStats:
+    """Per normalized statement counters for everything run through DBConn."""
+
+    def __init__(self, samples=1000):
+        self._samples = samples
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, sql, params, seconds, rows=0):
+        key = normalize_sql(sql)
+        caller = _calling_method()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    "count": 0, "total": 0.0, "max": 0.0, "rows": 0,
+                    "samples": collections.deque(maxlen=self._samples),
+                    "callers": collections.Counter(),
+                }
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["rows"] += max(rows, 0)
+            entry["samples"].append(seconds)
+            entry["callers"][caller] += 1
+
+        if seconds * 1000 >= conf.Slow_Query_Ms:
+            shape = [type(p).__name__ for p in params] if params else []
+            endpoint = request.endpoint if has_request_context() else None
+            logging.warning(
+                f"[slow query] {seconds * 1000:.1f}ms in {caller} (endpoint {endpoint}): "
+                f"{key} params={shape}")
+        return key
+
+    def add_rows(self, key, rows):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["rows"] += rows
+
+    def snapshot(self) -> list:
+        with self._lock:
+            items = [(key, dict(entry, samples=sorted(entry["samples"]),
+                                callers=dict(entry["callers"])))
+                     for key, entry in self._entries.items()]
+        result = []
+        for key, entry in items:
+            samples = entry["samples"]
+            p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] if samples else 0.0
+            result.append({
+                "statement": key,
+                "count": entry["count"],
+                "total_ms": entry["total"] * 1000,
+                "avg_ms": entry["total"] * 1000 / entry["count"],
+                "p99_ms": p99 * 1000,
+                "max_ms": entry["max"] * 1000,
+                "rows": entry["rows"],
+                "callers": entry["callers"],
+            })
+        result.sort(key=lambda row: row["total_ms"], reverse=True)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+
+sql_stats = SqlStats()
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that times statements and counts fetched rows."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._key = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._cursor.close()
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            rowcount = self._cursor.rowcount if self._cursor.with_rows is False else 0
+            self._key = sql_stats.record(operation, params, time.perf_counter() - start, rowcount)
+
+    def executemany(self, operation, seq_params):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params)
+        finally:
+            self._key = sql_stats.record(
+                operation, None, time.perf_counter() - start, self._cursor.rowcount)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None and self._key:
+            sql_stats.add_rows(self._key, 1)
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._cursor.fetchmany(size)
+        if self._key:
+            sql_stats.add_rows(self._key, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        if self._key:
+            sql_stats.add_rows(self._key, len(rows))
+        return rows
+
+
+class _RequestConnection:
+    """Connection handed to model objects by a UnitOfWork.
+
+    Cursors are recorded so the unit of work can close them, and close()
+    is a no-op because the connection is released at the end of the unit.
+    Callbacks registered with after_commit() run once the current
+    transaction commits and are dropped if it rolls back.
+    """
+
+    def __init__(self, uow, conn):
+        self._uow = uow
+        self._conn = conn
+        self._after_commit = []
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        self._uow.cursors.append(cursor)
+        if conf.Sql_Stats_Enabled:
+            return InstrumentedCursor(cursor)
+        return cursor
+
+    def close(self):
+        pass
+
+    def after_commit(self, callback, *args):
+        self._after_commit.append((callback, args))
+
+    def commit(self):
+        self._conn.commit()
+        self.run_after_commit()
+
+    def rollback(self):
+        self._after_commit = []
+        self._conn.rollback()
+
+    def run_after_commit(self):
+        callbacks, self._after_commit = self._after_commit, []
+        for callback, args in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.error(f"[after_commit] {callback} failed: {e}")
+
+    @property
+    def pooled(self):
+        """The underlying pooled connection, bypassing cursor tracking."""
+        return self._conn
+
+
+class UnitOfWork:
+    """One pooled connection shared by every model call of a request.
+
+    The connection is borrowed lazily on first use and returned to the
+    pool by finish(), which commits or rolls back first. Work left
+    uncommitted is only kept if the request succeeded: finish() rolls
+    back after an exception or once failed is set for an error response.
+    Read-only model methods get a second, replica-routed connection on
+    the same terms.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._read_conn = None
+        self.cursors = []
+        self.failed = False
+
+    @property
+    def connection(self) -> _RequestConnection:
+        if self._conn is None:
+            self._conn = _RequestConnection(self, store.get_db_conn())
+        return self._conn
+
+    def read_connection(self, user_id=None) -> _RequestConnection:
+        # 本请求已在主库上工作时继续使用主库，保证读到自己的写入
+        if self._conn is not None:
+            return self._conn
+        if self._read_conn is None:
+            self._read_conn = _RequestConnection(
+                self, store.get_db_conn(read_only=True, user_id=user_id))
+        return self._read_conn
+
+    def finish(self, exc: BaseException = None):
+        for cursor in self.cursors:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.cursors = []
+
+        commit = exc is None and not self.failed
+        for handle in (self._conn, self._read_conn):
+            if handle is not None:
+                if self._release(handle.pooled, commit, exc):
+                    handle.run_after_commit()
+        self._conn = self._read_conn = None
+
+    @staticmethod
+    def _release(conn, commit: bool, exc) -> bool:
+        """End the transaction and return conn to the pool; True if it committed."""
+        committed = False
+        try:
+            if commit:
+                conn.commit()
+                committed = True
+            else:
+                conn.rollback()
+        except Exception as e:
+            logging.error(f"[UnitOfWork] failed to end transaction: {e}")
+            conn.invalidate()
+        if isinstance(exc, (mysql.connector.InterfaceError, mysql.connector.OperationalError)):
+            conn.invalidate()
+        conn.close()
+        return committed
+
+
+def current_unit_of_work():
+    """Return the unit of work of the current Flask request, if any."""
+    if not has_app_context():
+        return None
+    uow = g.get("unit_of_work")
+    if uow is None:
+        uow = g.unit_of_work = UnitOfWork()
+    return uow
+
+
+def note_response_status(response):
+    """after_request hook: roll back the request's work unless it answered 2xx.
+
+    A model that returns an error after a partial write is not required
+    to roll back itself.
+    """
+    uow = g.get("unit_of_work")
+    if uow is not None and not 200 <= response.status_code < 300:
+        uow.failed = True
+    return response
+
+
+def teardown_unit_of_work(exc=None):
+    uow = g.pop("unit_of_work", None)
+    if uow is not None:
+        uow.finish(exc)
+
+
+def _argument_getter(func, name):
+    if name is None:
+        return lambda args, kwargs: None
+    signature = inspect.signature(func)
+
+    def get(args, kwargs):
+        return signature.bind_partial(*args, **kwargs).arguments.get(name)
+    return get
+
+
+def read_only(user_arg="user_id"):
+    """Declare a model method as a pure read that may be served by a replica.
+
+    user_arg names the parameter holding the acting user, whose reads stay
+    on the primary for a while after they write (see writes()).
+    """
+    def decorator(func):
+        get_user = _argument_getter(func, user_arg)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            previous = self._read_user
+            self._read_user = (get_user((self,) + args, kwargs),)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._read_user = previous
+        return wrapper
+    return decorator
+
+
+def writes(user_arg="user_id"):
+    """Record a successful write by the acting user for read-your-writes routing."""
+    def decorator(func):
+        get_user = _argument_getter(func, user_arg)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            result = func(self, *args, **kwargs)
+            if result[0] == 200:
+                store.note_write(get_user((self,) + args, kwargs))
+            return result
+        return wrapper
+    return decorator
+
+
+# 死锁 / 锁等待超时：事务已被（部分）回滚，整体重做即可
+_RETRYABLE_ERRORS = {1213, 1205}  # ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+
+
+def is_retryable(e: BaseException) -> bool:
+    return isinstance(e, mysql.connector.Error) and e.errno in _RETRYABLE_ERRORS
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a fraction of all transactions.
+
+    Every call deposits ratio tokens and every retry spends one, so a
+    database that keeps deadlocking is not hammered by retry storms.
+    """
+
+    def __init__(self, ratio: float, min_tokens: float = 10, max_tokens: float = 100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            return self._tokens
+
+
+class TransactionStats:
+    """Per method counters for transactional()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, method, errors=(), exhausted=False, denied=False):
+        """Account one call; errors holds the errno of every failed attempt."""
+        with self._lock:
+            entry = self._entries.get(method)
+            if entry is None:
+                entry = self._entries[method] = {
+                    "calls": 0, "retries": 0, "exhausted": 0, "budget_denied": 0,
+                    "errors": collections.Counter(),
+                }
+            entry["calls"] += 1
+            entry["retries"] += len(errors) - (exhausted or denied)
+            entry["exhausted"] += exhausted
+            entry["budget_denied"] += denied
+            entry["errors"].update(errors)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            methods = {name: dict(entry, errors={str(k): v for k, v in entry["errors"].items()})
+                       for name, entry in sorted(self._entries.items())}
+        return {"retry_budget": retry_budget.tokens, "methods": methods}
+
+
+retry_budget = RetryBudget(conf.Tx_Retry_Budget_Ratio)
+tx_stats = TransactionStats()
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter：在 [0, base * 2^attempt] 内随机，避免冲突双方同时重试
+    return random.uniform(0, min(conf.Tx_Backoff_Max, conf.Tx_Backoff_Base * 2 ** attempt))
+
+
+def transactional(*failure_extra):
+    """Retry a model method whose transaction hit a deadlock or lock wait timeout.
+
+    The method must let retryable errors propagate (see is_retryable());
+    the transaction is rolled back and the whole method is run again with
+    jittered exponential backoff, within conf.Tx_Max_Attempts and the
+    shared retry budget. When retries run out the method returns 530
+    followed by failure_extra, like its own error path would.
+    """
+    def decorator(func):
+        method = func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            retry_budget.deposit()
+            errors = []
+            while True:
+                try:
+                    result = func(self, *args, **kwargs)
+                except mysql.connector.Error as e:
+                    if not is_retryable(e):
+                        raise
+                    self.conn.rollback()
+                    errors.append(e.errno)
+                    exhausted = len(errors) >= conf.Tx_Max_Attempts
+                    denied = not exhausted and not retry_budget.withdraw()
+                    if exhausted or denied:
+                        tx_stats.record(method, errors, exhausted, denied)
+                        logging.error(f"[transactional] {method} gave up after "
+                                      f"{len(errors)} attempts: {e}")
+                        return (530, f"Internal error: {str(e)}") + failure_extra
+                    logging.info(f"[transactional] {method} retry {len(errors)} after errno {e.errno}")
+                    time.sleep(_backoff(len(errors)))
+                    continue
+                tx_stats.record(method, errors)
+                return result
+        return wrapper
+    return decorator
+
 
 class DBConn:
     def __init__(self):
-        self.conn = store.get_db_conn()
+        self.uow = current_unit_of_work()
+        # 请求之外（如后台线程）使用独立的 unit of work，需调用 close() 归还连接
+        self._owns_uow = self.uow is None
+        if self._owns_uow:
+            self.uow = UnitOfWork()
+        self._read_user = None
         self.page_size = 5
 
+    @property
+    def conn(self):
+        if self._read_user is not None:
+            return self.uow.read_connection(self._read_user[0])
+        return self.uow.connection
+
+    def close(self):
+        if self._owns_uow:
+            self.uow.finish()
+
+    def fetch_prepared(self, stmt: statements.Statement, params=()) -> list:
+        """Run a registered statement and return all of its rows."""
+        start = time.perf_counter()
+        rows = statements.execute(self.conn.pooled, stmt, params).fetchall()
+        if conf.Sql_Stats_Enabled:
+            sql_stats.record(stmt.sql, params, time.perf_counter() - start, len(rows))
+        return rows
+
+    def execute_prepared(self, stmt: statements.Statement, params=()) -> int:
+        """Run a registered DML statement and return the affected row count."""
+        start = time.perf_counter()
+        rowcount = statements.execute(self.conn.pooled, stmt, params).rowcount
+        if conf.Sql_Stats_Enabled:
+            sql_stats.record(stmt.sql, params, time.perf_counter() - start, rowcount)
+        return rowcount
+
     def user_id_exist(self, user_id):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
-        result = cursor.fetchone()
-        cursor.close()
-        return result is not None
+        return len(self.fetch_prepared(_USER_EXISTS, (user_id,))) > 0
 
     def book_id_exist(self, store_id, book_id):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT 1 FROM store_inventory WHERE store_id = %s AND book_id = %s", (store_id, book_id))
-        result = cursor.fetchone()
-        cursor.close()
-        return result is not None
+        return len(self.fetch_prepared(_BOOK_EXISTS, (store_id, book_id))) > 0
 
     def store_id_exist(self, store_id):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT 1 FROM stores WHERE store_id = %s", (store_id,))
-        result = cursor.fetchone()
-        cursor.close()
-        return result is not None
+        return len(self.fetch_prepared(_STORE_EXISTS, (store_id,))) > 0
     
     def check_store_owner(self, store_id, user_id):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT 1 FROM stores WHERE store_id = %s AND user_id = %s", (store_id, user_id))
-        return cursor.fetchone() is not None
+        return len(self.fetch_prepared(_STORE_OWNER, (store_id, user_id))) > 0
+
+    def check_preconditions(self, user_id, store_id=None, book_id=None,
+                            store_exists=True, owner=False, book_exists=None) -> (int, str):
+        """Validate what an operation needs to hold in a single query.
+
+        The user must exist. store_exists=True/False requires the store to
+        exist/not exist, owner requires user_id to own it, and book_exists
+        does the same for the store's inventory row; None skips a check.
+        Errors are reported in that order, as the separate checks did.
+        """
+        user_ok, store_ok, owner_ok, book_ok = self.fetch_prepared(
+            _PRECONDITIONS, (user_id, store_id, store_id, user_id, store_id, book_id))[0]
+        if not user_ok:
+            return error.error_non_exist_user_id(user_id)
+        if store_exists is True and not store_ok:
+            return error.error_non_exist_store_id(store_id)
+        if store_exists is False and store_ok:
+            return error.error_exist_store_id(store_id)
+        if owner and not owner_ok:
+            return error.error_authorization_fail()
+        if book_exists is True and not book_ok:
+            return error.error_non_exist_book_id(book_id)
+        if book_exists is False and book_ok:
+            return error.error_exist_book_id(book_id)
+        return 200, "ok"
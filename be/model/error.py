@@ -10,7 +10,7 @@ error_code = {
     518: "invalid order id {}",
     519: "not sufficient funds, order id {}",
     520: "",
-    521: "",
+    521: "order outcome unknown, check order history before retrying",
     522: "",
     523: "",
     524: "",
@@ -68,5 +68,8 @@ def error_unexpected_cancel_order(order_id):
 def error_order_status(order_id):
     return 531, error_code[531].format(order_id)
 
+def error_order_outcome_unknown():
+    return 521, error_code[521]
+
 def error_and_message(code, message):
     return code, message
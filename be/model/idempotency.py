@@ -0,0 +1,182 @@
+import collections
+import hashlib
+import itertools
+import json
+import threading
+import time
+import mysql.connector
+from be import conf
+from be.model import db_conn
+
+# begin() 的结果
+NEW = "new"
+REPLAY = "replay"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+
+# 这些状态码表示事务已回滚，不保存响应，允许客户端用同一个 key 重试
+_RETRYABLE_CODES = {528, 530}
+
+
+def request_hash(payload) -> str:
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+class _RecentKeys:
+    """In-process LRU of completed responses, checked before the database.
+
+    Entries expire with the stored row, not TTL seconds after caching.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, expires_at, req_hash, status, body):
+        """Cache a response until expires_at (time.monotonic())."""
+        with self._lock:
+            self._entries[key] = (expires_at, req_hash, status, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > conf.Idempotency_Cache_Size:
+                self._entries.popitem(last=False)
+
+
+recent_keys = _RecentKeys()
+
+
+class Idempotency(db_conn.DBConn):
+    """Idempotency-Key bookkeeping for write endpoints.
+
+    begin() claims a key with a pending row before the handler runs,
+    finish() stores the response so replays skip the handler. The claim
+    commits on its own so concurrent retries see it at once.
+
+    A pending claim answers 409 for conf.Idempotency_Pending_Timeout
+    seconds and can then be claimed again, so a crashed request does not
+    block its key until the stored-response TTL runs out. The handler may
+    commit before the response is stored, so the timeout has to outlast
+    the slowest request or a retry could repeat the order or payment.
+    """
+
+    _claims = itertools.count(1)
+
+    def __init__(self):
+        super().__init__()
+        self._claimed_at = None
+
+    def begin(self, user_id: str, endpoint: str, key: str, req_hash: str):
+        """Return (state, stored) where stored is (status, body) for REPLAY."""
+        cached = recent_keys.get((user_id, endpoint, key))
+        if cached is not None:
+            cached_hash, status, body = cached
+            if cached_hash != req_hash:
+                return MISMATCH, None
+            return REPLAY, (status, body)
+
+        cursor = self.conn.cursor()
+        try:
+            try:
+                cursor.execute(
+                    "INSERT INTO idempotency_keys (user_id, endpoint, idem_key, request_hash) "
+                    "VALUES (%s, %s, %s, %s)",
+                    (user_id, endpoint, key, req_hash)
+                )
+                self.conn.commit()
+                self._claimed_at = time.monotonic()
+                self._prune(cursor)
+                return NEW, None
+            except mysql.connector.IntegrityError as e:
+                self.conn.rollback()
+                if e.errno != 1062:  # ER_DUP_ENTRY
+                    raise
+
+            cursor.execute(
+                "SELECT request_hash, status_code, response, created_at, "
+                "TIMESTAMPDIFF(SECOND, NOW(), created_at + INTERVAL %s SECOND), "
+                "created_at < NOW() - INTERVAL %s SECOND "
+                "FROM idempotency_keys WHERE user_id = %s AND endpoint = %s AND idem_key = %s",
+                (conf.Idempotency_Key_TTL, conf.Idempotency_Pending_Timeout, user_id, endpoint, key)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                # 并发的请求刚刚释放了该 key
+                return self.begin(user_id, endpoint, key, req_hash)
+
+            stored_hash, status, body, created_at, expires_in, pending_stale = row
+            if expires_in <= 0 or (status is None and pending_stale):
+                # 过期的记录或超时未完成的占用：重新占用；比对 created_at，并发的重试只有一个能成功
+                cursor.execute(
+                    "UPDATE idempotency_keys "
+                    "SET request_hash = %s, status_code = NULL, response = NULL, created_at = NOW() "
+                    "WHERE user_id = %s AND endpoint = %s AND idem_key = %s "
+                    "AND request_hash = %s AND status_code <=> %s AND created_at = %s",
+                    (req_hash, user_id, endpoint, key, stored_hash, status, created_at)
+                )
+                self.conn.commit()
+                if not cursor.rowcount:
+                    return IN_PROGRESS, None
+                self._claimed_at = time.monotonic()
+                return NEW, None
+            if stored_hash != req_hash:
+                return MISMATCH, None
+            if status is None:
+                return IN_PROGRESS, None
+            recent_keys.put((user_id, endpoint, key), time.monotonic() + expires_in,
+                            stored_hash, status, body)
+            return REPLAY, (status, body)
+        finally:
+            cursor.close()
+
+    def finish(self, user_id: str, endpoint: str, key: str, req_hash: str, status: int, body: str):
+        """Record the response and commit.
+
+        The request's connection is shared with the handler, so a failed
+        request is rolled back first; committing here must not keep the
+        partial writes of a handler that raised or returned an error.
+        """
+        if not 200 <= status < 300:
+            self.conn.rollback()
+        cursor = self.conn.cursor()
+        try:
+            if status in _RETRYABLE_CODES:
+                cursor.execute(
+                    "DELETE FROM idempotency_keys "
+                    "WHERE user_id = %s AND endpoint = %s AND idem_key = %s AND status_code IS NULL",
+                    (user_id, endpoint, key)
+                )
+            else:
+                cursor.execute(
+                    "UPDATE idempotency_keys SET status_code = %s, response = %s "
+                    "WHERE user_id = %s AND endpoint = %s AND idem_key = %s",
+                    (status, body, user_id, endpoint, key)
+                )
+                # 记录在占用时写入 created_at，缓存随它一起过期
+                claimed_at = self._claimed_at if self._claimed_at is not None else time.monotonic()
+                recent_keys.put((user_id, endpoint, key), claimed_at + conf.Idempotency_Key_TTL,
+                                req_hash, status, body)
+            self.conn.commit()
+        finally:
+            cursor.close()
+
+    def _prune(self, cursor):
+        # 每占用一定数量的 key 顺带清理一批过期记录，不单独起线程
+        if next(Idempotency._claims) % 1000:
+            return
+        cursor.execute(
+            "DELETE FROM idempotency_keys WHERE created_at < NOW() - INTERVAL %s SECOND LIMIT 1000",
+            (conf.Idempotency_Key_TTL,)
+        )
+        self.conn.commit()
@@ -0,0 +1,111 @@
+import collections
+import threading
+import time
+from be import conf
+
+# 失效计数按 key 的哈希分段，内存有界；同段 key 互相影响只会让少量填充被丢弃
+_GENERATION_STRIPES = 1024
+
+
+class InventoryCache:
+    """In-process LRU of (stock_quantity, book_price) per (store_id, book_id).
+
+    Entries expire after conf.Inventory_Cache_TTL seconds. Writers call
+    invalidate() once their transaction has committed; every invalidation
+    bumps a generation counter, and a row loaded while the counter moved
+    is not stored, so a reader racing a writer cannot put the old row back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._generations = [0] * _GENERATION_STRIPES
+        self._counters = collections.Counter()
+
+    @staticmethod
+    def _stripe(key) -> int:
+        return hash(key) % _GENERATION_STRIPES
+
+    def _lookup(self, key):
+        """Return the cached row or None; caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        if time.monotonic() >= entry[0]:
+            del self._entries[key]
+            self._counters["expired"] += 1
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return entry[1]
+
+    def peek(self, store_id: str, book_id: str):
+        """Cached (stock_quantity, book_price), or None without loading."""
+        if not conf.Inventory_Cache_Enabled:
+            return None
+        with self._lock:
+            return self._lookup((store_id, book_id))
+
+    def get_or_load(self, store_id: str, book_id: str, load):
+        """Cached row, or load() it and remember the result unless it is None."""
+        if not conf.Inventory_Cache_Enabled:
+            return load()
+        key = (store_id, book_id)
+        stripe = self._stripe(key)
+        with self._lock:
+            row = self._lookup(key)
+            generation = self._generations[stripe]
+        if row is not None:
+            return row
+
+        row = load()
+        if row is None:
+            return None
+        with self._lock:
+            if self._generations[stripe] != generation:
+                self._counters["stale_fills"] += 1
+                return row
+            self._entries[key] = (time.monotonic() + conf.Inventory_Cache_TTL, row)
+            self._entries.move_to_end(key)
+            while len(self._entries) > conf.Inventory_Cache_Size:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+        return row
+
+    def invalidate(self, keys):
+        """Drop the given (store_id, book_id) pairs after a committed write."""
+        with self._lock:
+            for key in keys:
+                key = tuple(key)
+                self._generations[self._stripe(key)] += 1
+                if self._entries.pop(key, None) is not None:
+                    self._counters["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations = [g + 1 for g in self._generations]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return dict(
+            {name: counters.get(name, 0) for name in
+             ("hits", "misses", "expired", "evictions", "invalidations", "stale_fills",
+              "precheck_rejects")},
+            enabled=conf.Inventory_Cache_Enabled,
+            size=size,
+            max_size=conf.Inventory_Cache_Size,
+            hit_rate=counters.get("hits", 0) / lookups if lookups else 0.0,
+        )
+
+    def count_precheck_reject(self):
+        with self._lock:
+            self._counters["precheck_rejects"] += 1
+
+
+inventory_cache = InventoryCache()
@@ -0,0 +1,196 @@
+import logging
+import os
+import socket
+import threading
+import time
+from be import conf
+from be.model import db_conn
+from be.model import store
+
+# 多个后端进程时，每个后台任务只由持有对应 MySQL 命名锁（GET_LOCK）的进程执行。
+# 锁属于会话：进程退出或连接断开后服务器自动释放，其他进程在下一次心跳时接手
+
+NODE_NAME = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderElection(threading.Thread):
+    """Campaigns for one named lock per background job on a dedicated connection.
+
+    Every heartbeat the thread tries to take the locks it does not hold
+    and records the jobs it leads in job_status. If the connection fails
+    it gives up all jobs at once, before the server has necessarily
+    released the locks.
+
+    is_leader() answers from the last heartbeat and may be stale by up to
+    one interval; confirm() asks the server and is what a leader-only run
+    checks right before it starts. A run already under way is not
+    interrupted if the lock is lost meanwhile, so a short overlap with
+    the new leader is still possible and jobs must tolerate it.
+    """
+
+    def __init__(self, jobs, interval_seconds=None):
+        super().__init__(name="LeaderElection")
+        self.jobs = list(jobs)
+        self.interval_seconds = interval_seconds or conf.Leader_Heartbeat_Interval
+        self.daemon = True
+        self.running = True
+        self._conn = None
+        # 心跳线程与 confirm() 的调用者共用这条连接
+        self._conn_lock = threading.Lock()
+        self._held = frozenset()
+        self.elections_won = 0
+        self.sessions_lost = 0
+
+    def stop(self):
+        self.running = False
+
+    def is_leader(self, job: str) -> bool:
+        return job in self._held
+
+    def confirm(self, job: str) -> bool:
+        """Whether this session still holds the lock of job, asked of the server."""
+        with self._conn_lock:
+            if job not in self._held or self._conn is None:
+                return False
+            try:
+                cursor = self._conn.cursor()
+                try:
+                    cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.lock_name(job),))
+                    holds = cursor.fetchone()[0] == 1
+                finally:
+                    cursor.close()
+            except Exception as e:
+                logging.warning(f"[LeaderElection] lost database session, stepping down: {str(e)}")
+                self.sessions_lost += 1
+                self._step_down()
+                return False
+            if not holds:
+                logging.warning(f"[LeaderElection] {NODE_NAME} no longer holds the lock of {job}")
+                self._held = self._held - {job}
+            return holds
+
+    def held(self) -> list:
+        return sorted(self._held)
+
+    def run(self):
+        logging.info(f"LeaderElection thread started on {NODE_NAME}")
+        while self.running:
+            with self._conn_lock:
+                try:
+                    self._heartbeat()
+                except Exception as e:
+                    logging.warning(f"[LeaderElection] lost database session, stepping down: {str(e)}")
+                    self.sessions_lost += 1
+                    self._step_down()
+            time.sleep(self.interval_seconds)
+        with self._conn_lock:
+            self._step_down()
+        logging.info("LeaderElection thread stopped")
+
+    @staticmethod
+    def lock_name(job: str) -> str:
+        return f"{conf.DB_Name}.{job}"[:64]
+
+    def _heartbeat(self):
+        if self._conn is None:
+            self._conn = store.get_dedicated_conn()
+            self._conn.autocommit = True
+        held = set()
+        cursor = self._conn.cursor()
+        try:
+            for job in self.jobs:
+                # 已持有时不再 GET_LOCK，否则同一会话的锁计数会累加
+                cursor.execute(
+                    "SELECT IF(IS_USED_LOCK(%s) = CONNECTION_ID(), 1, GET_LOCK(%s, 0))",
+                    (self.lock_name(job), self.lock_name(job))
+                )
+                if cursor.fetchone()[0] == 1:
+                    held.add(job)
+                    if job not in self._held:
+                        self.elections_won += 1
+                        logging.info(f"[LeaderElection] {NODE_NAME} now leads {job}")
+            for job in held:
+                cursor.execute(
+                    "INSERT INTO job_status (job_name, leader) VALUES (%s, %s) "
+                    "ON DUPLICATE KEY UPDATE "
+                    "leader_since = IF(leader = VALUES(leader), leader_since, CURRENT_TIMESTAMP), "
+                    "leader = VALUES(leader), heartbeat_at = CURRENT_TIMESTAMP",
+                    (job, NODE_NAME)
+                )
+        finally:
+            cursor.close()
+        self._held = frozenset(held)
+
+    def _step_down(self):
+        self._held = frozenset()
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+election = None
+_node_conn = None
+
+
+def claim_node_id(node_id: int):
+    """Hold a named lock on node_id for the life of the process.
+
+    Order keys embed the node id, so two backends sharing one would hand
+    out the same ids. Raises RuntimeError if another process holds it.
+    """
+    global _node_conn
+    conn = store.get_dedicated_conn()
+    cursor = conn.cursor()
+    try:
+        # 连接空闲也不能被服务器断开，否则锁随之释放
+        cursor.execute("SET SESSION wait_timeout = 31536000")
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (f"{conf.DB_Name}.node_{node_id}"[:64],))
+        claimed = cursor.fetchone()[0] == 1
+    finally:
+        cursor.close()
+    if not claimed:
+        conn.close()
+        raise RuntimeError(f"node id {node_id} is used by another backend process, "
+                           "give each process its own Node_Id (BOOKSTORE_NODE_ID)")
+    _node_conn = conn
+    logging.info(f"{NODE_NAME} uses node id {node_id}")
+
+
+def start_leader_election(jobs) -> LeaderElection:
+    global election
+    thread = LeaderElection(jobs)
+    thread.start()
+    election = thread
+    return thread
+
+
+def is_leader(job: str) -> bool:
+    """Whether this process should run job; always true without leader election."""
+    return election is None or election.is_leader(job)
+
+
+def confirm_leader(job: str) -> bool:
+    """Like is_leader(), but re-checks the lock with the server; call right before a run."""
+    return election is None or election.confirm(job)
+
+
+def cluster_status() -> list:
+    """job_status rows with whether each leader's heartbeat is still fresh."""
+    db = db_conn.DBConn()
+    try:
+        with db.conn.cursor(dictionary=True) as cursor:
+            cursor.execute(
+                "SELECT job_name, leader, leader_since, heartbeat_at, "
+                "heartbeat_at >= NOW() - INTERVAL %s SECOND AS alive "
+                "FROM job_status ORDER BY job_name",
+                (conf.Leader_Heartbeat_Interval * 3,)
+            )
+            rows = cursor.fetchall()
+        for row in rows:
+            row["alive"] = bool(row["alive"])
+        return rows
+    finally:
+        db.close()
@@ -0,0 +1,90 @@
+from decimal import Decimal
+from be import conf
+from be import jobs
+from be.model import db_conn
+from be.model import statements
+
+# 卖家收入先追加到 seller_credits，由后台任务 FOLD_JOB 定期合并进 users.balance，
+# 支付时不再锁定卖家的 users 行
+
+INSERT_CREDIT = statements.register(
+    "ledger.insert_credit",
+    "INSERT INTO seller_credits (seller_id, order_id, amount) VALUES (%s, %s, %s)")
+BALANCE = statements.register(
+    "ledger.balance",
+    "SELECT u.balance, "
+    "(SELECT COALESCE(SUM(c.amount), 0) FROM seller_credits c WHERE c.seller_id = u.user_id) "
+    "FROM users u WHERE u.user_id = %s")
+
+
+def fold_seller_credits(conn, batch_size: int) -> int:
+    """Fold the oldest batch_size ledger rows into users.balance.
+
+    Returns the number of ledger rows folded; the balance update and the
+    removal of the folded rows commit together.
+
+    The batch is read without locking: a locking range read would take
+    gap locks up to the supremum and block every payment appending to the
+    ledger until the fold commits. Deleting the rows by credit_id locks
+    only them, and a batch that another fold got to first is abandoned.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT credit_id, seller_id, amount FROM seller_credits "
+            "ORDER BY credit_id LIMIT %s",
+            (batch_size,)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            conn.commit()
+            return 0
+
+        placeholders = ", ".join(["%s"] * len(rows))
+        cursor.execute(
+            f"DELETE FROM seller_credits WHERE credit_id IN ({placeholders})",
+            tuple(row[0] for row in rows)
+        )
+        if cursor.rowcount != len(rows):
+            conn.rollback()
+            return 0
+
+        totals = {}
+        for _, seller_id, amount in rows:
+            totals[seller_id] = totals.get(seller_id, Decimal('0.00')) + amount
+        # 按 user_id 顺序加锁，与其他合并批次保持一致
+        for seller_id in sorted(totals):
+            cursor.execute(
+                "UPDATE users SET balance = balance + %s WHERE user_id = %s",
+                (totals[seller_id], seller_id)
+            )
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+FOLD_JOB = "seller_credit_fold"
+
+
+def fold_pending_credits() -> int:
+    """Job body: fold the ledger until less than one batch is left."""
+    db = db_conn.DBConn()
+    try:
+        folded = 0
+        # 积压较多时连续合并，直到不足一个批次
+        while not jobs.stopping():
+            count = fold_seller_credits(db.conn, conf.Credit_Fold_Batch)
+            folded += count
+            if count < conf.Credit_Fold_Batch:
+                break
+        return folded
+    finally:
+        db.close()
+
+
+def fold_job() -> jobs.Job:
+    return jobs.Job(FOLD_JOB, fold_pending_credits, conf.Credit_Fold_Interval)
@@ -0,0 +1,37 @@
+from be.model import statements
+
+# orders 按 create_time 分区，order_id 上只有非唯一索引：经它加锁会取得 next-key 锁，
+# 最新订单之后的间隙一直延伸到 supremum，挡住所有新订单的插入，也无法裁剪分区。
+# 先从唯一的 order_ids 表不加锁地查出 (order_key, create_time)，再按完整主键加锁，
+# 只锁一个分区中的一行记录
+
+# create_time 以 Unix 秒传入，与会话时区无关
+PK_CONDITION = "order_key = %s AND create_time = FROM_UNIXTIME(%s)"
+
+FIND_ORDER_PK = statements.register(
+    "order_keys.find_order_pk",
+    "SELECT order_key, UNIX_TIMESTAMP(create_time) FROM order_ids WHERE order_id = %s")
+
+
+def pk_condition(count: int, alias: str = "") -> str:
+    """WHERE condition matching count orders primary keys, passed as flat (order_key, seconds) params."""
+    prefix = f"{alias}." if alias else ""
+    single = f"({prefix}order_key = %s AND {prefix}create_time = FROM_UNIXTIME(%s))"
+    return " OR ".join([single] * count)
+
+
+def primary_keys(cursor, order_ids) -> dict:
+    """Map order ids to their (order_key, create_time seconds); unknown ids are left out.
+
+    Reads order_ids without locking; the caller locks orders by primary
+    key and treats a missing row (archived since) like an unknown id.
+    """
+    if not order_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(order_ids))
+    cursor.execute(
+        "SELECT order_id, order_key, UNIX_TIMESTAMP(create_time) FROM order_ids "
+        f"WHERE order_id IN ({placeholders}) AND create_time IS NOT NULL",
+        tuple(order_ids)
+    )
+    return {order_id: (order_key, created) for order_id, order_key, created in cursor.fetchall()}
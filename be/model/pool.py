@@ -0,0 +1,248 @@
+import logging
+import threading
+import time
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class _PoolEntry:
+    """A physical connection owned by the pool."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.created_at = time.monotonic()
+        self.cache = {}
+
+
+class PooledConnection:
+    """Connection lent out by ConnectionPool for a single checkout.
+
+    Behaves like the underlying mysql.connector connection, except that
+    close() hands the physical connection back to the pool. A checkout
+    that is dropped without close() is returned when garbage collected.
+    """
+
+    _pool = None
+    _entry = None
+
+    def __init__(self, pool, entry):
+        self._pool = pool
+        self._entry = entry
+        self._broken = False
+
+    def __getattr__(self, name):
+        entry = self._entry
+        if entry is None:
+            raise PoolError("connection already returned to the pool")
+        return getattr(entry.raw, name)
+
+    @property
+    def cache(self) -> dict:
+        """Per physical connection storage, dropped when it is recycled."""
+        return self._entry.cache
+
+    def invalidate(self):
+        """Mark the connection as unusable so the pool destroys it on release."""
+        self._broken = True
+
+    def close(self):
+        entry, self._entry = self._entry, None
+        if entry is not None:
+            self._pool.release(entry, broken=self._broken)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, factory, min_size: int = 2, max_size: int = 32,
+                 timeout: float = 10, max_lifetime: float = 1800,
+                 ping_on_borrow: bool = True):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("invalid pool size {}..{}".format(min_size, max_size))
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_on_borrow = ping_on_borrow
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._created = 0
+        self._destroyed = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        self.fill()
+
+    def fill(self):
+        """Open connections until min_size physical connections exist."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                entry = self._create()
+            except Exception as e:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                logging.error(f"[ConnectionPool] prefill failed: {e}")
+                return
+            with self._cond:
+                self._idle.append(entry)
+                self._cond.notify()
+
+    def acquire(self) -> PooledConnection:
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            entry, create = None, False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            "no connection available within {}s".format(self.timeout))
+                    self._cond.wait(remaining)
+                self._in_use += 1
+
+            if create:
+                try:
+                    entry = self._create()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(entry):
+                self._discard(entry)
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return PooledConnection(self, entry)
+
+    def release(self, entry: _PoolEntry, broken: bool = False):
+        if not broken and not self._expired(entry):
+            try:
+                # 归还前结束未提交的事务，避免把锁和快照带给下一个使用者
+                entry.raw.rollback()
+            except Exception as e:
+                logging.warning(f"[ConnectionPool] rollback on release failed: {e}")
+                broken = True
+        else:
+            broken = True
+
+        if broken:
+            self._discard(entry)
+            return
+        with self._cond:
+            self._in_use -= 1
+            if self._closed:
+                self._size -= 1
+                self._destroy(entry)
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._destroy(entry)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self._created,
+                "destroyed": self._destroyed,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_time_total": self._wait_total,
+                "wait_time_avg": self._wait_total / self._checkouts if self._checkouts else 0.0,
+                "wait_time_max": self._wait_max,
+            }
+
+    def _create(self) -> _PoolEntry:
+        entry = _PoolEntry(self.factory())
+        with self._cond:
+            self._created += 1
+        return entry
+
+    def _expired(self, entry: _PoolEntry) -> bool:
+        return self.max_lifetime is not None and \
+            time.monotonic() - entry.created_at > self.max_lifetime
+
+    def _healthy(self, entry: _PoolEntry) -> bool:
+        if self._expired(entry):
+            return False
+        if not self.ping_on_borrow:
+            return True
+        try:
+            entry.raw.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logging.warning(f"[ConnectionPool] ping on borrow failed: {e}")
+            return False
+
+    def _discard(self, entry: _PoolEntry):
+        """Destroy a checked-out connection and free its slot."""
+        self._destroy(entry)
+        with self._cond:
+            self._size -= 1
+            self._in_use -= 1
+            self._cond.notify()
+
+    def _destroy(self, entry: _PoolEntry):
+        try:
+            entry.raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._destroyed += 1
@@ -0,0 +1,771 @@
+import logging
+import time
+from datetime import date
+import mysql.connector
+from be import conf
+from be.model import snowflake
+
+# 表结构变更按版本顺序追加到 MIGRATIONS 末尾，已发布的版本不要再修改
+
+
+class Migration:
+    def __init__(self, version: int, description: str, apply):
+        self.version = version
+        self.description = description
+        self.apply = apply
+
+
+def column_exists(cursor, database, table_name, column_name):
+    """Check if a column exists in a table"""
+    cursor.execute("""
+        SELECT COUNT(1)
+        FROM information_schema.columns
+        WHERE table_schema = %s
+        AND table_name = %s
+        AND column_name = %s
+    """, (database, table_name, column_name))
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, database, table_name, index_name):
+    """Check if an index exists on a table"""
+    cursor.execute("""
+        SELECT COUNT(1)
+        FROM information_schema.statistics
+        WHERE table_schema = %s
+        AND table_name = %s
+        AND index_name = %s
+    """, (database, table_name, index_name))
+    return cursor.fetchone()[0] > 0
+
+
+def foreign_keys(cursor, database, table_name, column_name) -> list:
+    """Names of the foreign key constraints on a column"""
+    cursor.execute("""
+        SELECT constraint_name
+        FROM information_schema.key_column_usage
+        WHERE table_schema = %s
+        AND table_name = %s
+        AND column_name = %s
+        AND referenced_table_name IS NOT NULL
+    """, (database, table_name, column_name))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_sizes(cursor, database) -> list:
+    """(table, rows, data bytes, index bytes) as estimated by InnoDB"""
+    cursor.execute("""
+        SELECT table_name, table_rows, data_length, index_length
+        FROM information_schema.tables
+        WHERE table_schema = %s
+        ORDER BY data_length + index_length DESC
+    """, (database,))
+    return cursor.fetchall()
+
+
+def month_partition(year: int, month: int) -> str:
+    """RANGE partition of orders holding the given month, named pYYYYMM."""
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return (f"PARTITION p{year:04d}{month:02d} "
+            f"VALUES LESS THAN (UNIX_TIMESTAMP('{next_year:04d}-{next_month:02d}-01 00:00:00'))")
+
+
+def month_range(start: date, count: int) -> list:
+    """(year, month) of count consecutive months starting at start."""
+    months = []
+    year, month = start.year, start.month
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def order_partitions(cursor, database) -> list:
+    """Names of the partitions of orders, oldest first"""
+    cursor.execute("""
+        SELECT partition_name
+        FROM information_schema.partitions
+        WHERE table_schema = %s
+        AND table_name = 'orders'
+        AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+    """, (database,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _v1_baseline(cursor, database):
+    """Tables and indexes previously created by Store.init_tables()."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS books (
+            id VARCHAR(255) PRIMARY KEY,
+            title VARCHAR(255),
+            author VARCHAR(255),
+            publisher VARCHAR(255),
+            original_title VARCHAR(255),
+            translator VARCHAR(255),
+            pub_year VARCHAR(128),
+            pages INT,
+            price FLOAT,
+            currency_unit VARCHAR(128),
+            binding VARCHAR(50),
+            isbn VARCHAR(50),
+            author_intro LONGTEXT,
+            book_intro LONGTEXT,
+            content LONGTEXT,
+            pictures LONGBLOB
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tags (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(225) UNIQUE
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS book_tags (
+            book_id VARCHAR(255),
+            tag_id INT,
+            PRIMARY KEY (book_id, tag_id),
+            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+            FOREIGN KEY (tag_id) REFERENCES tags(id) ON DELETE CASCADE
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id VARCHAR(255) PRIMARY KEY,
+            password_hash VARCHAR(255) NOT NULL,
+            token TEXT,
+            terminal VARCHAR(255),
+            balance DECIMAL(10,2) NOT NULL DEFAULT 0.00,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stores (
+            store_id VARCHAR(255) PRIMARY KEY,
+            user_id VARCHAR(255),
+            store_name VARCHAR(255) NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            UNIQUE KEY unique_user_store (user_id, store_id)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS store_inventory (
+            inventory_id INT PRIMARY KEY AUTO_INCREMENT,
+            store_id VARCHAR(255),
+            book_id VARCHAR(255),
+            stock_quantity INT NOT NULL DEFAULT 0,
+            book_price DECIMAL(10,2) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (store_id) REFERENCES stores(store_id) ON DELETE CASCADE,
+            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+            UNIQUE KEY unique_store_book (store_id, book_id)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id VARCHAR(255) PRIMARY KEY,
+            user_id VARCHAR(255),
+            store_id VARCHAR(255),
+            order_status VARCHAR(50) NOT NULL DEFAULT 'pending',
+            create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            total_amount DECIMAL(10,2),
+            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY (store_id) REFERENCES stores(store_id) ON DELETE CASCADE,
+            INDEX idx_user_id (user_id),
+            INDEX idx_store_id (store_id),
+            INDEX idx_status (order_status),
+            INDEX idx_order_time (create_time)
+        )
+    """)
+
+    # 旧版本创建的 orders 表可能缺少这两列
+    for column in ("ship_time", "receive_time"):
+        if not column_exists(cursor, database, "orders", column):
+            cursor.execute(f"ALTER TABLE orders ADD COLUMN {column} TIMESTAMP NULL DEFAULT NULL")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_details (
+            detail_id INT PRIMARY KEY AUTO_INCREMENT,
+            order_id VARCHAR(255),
+            book_id VARCHAR(255),
+            quantity INT NOT NULL,
+            unit_price DECIMAL(10,2) NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders(order_id) ON DELETE CASCADE,
+            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+            UNIQUE KEY unique_order_book (order_id, book_id)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS book_search_index (
+            book_id VARCHAR(255) PRIMARY KEY,
+            search_content TEXT,
+            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
+            FULLTEXT(search_content)
+        )
+    """)
+
+    indexes = [
+        ("idx_title", "CREATE INDEX idx_title ON books(title)"),
+        ("idx_author", "CREATE INDEX idx_author ON books(author)"),
+        ("idx_publisher", "CREATE INDEX idx_publisher ON books(publisher)"),
+        ("idx_fulltext",
+         "ALTER TABLE books ADD FULLTEXT idx_fulltext (title, author, publisher, book_intro, content)"),
+        ("idx_content_fulltext", "ALTER TABLE books ADD FULLTEXT idx_content_fulltext (content)"),
+    ]
+    for index_name, ddl in indexes:
+        if not index_exists(cursor, database, "books", index_name):
+            cursor.execute(ddl)
+
+
+def _v2_stock_reservations(cursor, database):
+    """Unpaid orders hold stock through reservations instead of row locks."""
+    # 不对 orders 建外键：预留行在订单归档后仍保留用于对账
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            reservation_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+            order_id VARCHAR(255) NOT NULL,
+            store_id VARCHAR(255) NOT NULL,
+            book_id VARCHAR(255) NOT NULL,
+            quantity INT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'held',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NULL DEFAULT NULL,
+            UNIQUE KEY unique_order_book (order_id, book_id),
+            INDEX idx_status_expires (status, expires_at)
+        )
+    """)
+
+    # 迁移前的未支付订单没有占用库存，补建预留并扣减，保证支付后库存正确
+    cursor.execute("""
+        INSERT IGNORE INTO stock_reservations (order_id, store_id, book_id, quantity, expires_at)
+        SELECT d.order_id, o.store_id, d.book_id, d.quantity, o.create_time
+        FROM order_details d
+        JOIN orders o ON o.order_id = d.order_id
+        WHERE o.order_status = 'unpaid'
+    """)
+    if cursor.rowcount:
+        cursor.execute("""
+            UPDATE store_inventory s
+            JOIN (
+                SELECT store_id, book_id, SUM(quantity) AS quantity
+                FROM stock_reservations
+                WHERE status = 'held'
+                GROUP BY store_id, book_id
+            ) r ON s.store_id = r.store_id AND s.book_id = r.book_id
+            SET s.stock_quantity = s.stock_quantity - r.quantity
+        """)
+
+
+def _v3_seller_credits(cursor, database):
+    """Append-only ledger of seller proceeds, folded into users.balance."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS seller_credits (
+            credit_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+            seller_id VARCHAR(255) NOT NULL,
+            order_id VARCHAR(255) NOT NULL,
+            amount DECIMAL(10,2) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_seller_id (seller_id)
+        )
+    """)
+
+
+def _v4_pay_order_procedure(cursor, database):
+    """Stored procedure running Buyer.payment in one call.
+
+    p_code is the be.model.error code of the outcome, 200 on success.
+    Comparisons use BINARY to match the case-sensitive Python checks.
+    """
+    cursor.execute("DROP PROCEDURE IF EXISTS pay_order")
+    cursor.execute("""
+        CREATE PROCEDURE pay_order(
+            IN p_user_id VARCHAR(255),
+            IN p_password VARCHAR(255),
+            IN p_order_id VARCHAR(255),
+            OUT p_code INT,
+            OUT p_store_id VARCHAR(255))
+        pay: BEGIN
+            DECLARE v_buyer_id VARCHAR(255) DEFAULT NULL;
+            DECLARE v_status VARCHAR(50);
+            DECLARE v_total DECIMAL(10,2);
+            DECLARE v_balance DECIMAL(10,2) DEFAULT NULL;
+            DECLARE v_password VARCHAR(255);
+            DECLARE v_seller_id VARCHAR(255) DEFAULT NULL;
+            DECLARE CONTINUE HANDLER FOR NOT FOUND BEGIN END;
+
+            SET p_store_id = NULL;
+            SELECT user_id, store_id, order_status INTO v_buyer_id, p_store_id, v_status
+            FROM orders WHERE order_id = p_order_id FOR UPDATE;
+            IF v_buyer_id IS NULL THEN
+                SET p_code = 518;
+                LEAVE pay;
+            END IF;
+            IF p_user_id IS NULL OR BINARY v_buyer_id <> BINARY p_user_id THEN
+                SET p_code = 401;
+                LEAVE pay;
+            END IF;
+            IF v_status <> 'unpaid' THEN
+                SET p_code = 531;
+                LEAVE pay;
+            END IF;
+
+            SELECT COALESCE(SUM(quantity * unit_price), 0) INTO v_total
+            FROM order_details WHERE order_id = p_order_id;
+
+            SELECT balance, password_hash INTO v_balance, v_password
+            FROM users WHERE user_id = v_buyer_id FOR UPDATE;
+            IF v_balance IS NULL THEN
+                SET p_code = 511;
+                LEAVE pay;
+            END IF;
+            IF p_password IS NULL OR BINARY v_password <> BINARY p_password THEN
+                SET p_code = 401;
+                LEAVE pay;
+            END IF;
+
+            SELECT user_id INTO v_seller_id FROM stores WHERE store_id = p_store_id;
+            IF v_seller_id IS NULL THEN
+                SET p_code = 513;
+                LEAVE pay;
+            END IF;
+            IF v_balance < v_total THEN
+                SET p_code = 519;
+                LEAVE pay;
+            END IF;
+
+            UPDATE users SET balance = balance - v_total WHERE user_id = v_buyer_id;
+            INSERT INTO seller_credits (seller_id, order_id, amount)
+            VALUES (v_seller_id, p_order_id, v_total);
+            UPDATE orders SET order_status = 'paid', total_amount = v_total
+            WHERE order_id = p_order_id;
+            UPDATE stock_reservations SET status = 'sold'
+            WHERE order_id = p_order_id AND status = 'held';
+            SET p_code = 200;
+        END
+    """)
+
+
+def _v5_idempotency_keys(cursor, database):
+    """Stored responses of write requests sent with an Idempotency-Key."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id VARCHAR(255) NOT NULL,
+            endpoint VARCHAR(64) NOT NULL,
+            idem_key VARCHAR(255) NOT NULL,
+            request_hash CHAR(64) NOT NULL,
+            status_code INT NULL DEFAULT NULL,
+            response TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, endpoint, idem_key),
+            INDEX idx_created_at (created_at)
+        )
+    """)
+
+
+_PAY_ORDER_V6 = """
+CREATE PROCEDURE pay_order(
+    IN p_user_id VARCHAR(255),
+    IN p_password VARCHAR(255),
+    IN p_order_id VARCHAR(255),
+    OUT p_code INT,
+    OUT p_store_id VARCHAR(255))
+pay: BEGIN
+    DECLARE v_order_key BIGINT;
+    DECLARE v_buyer_id VARCHAR(255) DEFAULT NULL;
+    DECLARE v_status VARCHAR(50);
+    DECLARE v_total DECIMAL(10,2);
+    DECLARE v_balance DECIMAL(10,2) DEFAULT NULL;
+    DECLARE v_password VARCHAR(255);
+    DECLARE v_seller_id VARCHAR(255) DEFAULT NULL;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND BEGIN END;
+
+    SET p_store_id = NULL;
+    SELECT order_key, user_id, store_id, order_status
+    INTO v_order_key, v_buyer_id, p_store_id, v_status
+    FROM orders WHERE order_id = p_order_id FOR UPDATE;
+    IF v_buyer_id IS NULL THEN
+        SET p_code = 518;
+        LEAVE pay;
+    END IF;
+    IF p_user_id IS NULL OR BINARY v_buyer_id <> BINARY p_user_id THEN
+        SET p_code = 401;
+        LEAVE pay;
+    END IF;
+    IF v_status <> 'unpaid' THEN
+        SET p_code = 531;
+        LEAVE pay;
+    END IF;
+
+    SELECT COALESCE(SUM(quantity * unit_price), 0) INTO v_total
+    FROM order_details WHERE order_key = v_order_key;
+
+    SELECT balance, password_hash INTO v_balance, v_password
+    FROM users WHERE user_id = v_buyer_id FOR UPDATE;
+    IF v_balance IS NULL THEN
+        SET p_code = 511;
+        LEAVE pay;
+    END IF;
+    IF p_password IS NULL OR BINARY v_password <> BINARY p_password THEN
+        SET p_code = 401;
+        LEAVE pay;
+    END IF;
+
+    SELECT user_id INTO v_seller_id FROM stores WHERE store_id = p_store_id;
+    IF v_seller_id IS NULL THEN
+        SET p_code = 513;
+        LEAVE pay;
+    END IF;
+    IF v_balance < v_total THEN
+        SET p_code = 519;
+        LEAVE pay;
+    END IF;
+
+    UPDATE users SET balance = balance - v_total WHERE user_id = v_buyer_id;
+    INSERT INTO seller_credits (seller_id, order_id, amount)
+    VALUES (v_seller_id, p_order_id, v_total);
+    UPDATE orders SET order_status = 'paid', total_amount = v_total
+    WHERE order_key = v_order_key;
+    UPDATE stock_reservations SET status = 'sold'
+    WHERE order_id = p_order_id AND status = 'held';
+    SET p_code = 200;
+END
+"""
+
+
+_PAY_ORDER_V11 = """
+CREATE PROCEDURE pay_order(
+    IN p_user_id VARCHAR(255),
+    IN p_password VARCHAR(255),
+    IN p_order_id VARCHAR(255),
+    OUT p_code INT,
+    OUT p_store_id VARCHAR(255))
+pay: BEGIN
+    DECLARE v_order_key BIGINT;
+    DECLARE v_create_time TIMESTAMP;
+    DECLARE v_buyer_id VARCHAR(255) DEFAULT NULL;
+    DECLARE v_status VARCHAR(50);
+    DECLARE v_total DECIMAL(10,2);
+    DECLARE v_balance DECIMAL(10,2) DEFAULT NULL;
+    DECLARE v_password VARCHAR(255);
+    DECLARE v_seller_id VARCHAR(255) DEFAULT NULL;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND BEGIN END;
+
+    SET p_store_id = NULL;
+    -- 先不加锁地从 order_ids 取主键，再按 (order_key, create_time) 锁定订单行
+    SELECT order_key, create_time INTO v_order_key, v_create_time
+    FROM order_ids WHERE order_id = p_order_id;
+    SELECT user_id, store_id, order_status
+    INTO v_buyer_id, p_store_id, v_status
+    FROM orders WHERE order_key = v_order_key AND create_time = v_create_time FOR UPDATE;
+    IF v_buyer_id IS NULL THEN
+        SET p_code = 518;
+        LEAVE pay;
+    END IF;
+    IF p_user_id IS NULL OR BINARY v_buyer_id <> BINARY p_user_id THEN
+        SET p_code = 401;
+        LEAVE pay;
+    END IF;
+    IF v_status <> 'unpaid' THEN
+        SET p_code = 531;
+        LEAVE pay;
+    END IF;
+
+    SELECT COALESCE(SUM(quantity * unit_price), 0) INTO v_total
+    FROM order_details WHERE order_key = v_order_key;
+
+    SELECT balance, password_hash INTO v_balance, v_password
+    FROM users WHERE user_id = v_buyer_id FOR UPDATE;
+    IF v_balance IS NULL THEN
+        SET p_code = 511;
+        LEAVE pay;
+    END IF;
+    IF p_password IS NULL OR BINARY v_password <> BINARY p_password THEN
+        SET p_code = 401;
+        LEAVE pay;
+    END IF;
+
+    SELECT user_id INTO v_seller_id FROM stores WHERE store_id = p_store_id;
+    IF v_seller_id IS NULL THEN
+        SET p_code = 513;
+        LEAVE pay;
+    END IF;
+    IF v_balance < v_total THEN
+        SET p_code = 519;
+        LEAVE pay;
+    END IF;
+
+    UPDATE users SET balance = balance - v_total WHERE user_id = v_buyer_id;
+    INSERT INTO seller_credits (seller_id, order_id, amount)
+    VALUES (v_seller_id, p_order_id, v_total);
+    UPDATE orders SET order_status = 'paid', total_amount = v_total
+    WHERE order_key = v_order_key AND create_time = v_create_time;
+    UPDATE stock_reservations SET status = 'sold'
+    WHERE order_id = p_order_id AND status = 'held';
+    SET p_code = 200;
+END
+"""
+
+
+def _v6_order_keys(cursor, database):
+    """BIGINT snowflake order_key as the orders primary key.
+
+    order_id stays as the external id under a unique index. order_details
+    references orders by order_key and drops its own order_id copy.
+    """
+    if not column_exists(cursor, database, "orders", "order_key"):
+        cursor.execute("ALTER TABLE orders ADD COLUMN order_key BIGINT NULL FIRST")
+
+    # 按创建时间为已有订单生成 key，保持时间顺序；旧数据统一使用节点号 0
+    cursor.execute(
+        "SELECT order_id, create_time FROM orders WHERE order_key IS NULL "
+        "ORDER BY create_time, order_id"
+    )
+    rows = cursor.fetchall()
+    last_ms, sequence, keys = None, 0, []
+    for order_id, create_time in rows:
+        ms = int(create_time.timestamp() * 1000) if create_time else 0
+        if last_ms is not None and ms <= last_ms:
+            ms, sequence = last_ms, sequence + 1
+            if sequence > snowflake.MAX_SEQUENCE:
+                ms, sequence = ms + 1, 0
+        else:
+            sequence = 0
+        last_ms = ms
+        keys.append((snowflake.compose(ms, 0, sequence), order_id))
+    for start in range(0, len(keys), 1000):
+        cursor.executemany("UPDATE orders SET order_key = %s WHERE order_id = %s",
+                           keys[start:start + 1000])
+
+    cursor.execute("ALTER TABLE orders MODIFY order_key BIGINT NOT NULL")
+    if not index_exists(cursor, database, "orders", "unique_order_id"):
+        cursor.execute("ALTER TABLE orders ADD UNIQUE KEY unique_order_id (order_id)")
+
+    if column_exists(cursor, database, "order_details", "order_id"):
+        if not column_exists(cursor, database, "order_details", "order_key"):
+            cursor.execute("ALTER TABLE order_details ADD COLUMN order_key BIGINT NULL AFTER detail_id")
+        cursor.execute("""
+            UPDATE order_details d JOIN orders o ON o.order_id = d.order_id
+            SET d.order_key = o.order_key
+        """)
+        cursor.execute("DELETE FROM order_details WHERE order_key IS NULL")
+        for name in foreign_keys(cursor, database, "order_details", "order_id"):
+            cursor.execute(f"ALTER TABLE order_details DROP FOREIGN KEY {name}")
+        if index_exists(cursor, database, "order_details", "unique_order_book"):
+            cursor.execute("ALTER TABLE order_details DROP INDEX unique_order_book")
+        cursor.execute("""
+            ALTER TABLE order_details
+                DROP COLUMN order_id,
+                MODIFY order_key BIGINT NOT NULL,
+                ADD UNIQUE KEY unique_order_book (order_key, book_id)
+        """)
+
+    cursor.execute("ALTER TABLE orders DROP PRIMARY KEY, ADD PRIMARY KEY (order_key)")
+    if not foreign_keys(cursor, database, "order_details", "order_key"):
+        cursor.execute("""
+            ALTER TABLE order_details
+            ADD FOREIGN KEY (order_key) REFERENCES orders(order_key) ON DELETE CASCADE
+        """)
+
+    # pay_order 改为按 order_key 读取明细
+    cursor.execute("DROP PROCEDURE IF EXISTS pay_order")
+    cursor.execute(_PAY_ORDER_V6)
+
+
+def _v7_inventory_version(cursor, database):
+    """Row version for compare-and-swap updates of store_inventory."""
+    if not column_exists(cursor, database, "store_inventory", "version"):
+        cursor.execute("ALTER TABLE store_inventory ADD COLUMN version INT NOT NULL DEFAULT 0")
+
+
+def _v8_partition_orders(cursor, database):
+    """Partition orders by month of create_time and add archive tables.
+
+    MySQL allows no foreign keys on a partitioned table and wants the
+    partitioning column in every unique key: the foreign keys of orders
+    and order_details are dropped, the primary key becomes (order_key,
+    create_time) and order_id gets a plain index. New order ids are
+    derived from order_key, so they stay unique.
+    """
+    for table, column in (("order_details", "order_key"), ("orders", "user_id"), ("orders", "store_id")):
+        for name in foreign_keys(cursor, database, table, column):
+            cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {name}")
+
+    cursor.execute("UPDATE orders SET create_time = CURRENT_TIMESTAMP WHERE create_time IS NULL")
+    cursor.execute("ALTER TABLE orders MODIFY create_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP")
+    if not index_exists(cursor, database, "orders", "idx_order_id"):
+        cursor.execute("ALTER TABLE orders ADD INDEX idx_order_id (order_id)")
+    if index_exists(cursor, database, "orders", "unique_order_id"):
+        cursor.execute("ALTER TABLE orders DROP INDEX unique_order_id")
+    cursor.execute("ALTER TABLE orders DROP PRIMARY KEY, ADD PRIMARY KEY (order_key, create_time)")
+
+    if not order_partitions(cursor, database):
+        # 从最早的订单所在月份起每月一个分区，并预留后续几个月；之后由归档任务继续追加
+        cursor.execute("SELECT MIN(create_time) FROM orders")
+        oldest = cursor.fetchone()[0]
+        today = date.today()
+        start = min(oldest.date(), today) if oldest else today
+        count = (today.year - start.year) * 12 + today.month - start.month + 1 \
+            + conf.Order_Partition_Months_Ahead
+        partitions = [month_partition(year, month) for year, month in month_range(start, count)]
+        partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        cursor.execute("ALTER TABLE orders PARTITION BY RANGE (UNIX_TIMESTAMP(create_time)) ("
+                       + ", ".join(partitions) + ")")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            order_key BIGINT PRIMARY KEY,
+            order_id VARCHAR(255) NOT NULL,
+            user_id VARCHAR(255),
+            store_id VARCHAR(255),
+            order_status VARCHAR(50) NOT NULL,
+            create_time TIMESTAMP NOT NULL,
+            total_amount DECIMAL(10,2),
+            ship_time TIMESTAMP NULL DEFAULT NULL,
+            receive_time TIMESTAMP NULL DEFAULT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_order_id (order_id),
+            INDEX idx_user_time (user_id, create_time)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_details_archive (
+            detail_id INT PRIMARY KEY,
+            order_key BIGINT NOT NULL,
+            book_id VARCHAR(255),
+            quantity INT NOT NULL,
+            unit_price DECIMAL(10,2) NOT NULL,
+            UNIQUE KEY unique_order_book (order_key, book_id)
+        )
+    """)
+
+
+def _v9_job_status(cursor, database):
+    """Which node leads each background job, readable from every node."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_status (
+            job_name VARCHAR(64) PRIMARY KEY,
+            leader VARCHAR(255) NOT NULL,
+            leader_since TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            heartbeat_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _v10_order_ids(cursor, database):
+    """Unique order ids, which the partitioned orders table cannot enforce.
+
+    Every order id is recorded here in the transaction that creates the
+    order and kept when the order is archived, so an id issued twice
+    fails on insert instead of merging two orders.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_ids (
+            order_key BIGINT PRIMARY KEY,
+            order_id VARCHAR(255) NOT NULL,
+            UNIQUE KEY unique_order_id (order_id)
+        )
+    """)
+    cursor.execute("INSERT IGNORE INTO order_ids (order_key, order_id) SELECT order_key, order_id FROM orders")
+    cursor.execute(
+        "INSERT IGNORE INTO order_ids (order_key, order_id) SELECT order_key, order_id FROM orders_archive")
+
+
+def _v11_order_primary_keys(cursor, database):
+    """Record create_time in order_ids so orders can be locked by primary key.
+
+    Locking orders through the non-unique order_id index takes next-key
+    locks that can reach past the newest order and block new ones (see
+    be.model.order_keys). create_time is NULL only for ids whose order no
+    longer exists. pay_order switches to the same lookup.
+    """
+    if not column_exists(cursor, database, "order_ids", "create_time"):
+        cursor.execute("ALTER TABLE order_ids ADD COLUMN create_time TIMESTAMP NULL DEFAULT NULL")
+    for table in ("orders", "orders_archive"):
+        cursor.execute(f"""
+            UPDATE order_ids i JOIN {table} o ON o.order_key = i.order_key
+            SET i.create_time = o.create_time
+            WHERE i.create_time IS NULL
+        """)
+
+    cursor.execute("DROP PROCEDURE IF EXISTS pay_order")
+    cursor.execute(_PAY_ORDER_V11)
+
+
+MIGRATIONS = [
+    Migration(1, "baseline tables and indexes", _v1_baseline),
+    Migration(2, "stock reservations", _v2_stock_reservations),
+    Migration(3, "seller credit ledger", _v3_seller_credits),
+    Migration(4, "pay_order stored procedure", _v4_pay_order_procedure),
+    Migration(5, "idempotency keys", _v5_idempotency_keys),
+    Migration(6, "snowflake order keys", _v6_order_keys),
+    Migration(7, "store_inventory version column", _v7_inventory_version),
+    Migration(8, "monthly order partitions and archive tables", _v8_partition_orders),
+    Migration(9, "background job leaders", _v9_job_status),
+    Migration(10, "unique order ids", _v10_order_ids),
+    Migration(11, "order primary keys in order_ids", _v11_order_primary_keys),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(cursor) -> int:
+    """Return the applied schema version, 0 for an empty database."""
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+    except mysql.connector.Error as e:
+        if e.errno in (1049, 1146):  # unknown database / table
+            return 0
+        raise
+    version = cursor.fetchone()[0]
+    return version or 0
+
+
+def upgrade(conn, database) -> list:
+    """Create database if needed and apply every pending migration in order.
+
+    Returns the versions that were applied. DDL commits implicitly in
+    MySQL, so each migration is recorded as soon as it finishes and a
+    failed run resumes from the first missing version.
+    """
+    applied = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database}")
+        cursor.execute(f"USE {database}")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        version = current_version(cursor)
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            start = time.time()
+            migration.apply(cursor, database)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (migration.version, migration.description)
+            )
+            conn.commit()
+            logging.info(f"[schema] applied migration {migration.version} "
+                         f"({migration.description}) in {time.time() - start:.3f}s")
+            applied.append(migration.version)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return applied
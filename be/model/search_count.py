@@ -0,0 +1,68 @@
+import collections
+import threading
+import time
+from be import conf
+
+COUNT_MODES = ("exact", "approx", "none")
+
+
+class SearchCountCache:
+    """In-process LRU of search totals keyed by (fingerprint, mode).
+
+    A total is (count, exact); approximate totals stop counting at
+    conf.Search_Count_Cap and are stored with exact=False. There is no
+    invalidation: newly listed books show up in totals once the entry
+    is older than conf.Search_Count_TTL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._counters = collections.Counter()
+
+    def get(self, key):
+        """Cached (count, exact) for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry[0]:
+                if entry is not None:
+                    del self._entries[key]
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, total):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + conf.Search_Count_TTL, total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > conf.Search_Count_Cache_Size:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def count(self, name: str):
+        """Record how a total was produced: counted, capped, from_page or skipped."""
+        with self._lock:
+            self._counters[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return dict(
+            {name: counters.get(name, 0) for name in
+             ("hits", "misses", "evictions", "counted", "capped", "from_page", "skipped")},
+            size=size,
+            max_size=conf.Search_Count_Cache_Size,
+            cap=conf.Search_Count_Cap,
+            hit_rate=counters.get("hits", 0) / lookups if lookups else 0.0,
+        )
+
+
+search_counts = SearchCountCache()
@@ -1,7 +1,46 @@
 import mysql.connector
 import json
+import random
+import threading
+import time
+from be import conf
 from be.model import error
 from be.model import db_conn
+from be.model import ledger
+from be.model import order_keys
+from be.model.inventory_cache import inventory_cache
+from be.model import statements
+
+_PRICE_AND_STOCK = statements.register(
+    "seller.price_and_stock",
+    "SELECT stock_quantity, book_price FROM store_inventory WHERE store_id = %s AND book_id = %s")
+
+
+class InventoryWriteStats:
+    """Attempts and version conflicts of inventory read-modify-writes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, operation, mode, conflicts, exhausted=False):
+        with self._lock:
+            entry = self._entries.setdefault((operation, mode), {
+                "writes": 0, "conflicts": 0, "exhausted": 0, "max_conflicts": 0,
+            })
+            entry["writes"] += 1
+            entry["conflicts"] += conflicts
+            entry["exhausted"] += exhausted
+            entry["max_conflicts"] = max(entry["max_conflicts"], conflicts)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {f"{operation}.{mode}": dict(entry)
+                    for (operation, mode), entry in sorted(self._entries.items())}
+
+
+INVENTORY_MODES = ("optimistic", "pessimistic")
+inventory_stats = InventoryWriteStats()
 
 
 class Seller(db_conn.DBConn):
@@ -9,22 +48,13 @@ class Seller(db_conn.DBConn):
         db_conn.DBConn.__init__(self)
 
     def check_store_owner(self, user_id: str, store_id: str) -> bool:
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM stores WHERE store_id = %s AND user_id = %s",
-            (store_id, user_id)
-        )
-        result = cursor.fetchone()
-        cursor.close()
-        return result is not None
+        return super().check_store_owner(store_id, user_id)
 
     def create_store(self, user_id: str, store_id: str) -> (int, str):
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
-
-            if self.store_id_exist(store_id):
-                return error.error_exist_store_id(store_id)
+            code, message = self.check_preconditions(user_id, store_id, store_exists=False)
+            if code != 200:
+                return code, message
 
             cursor = self.conn.cursor()
             cursor.execute(
@@ -47,14 +77,9 @@ class Seller(db_conn.DBConn):
 
     def change_store_name(self, user_id: str, store_id: str, new_name: str) -> (int, str):
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
-            
-            if not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id)
-            
-            if not self.check_store_owner(user_id, store_id):
-                return error.error_authorization_fail()
+            code, message = self.check_preconditions(user_id, store_id, owner=True)
+            if code != 200:
+                return code, message
             
             cursor = self.conn.cursor()
             cursor.execute(
@@ -80,14 +105,10 @@ class Seller(db_conn.DBConn):
 
     def add_book(self, user_id: str, store_id: str, book_id: str, book_json_str: str, stock_level: int):
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
-
-            if not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id)
-
-            if not self.check_store_owner(user_id, store_id):
-                return error.error_authorization_fail()
+            code, message = self.check_preconditions(
+                user_id, store_id, book_id, owner=True, book_exists=False)
+            if code != 200:
+                return code, message
 
             try:
                 book_info = json.loads(book_json_str)
@@ -98,9 +119,6 @@ class Seller(db_conn.DBConn):
             except json.JSONDecodeError:
                 return 400, "Invalid book JSON format"
 
-            if self.book_id_exist(store_id, book_id):
-                return error.error_exist_book_id(book_id)
-
             cursor = self.conn.cursor()
             cursor.execute(
                 "INSERT IGNORE INTO books (id, title, author, publisher, price) "
@@ -130,39 +148,15 @@ class Seller(db_conn.DBConn):
 
     def add_stock_level(self, user_id: str, store_id: str, book_id: str, add_stock_level: int):
         try:
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
-
-            if not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id)
-
-            if not self.check_store_owner(user_id, store_id):
-                return error.error_authorization_fail()
-
-            cursor = self.conn.cursor()
-            # 使用 FOR UPDATE 锁定行，防止并发修改
-            cursor.execute(
-                "SELECT stock_quantity FROM store_inventory "
-                "WHERE store_id = %s AND book_id = %s FOR UPDATE",
-                (store_id, book_id)
+            code, message = self.check_preconditions(user_id, store_id, owner=True)
+            if code != 200:
+                return code, message
+
+            # 保证库存最小为 0
+            return self._write_inventory(
+                "add_stock_level", store_id, book_id,
+                lambda stock, price: (max(0, stock + add_stock_level), price)
             )
-            result = cursor.fetchone()
-            if result is None:
-                cursor.close()
-                return error.error_non_exist_book_id(book_id)
-
-            current_stock = result[0]
-            new_stock = max(0, current_stock + add_stock_level)  # 保证最小为0
-
-            cursor.execute(
-                "UPDATE store_inventory SET stock_quantity = %s "
-                "WHERE store_id = %s AND book_id = %s",
-                (new_stock, store_id, book_id)
-            )
-
-            self.conn.commit()
-            cursor.close()
-            return 200, "ok"
 
         except mysql.connector.Error as e:
             self.conn.rollback()
@@ -171,23 +165,67 @@ class Seller(db_conn.DBConn):
             self.conn.rollback()
             return 530, f"Internal error: {str(e)}"
 
-    def ship_order(self, seller_id: str, store_id: str, order_id: str) -> (int, str):
-        try:
-            if not self.user_id_exist(seller_id):
-                return error.error_non_exist_user_id(seller_id)
+    def _write_inventory(self, operation: str, store_id: str, book_id: str, update) -> (int, str):
+        """Read-modify-write one store_inventory row and commit.
 
-            if not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id)
+        update(stock, price) returns the new (stock, price). The mode in
+        conf.Inventory_Concurrency[operation] decides how the row is
+        protected: "pessimistic" locks it with SELECT ... FOR UPDATE,
+        "optimistic" reads without a lock and writes only if version is
+        unchanged, retrying up to conf.Inventory_Cas_Retries times.
+        """
+        mode = conf.Inventory_Concurrency.get(operation, "pessimistic")
+        attempts = conf.Inventory_Cas_Retries + 1 if mode == "optimistic" else 1
+        lock = " FOR UPDATE" if mode == "pessimistic" else ""
+        with self.conn.cursor() as cursor:
+            for attempt in range(attempts):
+                cursor.execute(
+                    "SELECT stock_quantity, book_price, version FROM store_inventory "
+                    "WHERE store_id = %s AND book_id = %s" + lock,
+                    (store_id, book_id)
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    return error.error_non_exist_book_id(book_id)
+
+                stock, price, version = row
+                new_stock, new_price = update(stock, price)
+                cursor.execute(
+                    "UPDATE store_inventory "
+                    "SET stock_quantity = %s, book_price = %s, version = version + 1 "
+                    "WHERE store_id = %s AND book_id = %s AND version = %s",
+                    (new_stock, new_price, store_id, book_id, version)
+                )
+                if cursor.rowcount == 1:
+                    self.conn.after_commit(inventory_cache.invalidate, [(store_id, book_id)])
+                    self.conn.commit()
+                    inventory_stats.record(operation, mode, attempt)
+                    return 200, "ok"
+
+                # 版本已被其他事务修改：结束事务以取得新的快照，退避后重试
+                self.conn.rollback()
+                time.sleep(random.uniform(0, 0.001 * 2 ** attempt))
+
+        inventory_stats.record(operation, mode, attempts, exhausted=True)
+        return 530, f"Internal error: too many concurrent updates of book {book_id}"
 
-            if not self.check_store_owner(seller_id, store_id):
-                return error.error_authorization_fail()
+    def ship_order(self, seller_id: str, store_id: str, order_id: str) -> (int, str):
+        try:
+            code, message = self.check_preconditions(seller_id, store_id, owner=True)
+            if code != 200:
+                return code, message
 
             cursor = self.conn.cursor()
-            cursor.execute(
-                "SELECT order_status FROM orders WHERE order_id = %s AND store_id = %s",
-                (order_id, store_id)
-            )
-            result = cursor.fetchone()
+            # 按完整主键加锁，经 order_id 的非唯一索引加锁会挡住新订单的插入
+            pk = order_keys.primary_keys(cursor, [order_id]).get(order_id)
+            result = None
+            if pk is not None:
+                cursor.execute(
+                    f"SELECT order_status FROM orders WHERE {order_keys.PK_CONDITION} AND store_id = %s "
+                    "FOR UPDATE",
+                    (*pk, store_id)
+                )
+                result = cursor.fetchone()
             if result is None:
                 cursor.close()
                 return error.error_invalid_order_id(order_id)
@@ -199,8 +237,8 @@ class Seller(db_conn.DBConn):
 
             cursor.execute(
                 "UPDATE orders SET order_status = 'shipped', ship_time = NOW() "
-                "WHERE order_id = %s",
-                (order_id,)
+                f"WHERE {order_keys.PK_CONDITION}",
+                pk
             )
 
             self.conn.commit()
@@ -219,15 +257,15 @@ class Seller(db_conn.DBConn):
         返回格式：
         - 成功时 (200, {"stock_quantity": int, "book_price": float})
         - 失败时 (错误码, 错误信息字符串)
+
+        结果来自进程内库存缓存；未命中时读主库，避免延迟的副本把旧值重新填入缓存
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
-                "SELECT stock_quantity, book_price FROM store_inventory WHERE store_id = %s AND book_id = %s",
-                (store_id, book_id)
-            )
-            result = cursor.fetchone()
-            cursor.close()
+            def load():
+                rows = self.fetch_prepared(_PRICE_AND_STOCK, (store_id, book_id))
+                return rows[0] if rows else None
+
+            result = inventory_cache.get_or_load(store_id, book_id, load)
 
             if result is None:
                 # 库存中没有该书
@@ -246,36 +284,15 @@ class Seller(db_conn.DBConn):
 
     def change_book_price(self, user_id: str, store_id: str, book_id: str, new_price: int) -> (int, str):
         try:
-            cursor = self.conn.cursor()
-
-            if not self.user_id_exist(user_id):
-                return error.error_non_exist_user_id(user_id)
-
-            if not self.store_id_exist(store_id):
-                return error.error_non_exist_store_id(store_id)
-
-            cursor.execute(
-                "SELECT 1 FROM stores WHERE store_id = %s AND user_id = %s",
-                (store_id, user_id)
+            code, message = self.check_preconditions(
+                user_id, store_id, book_id, owner=True, book_exists=True)
+            if code != 200:
+                return code, message
+
+            return self._write_inventory(
+                "change_book_price", store_id, book_id,
+                lambda stock, price: (stock, new_price)
             )
-            if cursor.fetchone() is None:
-                return error.error_authorization_fail()
-
-            cursor.execute(
-                "SELECT 1 FROM store_inventory WHERE store_id = %s AND book_id = %s",
-                (store_id, book_id)
-            )
-            if cursor.fetchone() is None:
-                return error.error_non_exist_book_id(book_id)
-
-            cursor.execute(
-                "UPDATE store_inventory SET book_price = %s WHERE store_id = %s AND book_id = %s",
-                (new_price, store_id, book_id)
-            )
-
-            self.conn.commit()
-            cursor.close()
-            return 200, "ok"
 
         except mysql.connector.Error as e:
             self.conn.rollback()
@@ -283,3 +300,21 @@ class Seller(db_conn.DBConn):
         except Exception as e:
             self.conn.rollback()
             return 530, f"Internal error: {str(e)}"
+
+    def get_balance(self, user_id: str) -> (int, str, dict):
+        """Balance including proceeds still waiting in the seller credit ledger."""
+        try:
+            result = self.fetch_prepared(ledger.BALANCE, (user_id,))
+            if not result:
+                return error.error_non_exist_user_id(user_id) + ({},)
+
+            balance, pending = result[0]
+            return 200, "ok", {
+                "balance": float(balance + pending),
+                "pending": float(pending)
+            }
+
+        except mysql.connector.Error as e:
+            return 528, f"MySQL error: {str(e)}", {}
+        except Exception as e:
+            return 530, f"Internal error: {str(e)}", {}
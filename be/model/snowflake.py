@@ -0,0 +1,62 @@
+import threading
+import time
+
+# 64 位 ID：41 位毫秒时间戳 | 10 位节点号 | 12 位序号，按时间递增
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+DEFAULT_EPOCH_MS = 1577836800000  # 2020-01-01 00:00:00 UTC
+
+
+def compose(timestamp_ms: int, node_id: int, sequence: int, epoch_ms: int = DEFAULT_EPOCH_MS) -> int:
+    return (max(timestamp_ms - epoch_ms, 0) << (NODE_BITS + SEQUENCE_BITS)) \
+        | (node_id << SEQUENCE_BITS) | sequence
+
+
+def timestamp_ms(snowflake_id: int, epoch_ms: int = DEFAULT_EPOCH_MS) -> int:
+    return (snowflake_id >> (NODE_BITS + SEQUENCE_BITS)) + epoch_ms
+
+
+class SnowflakeGenerator:
+    """Thread-safe generator of time-ordered 64-bit ids for one node.
+
+    Each backend process needs its own node id (conf.Node_Id). If the
+    clock moves backwards the generator waits until it has caught up
+    rather than risk handing out a duplicate.
+    """
+
+    def __init__(self, node_id: int, epoch_ms: int = DEFAULT_EPOCH_MS):
+        if not 0 <= node_id <= MAX_NODE:
+            raise ValueError("node id must be between 0 and {}".format(MAX_NODE))
+        self.node_id = node_id
+        self.epoch_ms = epoch_ms
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            now = self._now()
+            if now < self._last_ms:
+                now = self._wait_until(self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 本毫秒的序号用完，等到下一毫秒
+                    now = self._wait_until(self._last_ms + 1)
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return compose(now, self.node_id, self._sequence, self.epoch_ms)
+
+    @staticmethod
+    def _now() -> int:
+        return time.time_ns() // 1_000_000
+
+    def _wait_until(self, target_ms: int) -> int:
+        now = self._now()
+        while now < target_ms:
+            time.sleep((target_ms - now) / 1000)
+            now = self._now()
+        return now
@@ -0,0 +1,71 @@
+import threading
+import mysql.connector
+
+# 连接被回收或服务端丢弃句柄时，重新 prepare 一次即可
+_STALE_HANDLE_ERRORS = {1243}  # ER_UNKNOWN_STMT_HANDLER
+
+
+class Statement:
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.prepares = 0
+        self.executions = 0
+
+
+_registry = {}
+_lock = threading.Lock()
+
+
+def register(name: str, sql: str) -> Statement:
+    """Declare a hot statement that should run over the binary protocol."""
+    with _lock:
+        stmt = _registry.get(name)
+        if stmt is None:
+            stmt = _registry[name] = Statement(name, sql)
+        elif stmt.sql != sql:
+            raise ValueError("statement {} registered twice with different SQL".format(name))
+        return stmt
+
+
+def execute(conn, stmt: Statement, params=()):
+    """Execute stmt on the prepared handle cached on conn and return the cursor.
+
+    conn is a pooled connection; each physical connection prepares a
+    statement once and reuses the handle for the rest of its lifetime.
+    """
+    handles = conn.cache.setdefault("prepared", {})
+    for attempt in range(2):
+        cursor = handles.get(stmt.name)
+        if cursor is None:
+            cursor = conn.cursor(prepared=True)
+            handles[stmt.name] = cursor
+            with _lock:
+                stmt.prepares += 1
+        try:
+            cursor.execute(stmt.sql, tuple(params))
+        except mysql.connector.Error as e:
+            handles.pop(stmt.name, None)
+            try:
+                cursor.close()
+            except Exception:
+                pass
+            if attempt or e.errno not in _STALE_HANDLE_ERRORS:
+                raise
+            continue
+        with _lock:
+            stmt.executions += 1
+        return cursor
+
+
+def stats() -> dict:
+    with _lock:
+        statements = {
+            name: {"prepares": stmt.prepares, "executions": stmt.executions}
+            for name, stmt in sorted(_registry.items())
+        }
+    return {
+        "prepares": sum(s["prepares"] for s in statements.values()),
+        "executions": sum(s["executions"] for s in statements.values()),
+        "statements": statements,
+    }
@@ -1,23 +1,103 @@
+import itertools
 import logging
 import mysql.connector
 import threading
+import time
 from contextlib import closing
+from be.model import schema
+from be.model.pool import ConnectionPool, PoolError
+
+
+class Replica:
+    """A read replica endpoint with its own pool and a cached lag reading."""
+
+    def __init__(self, name, pool: ConnectionPool, lag_check_interval=1.0):
+        self.name = name
+        self.pool = pool
+        self.lag_check_interval = lag_check_interval
+        self._lag = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def lag(self):
+        """Seconds behind the primary, or None when replication is not running."""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.lag_check_interval:
+                return self._lag
+            self._checked_at = now
+            try:
+                self._lag = self._read_lag()
+            except Exception as e:
+                logging.warning(f"[Replica {self.name}] lag check failed: {e}")
+                self._lag = None
+            return self._lag
+
+    def _read_lag(self):
+        conn = self.pool.acquire()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except mysql.connector.Error:
+                # MySQL < 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+
+    def stats(self):
+        stats = self.pool.stats()
+        stats["lag"] = self._lag
+        return stats
+
 
 class Store:
-    def __init__(self, host="localhost", user="stu", password="123456", database="bookstore_lx"):
+    def __init__(self, host="localhost", user="stu", password="123456", database="bookstore_lx",
+                 pool_min_size=2, pool_max_size=32, pool_timeout=10,
+                 pool_max_lifetime=1800, pool_ping_on_borrow=True,
+                 replicas=None, replica_max_lag=2.0, replica_lag_check_interval=1.0,
+                 read_your_writes_seconds=5.0, auto_migrate=False):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
-        self.init_tables()
-
-    def get_connection(self):
-        return mysql.connector.connect(
+        self.check_schema(auto_migrate)
+        pool_options = dict(
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            max_lifetime=pool_max_lifetime,
+            ping_on_borrow=pool_ping_on_borrow,
+        )
+        self.pool = ConnectionPool(self.get_connection, **pool_options)
+
+        self.replicas = []
+        for endpoint in replicas or []:
+            endpoint = dict(endpoint)
+            name = "{}:{}".format(endpoint.get("host", self.host), endpoint.get("port", 3306))
+            pool = ConnectionPool(lambda endpoint=endpoint: self.get_connection(**endpoint), **pool_options)
+            self.replicas.append(Replica(name, pool, replica_lag_check_interval))
+        self._replica_cycle = itertools.cycle(self.replicas)
+        self.replica_max_lag = replica_max_lag
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._recent_writers = {}
+        self._writers_lock = threading.Lock()
+
+    def get_connection(self, **endpoint):
+        options = dict(
             host=self.host,
             user=self.user,
             password=self.password,
             database=self.database
         )
+        options.update(endpoint)
+        return mysql.connector.connect(**options)
 
     def get_connection_no_db(self):
         return mysql.connector.connect(
@@ -26,237 +106,103 @@ class Store:
             password=self.password
         )
 
-    def column_exists(self, cursor, table_name, column_name):
-        """Check if a column exists in a table"""
-        cursor.execute(f"""
-            SELECT COUNT(1) 
-            FROM information_schema.columns 
-            WHERE table_schema = %s 
-            AND table_name = %s 
-            AND column_name = %s
-        """, (self.database, table_name, column_name))
-        return cursor.fetchone()[0] > 0
-
-    def index_exists(self, cursor, table_name, index_name):
-        """Check if an index exists on a table"""
-        cursor.execute(f"""
-            SELECT COUNT(1) 
-            FROM information_schema.statistics 
-            WHERE table_schema = %s 
-            AND table_name = %s 
-            AND index_name = %s
-        """, (self.database, table_name, index_name))
-        return cursor.fetchone()[0] > 0
-
-    def fulltext_index_exists(self, cursor, table_name, index_name):
-        """Check if a fulltext index exists on a table"""
-        cursor.execute(f"""
-            SELECT COUNT(1) 
-            FROM information_schema.statistics 
-            WHERE table_schema = %s 
-            AND table_name = %s 
-            AND index_name = %s
-            AND index_type = 'FULLTEXT'
-        """, (self.database, table_name, index_name))
-        return cursor.fetchone()[0] > 0
+    def schema_version(self) -> int:
+        try:
+            conn = self.get_connection()
+        except mysql.connector.Error as e:
+            if e.errno == 1049:  # unknown database
+                return 0
+            raise
+        with closing(conn):
+            with closing(conn.cursor()) as cursor:
+                return schema.current_version(cursor)
 
-    def init_tables(self):
+    def migrate(self) -> list:
         with closing(self.get_connection_no_db()) as conn:
-            with closing(conn.cursor()) as cursor:
+            return schema.upgrade(conn, self.database)
+
+    def check_schema(self, auto_migrate=False):
+        """Fail fast when the database is behind the code.
+
+        A current schema costs one indexed read; DDL only runs here when
+        auto_migrate is set, otherwise `python -m be.migrate` does it.
+        """
+        version = self.schema_version()
+        if version >= schema.LATEST_VERSION:
+            return
+        if not auto_migrate:
+            raise RuntimeError(
+                f"数据库结构版本 {version} 低于 {schema.LATEST_VERSION}，请先运行 python -m be.migrate")
+        self.migrate()
+
+    def get_db_conn(self, read_only=False, user_id=None):
+        """Borrow a connection from the pool; close() returns it.
+
+        Read-only work goes to a replica whose lag is within
+        replica_max_lag, unless user_id wrote recently (read-your-writes);
+        otherwise, or when no replica can serve, the primary is used.
+        """
+        if read_only and self.replicas and not self._wrote_recently(user_id):
+            for _ in range(len(self.replicas)):
+                replica = next(self._replica_cycle)
+                lag = replica.lag()
+                if lag is None or lag > self.replica_max_lag:
+                    continue
                 try:
-                    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")
-                    cursor.execute(f"USE {self.database}")
-
-                    # Create books table first since other tables reference it
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS books (
-                            id VARCHAR(255) PRIMARY KEY,
-                            title VARCHAR(255),
-                            author VARCHAR(255),
-                            publisher VARCHAR(255),
-                            original_title VARCHAR(255),
-                            translator VARCHAR(255),
-                            pub_year VARCHAR(128),
-                            pages INT,
-                            price FLOAT,
-                            currency_unit VARCHAR(128),
-                            binding VARCHAR(50),
-                            isbn VARCHAR(50),
-                            author_intro LONGTEXT,
-                            book_intro LONGTEXT,
-                            content LONGTEXT,
-                            pictures LONGBLOB
-                        )
-                    """)
-
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS users (
-                            user_id VARCHAR(255) PRIMARY KEY,
-                            password_hash VARCHAR(255) NOT NULL,
-                            token TEXT,
-                            terminal VARCHAR(255),
-                            balance DECIMAL(10,2) NOT NULL DEFAULT 0.00,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """)
-
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS stores (
-                            store_id VARCHAR(255) PRIMARY KEY,
-                            user_id VARCHAR(255),
-                            store_name VARCHAR(255) NOT NULL,
-                            description TEXT,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                            UNIQUE KEY unique_user_store (user_id, store_id)
-                        )
-                    """)
-
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS store_inventory (
-                            inventory_id INT PRIMARY KEY AUTO_INCREMENT,
-                            store_id VARCHAR(255),
-                            book_id VARCHAR(255),
-                            stock_quantity INT NOT NULL DEFAULT 0,
-                            book_price DECIMAL(10,2) NOT NULL,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (store_id) REFERENCES stores(store_id) ON DELETE CASCADE,
-                            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
-                            UNIQUE KEY unique_store_book (store_id, book_id)
-                        )
-                    """)
-
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS orders (
-                            order_id VARCHAR(255) PRIMARY KEY,
-                            user_id VARCHAR(255),
-                            store_id VARCHAR(255),
-                            order_status VARCHAR(50) NOT NULL DEFAULT 'pending',
-                            create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            total_amount DECIMAL(10,2),
-                            FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                            FOREIGN KEY (store_id) REFERENCES stores(store_id) ON DELETE CASCADE,
-                            INDEX idx_user_id (user_id),
-                            INDEX idx_store_id (store_id),
-                            INDEX idx_status (order_status),
-                            INDEX idx_order_time (create_time)
-                        )
-                    """)
-
-                    # Check and add ship_time and receive_time columns if they don't exist
-                    if not self.column_exists(cursor, "orders", "ship_time"):
-                        try:
-                            cursor.execute("ALTER TABLE orders ADD COLUMN ship_time TIMESTAMP NULL DEFAULT NULL")
-                            logging.info("Added ship_time column to orders table")
-                        except Exception as e:
-                            logging.warning(f"添加 ship_time 列失败: {e}")
-                    else:
-                        logging.info("Column ship_time already exists")
-
-                    if not self.column_exists(cursor, "orders", "receive_time"):
-                        try:
-                            cursor.execute("ALTER TABLE orders ADD COLUMN receive_time TIMESTAMP NULL DEFAULT NULL")
-                            logging.info("Added receive_time column to orders table")
-                        except Exception as e:
-                            logging.warning(f"添加 receive_time 列失败: {e}")
-                    else:
-                        logging.info("Column receive_time already exists")
-
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS order_details (
-                            detail_id INT PRIMARY KEY AUTO_INCREMENT,
-                            order_id VARCHAR(255),
-                            book_id VARCHAR(255),
-                            quantity INT NOT NULL,
-                            unit_price DECIMAL(10,2) NOT NULL,
-                            FOREIGN KEY (order_id) REFERENCES orders(order_id) ON DELETE CASCADE,
-                            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
-                            UNIQUE KEY unique_order_book (order_id, book_id)
-                        )
-                    """)
-
-                    cursor.execute("""
-                        CREATE TABLE IF NOT EXISTS book_search_index (
-                            book_id VARCHAR(255) PRIMARY KEY,
-                            search_content TEXT,
-                            FOREIGN KEY (book_id) REFERENCES books(id) ON DELETE CASCADE,
-                            FULLTEXT(search_content)
-                        )
-                    """)
-
-                    # Check and create indexes only if they don't exist
-                    if not self.index_exists(cursor, "books", "idx_title"):
-                        try:
-                            cursor.execute("CREATE INDEX idx_title ON books(title)")
-                            logging.info("Created index idx_title on books(title)")
-                        except Exception as e:
-                            logging.warning(f"创建索引 idx_title 失败: {e}")
-                    else:
-                        logging.info("Index idx_title already exists")
-
-                    if not self.index_exists(cursor, "books", "idx_author"):
-                        try:
-                            cursor.execute("CREATE INDEX idx_author ON books(author)")
-                            logging.info("Created index idx_author on books(author)")
-                        except Exception as e:
-                            logging.warning(f"创建索引 idx_author 失败: {e}")
-                    else:
-                        logging.info("Index idx_author already exists")
-
-                    if not self.index_exists(cursor, "books", "idx_publisher"):
-                        try:
-                            cursor.execute("CREATE INDEX idx_publisher ON books(publisher)")
-                            logging.info("Created index idx_publisher on books(publisher)")
-                        except Exception as e:
-                            logging.warning(f"创建索引 idx_publisher 失败: {e}")
-                    else:
-                        logging.info("Index idx_publisher already exists")
-
-                    if not self.fulltext_index_exists(cursor, "books", "idx_fulltext"):
-                        try:
-                            cursor.execute("""
-                                ALTER TABLE books 
-                                ADD FULLTEXT idx_fulltext (title, author, publisher, book_intro, content)
-                            """)
-                            logging.info("Created fulltext index idx_fulltext on books")
-                        except Exception as e:
-                            logging.warning(f"添加全文索引 idx_fulltext 失败: {e}")
-                    else:
-                        logging.info("Fulltext index idx_fulltext already exists")
-                    
-                    if not self.fulltext_index_exists(cursor, "books", "idx_content_fulltext"):
-                        try:
-                            cursor.execute("""
-                                ALTER TABLE books 
-                                ADD FULLTEXT idx_content_fulltext (content)
-                            """)
-                            logging.info("Created fulltext index idx_content_fulltext on books(content)")
-                        except Exception as e:
-                            logging.warning(f"添加全文索引 idx_content_fulltext 失败: {e}")
-                    else:
-                        logging.info("Fulltext index idx_content_fulltext already exists")
-                    
-
-                    conn.commit()
-
-                except Exception as e:
-                    logging.error(f"创建数据库或表失败: {e}")
-                    conn.rollback()
-
-    def get_db_conn(self):
-        return self.get_connection()
+                    return replica.pool.acquire()
+                except (PoolError, mysql.connector.Error) as e:
+                    logging.warning(f"[Store] replica {replica.name} unavailable: {e}")
+        return self.pool.acquire()
+
+    def note_write(self, user_id):
+        """Pin user_id's reads to the primary for read_your_writes_seconds."""
+        if not self.replicas or user_id is None:
+            return
+        now = time.monotonic()
+        with self._writers_lock:
+            self._recent_writers[user_id] = now + self.read_your_writes_seconds
+            if len(self._recent_writers) > 10000:
+                self._recent_writers = {
+                    k: v for k, v in self._recent_writers.items() if v > now}
+
+    def _wrote_recently(self, user_id):
+        if user_id is None:
+            return False
+        with self._writers_lock:
+            until = self._recent_writers.get(user_id)
+        return until is not None and until > time.monotonic()
+
+    def pool_stats(self):
+        stats = self.pool.stats()
+        stats["replicas"] = {replica.name: replica.stats() for replica in self.replicas}
+        return stats
 
 
 database_instance: Store = None
 init_completed_event = threading.Event()
 
-def init_database(host="localhost", user="stu", password="123456", database="bookstore_lx"):
+def init_database(host="localhost", user="stu", password="123456", database="bookstore_lx", **options):
     global database_instance
-    database_instance = Store(host=host, user=user, password=password, database=database)
+    database_instance = Store(host=host, user=user, password=password, database=database, **options)
     init_completed_event.set()
 
-def get_db_conn():
+def get_db_conn(read_only=False, user_id=None):
     global database_instance
     if database_instance is None:
         raise RuntimeError("数据库未初始化，请先调用 init_database()")
-    return database_instance.get_db_conn()
\ No newline at end of file
+    return database_instance.get_db_conn(read_only=read_only, user_id=user_id)
+
+def get_dedicated_conn():
+    """Open a primary connection outside the pool, e.g. to hold session-level locks."""
+    if database_instance is None:
+        raise RuntimeError("数据库未初始化，请先调用 init_database()")
+    return database_instance.get_connection()
+
+def note_write(user_id):
+    if database_instance is not None:
+        database_instance.note_write(user_id)
+
+def get_pool_stats():
+    if database_instance is None:
+        raise RuntimeError("数据库未初始化，请先调用 init_database()")
+    return database_instance.pool_stats()
@@ -1,14 +1,24 @@
 import logging
 import os
+import time
 from flask import Flask
 from flask import Blueprint
 from flask import request
 from be.view import auth
 from be.view import seller
 from be.view import buyer
+from be.view import admin
+from be import conf
 from be.model.store import init_database, init_completed_event
-from be.model.buyer import OrderCleaner 
-from be.model.buyer import auto_cancel_unpaid_orders
+from be.model.db_conn import note_response_status
+from be.model.db_conn import teardown_unit_of_work
+from be import jobs
+from be.model import archive
+from be.model import ledger
+from be.model.buyer import create_order_expiry
+from be.model.buyer import start_order_writer
+from be.model.leader import claim_node_id
+from be.model.leader import start_leader_election
 
 bp_shutdown = Blueprint("shutdown", __name__)
 
@@ -30,12 +40,25 @@ def be_run():
     this_path = os.path.dirname(__file__)
     parent_path = os.path.dirname(this_path)
     log_file = os.path.join(parent_path, "app.log")
+    start = time.time()
     init_database(
-    host="localhost",
-    user="stu",
-    password="123456",
-    database="bookstore_lx",
-)
+        host=conf.DB_Host,
+        user=conf.DB_User,
+        password=conf.DB_Password,
+        database=conf.DB_Name,
+        pool_min_size=conf.Pool_Min_Size,
+        pool_max_size=conf.Pool_Max_Size,
+        pool_timeout=conf.Pool_Timeout,
+        pool_max_lifetime=conf.Pool_Max_Lifetime,
+        pool_ping_on_borrow=conf.Pool_Ping_On_Borrow,
+        replicas=conf.DB_Replicas,
+        replica_max_lag=conf.Replica_Max_Lag,
+        replica_lag_check_interval=conf.Replica_Lag_Check_Interval,
+        read_your_writes_seconds=conf.Read_Your_Writes_Seconds,
+        auto_migrate=conf.Auto_Migrate,
+    )
+    init_seconds = time.time() - start
+    claim_node_id(conf.Node_Id)
     logging.basicConfig(filename=log_file, level=logging.ERROR)
     handler = logging.StreamHandler()
     formatter = logging.Formatter(
@@ -43,15 +66,30 @@ def be_run():
     )
     handler.setFormatter(formatter)
     logging.getLogger().addHandler(handler)
+    # 根 logger 只输出 ERROR，启动耗时用单独的 INFO 级 logger 记录
+    startup_log = logging.getLogger(__name__)
+    startup_log.setLevel(logging.INFO)
+    startup_log.info(f"database initialised in {init_seconds:.3f}s")
 
     app = Flask(__name__)
     app.register_blueprint(bp_shutdown)
     app.register_blueprint(auth.bp_auth)
     app.register_blueprint(seller.bp_seller)
     app.register_blueprint(buyer.bp_buyer)
+    app.register_blueprint(admin.bp_admin)
+    app.after_request(note_response_status)
+    app.teardown_request(teardown_unit_of_work)
     init_completed_event.set()
 
-    order_cleaner = OrderCleaner()
-    order_cleaner.start()
-    auto_cancel_unpaid_orders() 
-    app.run()
+    background_jobs = [create_order_expiry().job(), ledger.fold_job(), archive.archive_job()]
+    if conf.Leader_Election:
+        start_leader_election([job.name for job in background_jobs])
+    jobs.start_runner(background_jobs)
+    order_writer = start_order_writer() if conf.Order_Group_Commit else None
+    try:
+        app.run()
+    finally:
+        # 写完已排队的订单、等待正在运行的后台任务结束，避免在事务中途退出
+        if order_writer is not None:
+            order_writer.stop()
+        jobs.stop_runner()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Dump backend statistics from the admin endpoints: python -m be.stats sql"""
+import argparse
+import json
+import requests
+from urllib.parse import urljoin
+
+ENDPOINTS = {
+    "sql": "admin/sql_stats",
+    "pool": "admin/pool_stats",
+    "statements": "admin/statement_stats",
+    "tx": "admin/tx_stats",
+    "inventory_cache": "admin/inventory_cache",
+    "search_counts": "admin/search_counts",
+    "expiry": "admin/expiry",
+    "jobs": "admin/jobs",
+}
+
+
+def print_sql(data, limit):
+    header = f"{'count':>8} {'total_ms':>10} {'avg_ms':>8} {'p99_ms':>8} {'rows':>8}  statement / callers"
+    print(header)
+    print("-" * len(header))
+    for row in data["statements"][:limit]:
+        print(f"{row['count']:>8} {row['total_ms']:>10.1f} {row['avg_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {row['rows']:>8}  {row['statement']}")
+        callers = ", ".join(f"{name} x{n}" for name, n in row["callers"].items())
+        print(f"{'':>48}  <- {callers}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("what", choices=sorted(ENDPOINTS))
+    parser.add_argument("--url", default="http://127.0.0.1:5000/")
+    parser.add_argument("--limit", type=int, default=20, help="sql: 显示耗时最多的前 N 条")
+    args = parser.parse_args(argv)
+
+    r = requests.get(urljoin(args.url, ENDPOINTS[args.what]))
+    r.raise_for_status()
+    if args.what == "sql":
+        print_sql(r.json(), args.limit)
+    else:
+        print(json.dumps(r.json(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
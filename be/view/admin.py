@@ -0,0 +1,125 @@
+import hmac
+from flask import Blueprint
+from flask import jsonify
+from flask import request
+from be import conf
+from be import jobs
+from be.model import buyer
+from be.model import seller
+from be.model import store
+from be.model import statements
+from be.model import db_conn
+from be.model import leader
+from be.model.inventory_cache import inventory_cache
+from be.model.search_count import search_counts
+
+bp_admin = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+@bp_admin.before_request
+def require_admin_token():
+    """GETs only report stats; anything that changes state needs conf.Admin_Token."""
+    if request.method == "GET":
+        return None
+    if not conf.Admin_Token:
+        return jsonify({"message": "admin changes are disabled"}), 403
+    token = request.headers.get("Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), conf.Admin_Token.encode("utf-8")):
+        return jsonify({"message": "authorization fail."}), 401
+    return None
+
+
+@bp_admin.route("/pool_stats", methods=["GET"])
+def pool_stats():
+    return jsonify(store.get_pool_stats()), 200
+
+
+@bp_admin.route("/statement_stats", methods=["GET"])
+def statement_stats():
+    return jsonify(statements.stats()), 200
+
+
+@bp_admin.route("/sql_stats", methods=["GET"])
+def sql_stats():
+    return jsonify({"statements": db_conn.sql_stats.snapshot()}), 200
+
+
+@bp_admin.route("/sql_stats/reset", methods=["POST"])
+def reset_sql_stats():
+    db_conn.sql_stats.reset()
+    return jsonify({"message": "ok"}), 200
+
+
+@bp_admin.route("/tx_stats", methods=["GET"])
+def tx_stats():
+    return jsonify(db_conn.tx_stats.snapshot()), 200
+
+
+@bp_admin.route("/payment_engine", methods=["GET", "POST"])
+def payment_engine():
+    if request.method == "POST":
+        engine = request.json.get("engine")
+        if engine not in buyer.PAYMENT_ENGINES:
+            return jsonify({"message": f"unknown payment engine {engine}"}), 400
+        conf.Payment_Engine = engine
+    return jsonify({"engine": conf.Payment_Engine}), 200
+
+
+@bp_admin.route("/order_writer", methods=["GET"])
+def order_writer_stats():
+    if buyer.order_writer is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(buyer.order_writer.stats(), enabled=True)), 200
+
+
+@bp_admin.route("/inventory_concurrency", methods=["GET", "POST"])
+def inventory_concurrency():
+    if request.method == "POST":
+        operation = request.json.get("operation")
+        mode = request.json.get("mode")
+        if operation not in conf.Inventory_Concurrency or mode not in seller.INVENTORY_MODES:
+            return jsonify({"message": f"unknown operation {operation} or mode {mode}"}), 400
+        conf.Inventory_Concurrency[operation] = mode
+    return jsonify({"modes": conf.Inventory_Concurrency,
+                    "stats": seller.inventory_stats.snapshot()}), 200
+
+
+@bp_admin.route("/inventory_cache", methods=["GET"])
+def inventory_cache_stats():
+    return jsonify(inventory_cache.stats()), 200
+
+
+@bp_admin.route("/inventory_cache/clear", methods=["POST"])
+def clear_inventory_cache():
+    inventory_cache.clear()
+    return jsonify({"message": "ok"}), 200
+
+
+@bp_admin.route("/search_counts", methods=["GET"])
+def search_count_stats():
+    return jsonify(search_counts.stats()), 200
+
+
+@bp_admin.route("/expiry", methods=["GET"])
+def expiry_stats():
+    if buyer.order_expiry is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(buyer.order_expiry.stats(), enabled=True)), 200
+
+
+@bp_admin.route("/leader", methods=["GET"])
+def leader_status():
+    local = leader.election
+    return jsonify({
+        "node": leader.NODE_NAME,
+        "election": local is not None,
+        "leading": local.held() if local is not None else None,
+        "jobs": leader.cluster_status(),
+    }), 200
+
+
+@bp_admin.route("/jobs", methods=["GET"])
+def job_stats():
+    if jobs.runner is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, "jobs": jobs.runner.stats()}), 200
@@ -3,12 +3,14 @@ from flask import request
 from flask import jsonify
 from be.model.buyer import Buyer
 from be.model import error 
+from be.view.idempotency import idempotent
 import logging
 
 bp_buyer = Blueprint("buyer", __name__, url_prefix="/buyer")
 
 
 @bp_buyer.route("/new_order", methods=["POST"])
+@idempotent("new_order")
 def new_order():
     data = request.get_json()
     user_id = data.get("user_id")
@@ -21,6 +23,7 @@ def new_order():
     return jsonify({"message": message, "order_id": order_id}), code
 
 @bp_buyer.route("/payment", methods=["POST"])
+@idempotent("payment")
 def payment():
     user_id: str = request.json.get("user_id")
     order_id: str = request.json.get("order_id")
@@ -30,7 +33,21 @@ def payment():
     return jsonify({"message": message}), code
 
 
+@bp_buyer.route("/batch_payment", methods=["POST"])
+def batch_payment():
+    user_id: str = request.json.get("user_id")
+    password: str = request.json.get("password")
+    order_ids = request.json.get("order_ids")
+    if not user_id or not isinstance(order_ids, list):
+        return jsonify({"message": "Missing user_id or order_ids"}), 400
+
+    b = Buyer()
+    code, message, results = b.batch_payment(user_id, password, order_ids)
+    return jsonify({"message": message, "results": results}), code
+
+
 @bp_buyer.route("/add_funds", methods=["POST"])
+@idempotent("add_funds")
 def add_funds():
     user_id = request.json.get("user_id")
     password = request.json.get("password")
@@ -124,6 +141,8 @@ def search_books():
         store_id = data.get("store_id")
         page = data.get("page", 1)
         per_page = data.get("per_page", 10)
+        cursor = data.get("cursor")
+        count = data.get("count", "exact")
 
         if not user_id:
             return jsonify({"message": "User ID is required"}), 400
@@ -137,7 +156,9 @@ def search_books():
             search_field=search_field,
             store_id=store_id,
             page=page,
-            per_page=per_page
+            per_page=per_page,
+            cursor=cursor,
+            count=count
         )
 
         if code != 200:
@@ -149,7 +170,9 @@ def search_books():
             "page": result["page"],
             "per_page": result["per_page"],
             "total": result["total"],
-            "total_pages": result["total_pages"]
+            "total_exact": result["total_exact"],
+            "total_pages": result["total_pages"],
+            "next_cursor": result["next_cursor"]
         }), code
 
     except KeyError as ke:
@@ -0,0 +1,46 @@
+import functools
+from flask import Response
+from flask import jsonify
+from flask import request
+from be.model import idempotency
+
+HEADER = "Idempotency-Key"
+
+
+def idempotent(endpoint: str):
+    """Replay the stored response when a request repeats its Idempotency-Key.
+
+    Keys are scoped to the user and endpoint. Reusing a key with another
+    body is rejected with 422, a replay of a request still running with 409.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            payload = request.get_json(silent=True) or {}
+            user_id = payload.get("user_id")
+            if not key or not user_id:
+                return view(*args, **kwargs)
+
+            req_hash = idempotency.request_hash(payload)
+            store = idempotency.Idempotency()
+            state, stored = store.begin(user_id, endpoint, key, req_hash)
+            if state == idempotency.MISMATCH:
+                return jsonify({"message": f"{HEADER} reused with a different request"}), 422
+            if state == idempotency.IN_PROGRESS:
+                return jsonify({"message": f"request with this {HEADER} is in progress"}), 409
+            if state == idempotency.REPLAY:
+                status, body = stored
+                response = Response(body, status=status, mimetype="application/json")
+                response.headers["Idempotent-Replayed"] = "true"
+                return response
+
+            try:
+                body, status = view(*args, **kwargs)
+            except Exception:
+                store.finish(user_id, endpoint, key, req_hash, 530, "")
+                raise
+            store.finish(user_id, endpoint, key, req_hash, status, body.get_data(as_text=True))
+            return body, status
+        return wrapper
+    return decorator
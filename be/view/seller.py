@@ -2,6 +2,7 @@ from flask import Blueprint
 from flask import request
 from flask import jsonify
 from be.model import seller
+from be.model import user
 import json
 
 bp_seller = Blueprint("seller", __name__, url_prefix="/seller")
@@ -91,4 +92,21 @@ def change_book_price():
     s = seller.Seller()
     code, message = s.change_book_price(user_id, store_id, book_id, new_price)
 
-    return jsonify({"message": message}), code
\ No newline at end of file
+    return jsonify({"message": message}), code
+
+
+@bp_seller.route("/balance", methods=["GET"])
+def get_balance():
+    user_id = request.args.get("user_id")
+    token: str = request.headers.get("token")
+    code, message = user.User().check_token(user_id, token)
+    if code != 200:
+        return jsonify({"message": message}), code
+
+    s = seller.Seller()
+    code, message, result = s.get_balance(user_id)
+
+    if code == 200:
+        return jsonify(result), 200
+    else:
+        return jsonify({"message": message}), code
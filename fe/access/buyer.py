@@ -18,13 +18,20 @@ class Buyer:
         code, self.token = self.auth.login(self.user_id, self.password, self.terminal)
         assert code == 200
 
-    def new_order(self, store_id: str, book_id_and_count: [(str, int)]) -> (int, str):
+    def _headers(self, idempotency_key: str = None) -> dict:
+        headers = {"token": self.token}
+        if idempotency_key is not None:
+            headers["Idempotency-Key"] = idempotency_key
+        return headers
+
+    def new_order(self, store_id: str, book_id_and_count: [(str, int)],
+                  idempotency_key: str = None) -> (int, str):
         books = []
         for id_count_pair in book_id_and_count:
             books.append({"id": id_count_pair[0], "count": id_count_pair[1]})
         json = {"user_id": self.user_id, "store_id": store_id, "books": books}
         url = urljoin(self.url_prefix, "new_order")
-        headers = {"token": self.token}
+        headers = self._headers(idempotency_key)
         r = requests.post(url, headers=headers, json=json)
         response_json = r.json()
         return r.status_code, response_json.get("order_id")
@@ -47,25 +54,36 @@ class Buyer:
             logging.error(f"Failed to call reduce_order_item API: {str(e)}")
             return 530, f"Internal error: {str(e)}"
 
-    def payment(self, order_id: str):
+    def payment(self, order_id: str, idempotency_key: str = None):
         json = {
             "user_id": self.user_id,
             "password": self.password,
             "order_id": order_id,
         }
         url = urljoin(self.url_prefix, "payment")
-        headers = {"token": self.token}
+        headers = self._headers(idempotency_key)
         r = requests.post(url, headers=headers, json=json)
         return r.status_code
 
-    def add_funds(self, add_value: str) -> int:
+    def batch_payment(self, order_ids: List[str]) -> Tuple[int, list]:
+        json = {
+            "user_id": self.user_id,
+            "password": self.password,
+            "order_ids": order_ids,
+        }
+        url = urljoin(self.url_prefix, "batch_payment")
+        headers = {"token": self.token}
+        r = requests.post(url, headers=headers, json=json)
+        return r.status_code, r.json().get("results", [])
+
+    def add_funds(self, add_value: str, idempotency_key: str = None) -> int:
         json = {
             "user_id": self.user_id,
             "password": self.password,
             "add_value": add_value,
         }
         url = urljoin(self.url_prefix, "add_funds")
-        headers = {"token": self.token}
+        headers = self._headers(idempotency_key)
         r = requests.post(url, headers=headers, json=json)
         return r.status_code
     
@@ -123,14 +141,17 @@ class Buyer:
             return 500, "Invalid response format", []
         
     def search_books(self, query: str, search_field: str = 'all', 
-                    store_id: str = None, page: int = 1, per_page: int = 10) -> Tuple[int, Dict]:
+                    store_id: str = None, page: int = 1, per_page: int = 10,
+                    cursor: str = None, count: str = 'exact') -> Tuple[int, Dict]:
         json_data = {
             "user_id": self.user_id,
             "query": query,
             "search_field": search_field,
             "store_id": store_id,
             "page": page,
-            "per_page": per_page
+            "per_page": per_page,
+            "cursor": cursor,
+            "count": count
         }
         url = urljoin(self.url_prefix, "search_books")
         headers = {"token": self.token}
@@ -163,9 +184,11 @@ class Buyer:
                 return r.status_code, {
                     "books": books,
                     "total": response_data.get("result", {}).get("total", 0),
+                    "total_exact": response_data.get("result", {}).get("total_exact"),
                     "page": response_data.get("result", {}).get("page", page),
                     "per_page": response_data.get("result", {}).get("per_page", per_page),
                     "total_pages": response_data.get("result", {}).get("total_pages", 0),
+                    "next_cursor": response_data.get("result", {}).get("next_cursor"),
                     "message": response_data.get("message", "success")
                 }
             else:
@@ -159,3 +159,16 @@ class Seller:
         headers = {"token": self.token}
         r = requests.post(url, headers=headers, json=json) 
         return r.status_code
+
+    def get_balance(self) -> (int, dict or str):
+        """
+        查询账户余额，包含尚未合并的卖家收入
+        :return: (状态码, dict{balance, pending} 或 错误信息字符串)
+        """
+        params = {"user_id": self.seller_id}
+        url = urljoin(self.url_prefix, "balance")
+        headers = {"token": self.token}
+        r = requests.get(url, headers=headers, params=params)
+        if r.status_code == 200:
+            return 200, r.json()
+        return r.status_code, r.json().get("message", r.text)
@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+import uuid
+import requests
+from urllib.parse import urljoin
+from fe import conf
+from fe.access import book
+from fe.access.new_seller import register_new_seller
+
+MODES = ("optimistic", "pessimistic")
+
+
+def set_inventory_mode(operation: str, mode: str) -> dict:
+    """Switch the concurrency control of one inventory operation and return the stats."""
+    url = urljoin(conf.URL, "admin/inventory_concurrency")
+    r = requests.post(url, json={"operation": operation, "mode": mode},
+                      headers={"Admin-Token": conf.Admin_Token})
+    assert r.status_code == 200
+    return r.json()
+
+
+def run_contention_bench(mode: str, threads: int = 16, per_thread: int = 50) -> dict:
+    """Hammer add_stock_level on a single hot book from many threads."""
+    seller_id = "inventory_bench_{}".format(uuid.uuid1())
+    store_id = "inventory_bench_store_{}".format(uuid.uuid1())
+    seller = register_new_seller(seller_id, seller_id)
+    assert seller.create_store(store_id) == 200
+    bk = book.BookDB().get_book_info(0, 1)[0]
+    assert seller.add_book(store_id, 0, bk) == 200
+
+    set_inventory_mode("add_stock_level", mode)
+    failures = []
+
+    def worker():
+        for _ in range(per_thread):
+            if seller.add_stock_level(seller_id, store_id, bk.id, 1) != 200:
+                failures.append(1)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - start
+
+    stats = set_inventory_mode("add_stock_level", mode)["stats"]
+    code, info = seller.get_book_price_and_stock(store_id, bk.id)
+    result = {
+        "mode": mode,
+        "writes": threads * per_thread,
+        "failed": len(failures),
+        "stock": info["stock_quantity"] if code == 200 else None,
+        "throughput": threads * per_thread / elapsed,
+        "stats": stats.get("add_stock_level." + mode),
+    }
+    logging.info("INVENTORY MODE={mode} FAILED:{failed}/{writes} THROUGHPUT:{throughput}".format(**result))
+    return result
+
+
+def compare_inventory_modes() -> list:
+    url = urljoin(conf.URL, "admin/inventory_concurrency")
+    previous = requests.get(url).json()["modes"]["add_stock_level"]
+    try:
+        return [run_contention_bench(mode) for mode in MODES]
+    finally:
+        set_inventory_mode("add_stock_level", previous)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for row in compare_inventory_modes():
+        print(row)
@@ -0,0 +1,55 @@
+import logging
+import requests
+from urllib.parse import urljoin
+from fe import conf
+from fe.bench.workload import Workload
+from fe.bench.session import Session
+
+ENGINES = ("python", "procedure")
+
+
+def set_payment_engine(engine: str) -> str:
+    """Switch the backend payment engine and return the previous one."""
+    url = urljoin(conf.URL, "admin/payment_engine")
+    previous = requests.get(url).json()["engine"]
+    r = requests.post(url, json={"engine": engine}, headers={"Admin-Token": conf.Admin_Token})
+    assert r.status_code == 200
+    return previous
+
+
+def run_payment_bench(engine: str, wl: Workload) -> dict:
+    set_payment_engine(engine)
+    sessions = [Session(wl) for _ in range(0, wl.session)]
+    for ss in sessions:
+        ss.start()
+    for ss in sessions:
+        ss.join()
+
+    n_payment = sum(ss.payment_i for ss in sessions)
+    n_payment_ok = sum(ss.payment_ok for ss in sessions)
+    time_payment = sum(ss.time_payment for ss in sessions)
+    result = {
+        "engine": engine,
+        "payment": n_payment,
+        "payment_ok": n_payment_ok,
+        "latency": time_payment / n_payment if n_payment else 0,
+    }
+    logging.info("PAYMENT ENGINE={engine} OK:{payment_ok} TOTAL:{payment} LATENCY:{latency}".format(**result))
+    return result
+
+
+def compare_payment_engines() -> list:
+    """Run the same workload against each payment engine, python path last."""
+    wl = Workload()
+    wl.gen_database()
+    previous = set_payment_engine("python")
+    try:
+        return [run_payment_bench(engine, wl) for engine in reversed(ENGINES)]
+    finally:
+        set_payment_engine(previous)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for row in compare_payment_engines():
+        print(row)
@@ -1,6 +1,7 @@
 from fe.bench.workload import Workload
 from fe.bench.workload import NewOrder
 from fe.bench.workload import Payment
+from fe import conf
 import time
 import threading
 
@@ -52,12 +53,31 @@ class Session(threading.Thread):
                     self.time_new_order,
                     self.time_payment,
                 )
-                for payment in self.payment_request:
-                    before = time.time()
-                    ok = payment.run()
-                    after = time.time()
-                    self.time_payment = self.time_payment + after - before
-                    self.payment_i = self.payment_i + 1
-                    if ok:
-                        self.payment_ok = self.payment_ok + 1
+                if conf.Use_Batch_Payment:
+                    self.run_batch_payment()
+                else:
+                    for payment in self.payment_request:
+                        before = time.time()
+                        ok = payment.run()
+                        after = time.time()
+                        self.time_payment = self.time_payment + after - before
+                        self.payment_i = self.payment_i + 1
+                        if ok:
+                            self.payment_ok = self.payment_ok + 1
                 self.payment_request = []
+
+    def run_batch_payment(self):
+        # 同一买家的待支付订单合并为一次 batch_payment 请求
+        by_buyer = {}
+        for payment in self.payment_request:
+            by_buyer.setdefault(payment.buyer.user_id, []).append(payment)
+        for payments in by_buyer.values():
+            before = time.time()
+            code, results = payments[0].buyer.batch_payment(
+                [payment.order_id for payment in payments])
+            after = time.time()
+            self.time_payment = self.time_payment + after - before
+            self.payment_i = self.payment_i + len(payments)
+            if code == 200:
+                self.payment_ok = self.payment_ok + sum(
+                    1 for result in results if result["code"] == 200)
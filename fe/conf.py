@@ -9,3 +9,5 @@ Default_Stock_Level = 1000000
 Default_User_Funds = 10000000
 Data_Batch_Size = 100
 Use_Large_DB = True
+Use_Batch_Payment = False
+Admin_Token = ""
@@ -2,6 +2,7 @@ import requests
 import threading
 from urllib.parse import urljoin
 from be import serve
+from be import migrate
 from be.model.store import init_completed_event
 from fe import conf
 
@@ -17,6 +18,7 @@ def run_backend():
 def pytest_configure(config):
     global thread
     print("frontend begin test")
+    migrate.upgrade()
     thread = threading.Thread(target=run_backend)
     thread.start()
     init_completed_event.wait()
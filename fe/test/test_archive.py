@@ -0,0 +1,138 @@
+import pytest
+from datetime import date
+
+from fe.access.buyer import Buyer
+from fe.access.book import Book
+from fe.test.gen_book_data import GenBook
+from fe.access.new_buyer import register_new_buyer
+from be import conf as be_conf
+from be.model import archive
+from be.model import db_conn
+from be.model import schema
+import uuid
+
+
+class TestArchive:
+    seller_id: str
+    store_id: str
+    buyer_id: str
+    buy_book_id_list: [(str, int)]
+    total_price: int
+    buyer: Buyer
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.seller_id = "test_archive_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_archive_store_id_{}".format(str(uuid.uuid1()))
+        self.buyer_id = "test_archive_buyer_id_{}".format(str(uuid.uuid1()))
+        gen_book = GenBook(self.seller_id, self.store_id)
+        ok, self.buy_book_id_list = gen_book.gen(
+            non_exist_book_id=False, low_stock_level=False, max_book_count=5
+        )
+        assert ok
+        self.buyer = register_new_buyer(self.buyer_id, self.buyer_id)
+        self.total_price = 0
+        for item in gen_book.buy_book_info_list:
+            book: Book = item[0]
+            num = item[1]
+            if book.price is not None:
+                self.total_price = self.total_price + book.price * num
+        yield
+
+    def cancelled_order(self) -> str:
+        code, order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+        code, _ = self.buyer.cancel_order(order_id)
+        assert code == 200
+        return order_id
+
+    def paid_order(self) -> str:
+        code, order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+        assert self.buyer.add_funds(self.total_price) == 200
+        assert self.buyer.payment(order_id) == 200
+        return order_id
+
+    @staticmethod
+    def execute(sql, params=()):
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if cursor.with_rows else None
+            db.conn.commit()
+            return rows
+        finally:
+            db.close()
+
+    def backdate(self, order_id, days):
+        # order_ids 记录着订单的完整主键，两边一起改
+        self.execute(
+            "UPDATE orders o JOIN order_ids i ON i.order_key = o.order_key "
+            "SET o.create_time = o.create_time - INTERVAL %s DAY, "
+            "i.create_time = i.create_time - INTERVAL %s DAY "
+            "WHERE o.order_id = %s",
+            (days, days, order_id)
+        )
+
+    def location(self, order_id) -> str:
+        live = self.execute("SELECT order_key FROM orders WHERE order_id = %s", (order_id,))
+        archived = self.execute("SELECT order_key FROM orders_archive WHERE order_id = %s", (order_id,))
+        assert not (live and archived)
+        return "orders" if live else "orders_archive" if archived else None
+
+    def archive_all(self):
+        db = db_conn.DBConn()
+        try:
+            while archive.archive_orders(db.conn, be_conf.Order_Archive_After_Days, 1000) == 1000:
+                pass
+        finally:
+            db.close()
+
+    def test_archive_moves_only_old_terminal_orders(self):
+        old_cancelled = self.cancelled_order()
+        recent_cancelled = self.cancelled_order()
+        old_paid = self.paid_order()
+        self.backdate(old_cancelled, be_conf.Order_Archive_After_Days + 10)
+        self.backdate(old_paid, be_conf.Order_Archive_After_Days + 10)
+
+        self.archive_all()
+
+        assert self.location(old_cancelled) == "orders_archive"
+        assert self.location(recent_cancelled) == "orders"
+        assert self.location(old_paid) == "orders"
+
+        # 明细随订单一起移动
+        order_key = self.execute(
+            "SELECT order_key FROM orders_archive WHERE order_id = %s", (old_cancelled,))[0][0]
+        assert self.execute("SELECT COUNT(*) FROM order_details WHERE order_key = %s", (order_key,))[0][0] == 0
+        assert self.execute(
+            "SELECT COUNT(*) FROM order_details_archive WHERE order_key = %s", (order_key,))[0][0] > 0
+
+        # 归档后的订单仍可查询
+        code, status = self.buyer.get_order_status(old_cancelled)
+        assert code == 200
+        assert status == "cancelled"
+        code, _, orders = self.buyer.get_order_history()
+        assert code == 200
+        assert len(orders) == 3
+
+    def test_partitions_cover_months_ahead(self):
+        months_ahead = be_conf.Order_Partition_Months_Ahead
+        db = db_conn.DBConn()
+        try:
+            archive.maintain_partitions(db.conn, be_conf.DB_Name, months_ahead,
+                                        be_conf.Order_Archive_After_Days)
+            # 已经齐全时不再追加
+            added, _ = archive.maintain_partitions(db.conn, be_conf.DB_Name, months_ahead,
+                                                   be_conf.Order_Archive_After_Days)
+            assert added == 0
+            with db.conn.cursor() as cursor:
+                names = schema.order_partitions(cursor, be_conf.DB_Name)
+        finally:
+            db.close()
+
+        today = date.today()
+        for year, month in schema.month_range(date(today.year, today.month, 1), months_ahead + 1):
+            assert f"p{year:04d}{month:02d}" in names
+        assert names[-1] == "pmax"
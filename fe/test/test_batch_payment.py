@@ -0,0 +1,82 @@
+import pytest
+
+from fe.access.buyer import Buyer
+from fe.test.gen_book_data import GenBook
+from fe.access.new_buyer import register_new_buyer
+from fe.access.book import Book
+import uuid
+
+
+class TestBatchPayment:
+    buyer_id: str
+    password: str
+    order_ids: [str]
+    total_price: int
+    buyer: Buyer
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.buyer_id = "test_batch_payment_buyer_id_{}".format(str(uuid.uuid1()))
+        self.password = self.buyer_id
+        self.buyer = register_new_buyer(self.buyer_id, self.password)
+        self.order_ids = []
+        self.total_price = 0
+        for i in range(3):
+            seller_id = "test_batch_payment_seller_id_{}".format(str(uuid.uuid1()))
+            store_id = "test_batch_payment_store_id_{}".format(str(uuid.uuid1()))
+            gen_book = GenBook(seller_id, store_id)
+            ok, buy_book_id_list = gen_book.gen(
+                non_exist_book_id=False, low_stock_level=False, max_book_count=5
+            )
+            assert ok
+            code, order_id = self.buyer.new_order(store_id, buy_book_id_list)
+            assert code == 200
+            self.order_ids.append(order_id)
+            for item in gen_book.buy_book_info_list:
+                book: Book = item[0]
+                num = item[1]
+                if book.price is not None:
+                    self.total_price = self.total_price + book.price * num
+        yield
+
+    def test_ok(self):
+        code = self.buyer.add_funds(self.total_price)
+        assert code == 200
+        code, results = self.buyer.batch_payment(self.order_ids)
+        assert code == 200
+        assert [r["order_id"] for r in results] == self.order_ids
+        assert all(r["code"] == 200 for r in results)
+        for order_id in self.order_ids:
+            code, status = self.buyer.get_order_status(order_id)
+            assert code == 200
+            assert status == "paid"
+
+    def test_repeat_pay(self):
+        code = self.buyer.add_funds(self.total_price)
+        assert code == 200
+        code, results = self.buyer.batch_payment(self.order_ids)
+        assert code == 200
+
+        code, results = self.buyer.batch_payment(self.order_ids)
+        assert code == 200
+        assert all(r["code"] != 200 for r in results)
+
+    def test_invalid_order_id(self):
+        code = self.buyer.add_funds(self.total_price)
+        assert code == 200
+        order_ids = self.order_ids + [self.order_ids[0] + "_x"]
+        code, results = self.buyer.batch_payment(order_ids)
+        assert code == 200
+        assert [r["code"] == 200 for r in results] == [True] * len(self.order_ids) + [False]
+
+    def test_not_suff_funds(self):
+        code, results = self.buyer.batch_payment(self.order_ids)
+        assert code == 200
+        assert all(r["code"] != 200 for r in results)
+
+    def test_authorization_error(self):
+        code = self.buyer.add_funds(self.total_price)
+        assert code == 200
+        self.buyer.password = self.buyer.password + "_x"
+        code, results = self.buyer.batch_payment(self.order_ids)
+        assert code != 200
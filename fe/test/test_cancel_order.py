@@ -65,6 +65,21 @@ class TestSend:
         code, message = self.buyer.cancel_order(self.order_id)
         assert code != 200
 
+    def test_cancel_order_releases_stock(self):
+        reserved = {}
+        for book, num in self.buy_book_info_list:
+            code, data = self.seller.get_book_price_and_stock(self.store_id, book.id)
+            assert code == 200
+            reserved[book.id] = data["stock_quantity"]
+
+        code, message = self.buyer.cancel_order(self.order_id)
+        assert code == 200
+
+        for book, num in self.buy_book_info_list:
+            code, data = self.seller.get_book_price_and_stock(self.store_id, book.id)
+            assert code == 200
+            assert data["stock_quantity"] == reserved[book.id] + num
+
     def test_cancel_order_already_paid(self):
         code = self.buyer.add_funds(self.total_price)
         assert code == 200
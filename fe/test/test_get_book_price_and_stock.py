@@ -197,4 +197,31 @@ class TestGetBookPriceAndStock:
         # 验证返回数据
         data = r.json()
         assert "stock_quantity" in data, "返回数据缺少stock_quantity"
-        assert "book_price" in data, "返回数据缺少book_price"
\ No newline at end of file
+        assert "book_price" in data, "返回数据缺少book_price"
+
+    def test_after_order_and_cancel(self):
+        """测试下单预留库存、取消归还库存后查询结果"""
+        book_id = self.books[0].id
+        code = self.seller.add_stock_level(self.user_id, self.store_id, book_id, 10)
+        assert code == 200
+        code, initial_data = self.seller.get_book_price_and_stock(self.store_id, book_id)
+        assert code == 200
+
+        buyer_id = f"test_get_price_stock_buyer_{uuid.uuid1()}"
+        buyer = register_new_buyer(buyer_id, buyer_id)
+        code, order_id = buyer.new_order(self.store_id, [(book_id, 4)])
+        assert code == 200
+
+        code, after_order_data = self.seller.get_book_price_and_stock(self.store_id, book_id)
+        assert code == 200
+        assert after_order_data["stock_quantity"] == initial_data["stock_quantity"] - 4
+
+        # 缓存中的库存不足时下单被拒绝
+        code, _ = buyer.new_order(self.store_id, [(book_id, after_order_data["stock_quantity"] + 1)])
+        assert code != 200
+
+        code, _ = buyer.cancel_order(order_id)
+        assert code == 200
+        code, after_cancel_data = self.seller.get_book_price_and_stock(self.store_id, book_id)
+        assert code == 200
+        assert after_cancel_data["stock_quantity"] == initial_data["stock_quantity"]
@@ -0,0 +1,129 @@
+import pytest
+import threading
+import mysql.connector
+
+from fe import conf
+from fe.access import book
+from fe.access.new_buyer import register_new_buyer
+from fe.access.new_seller import register_new_seller
+from be.model import buyer as buyer_model
+from be.model import db_conn
+import uuid
+
+
+class TestGroupCommit:
+    seller_id: str
+    store_id: str
+    buyers: list
+    book: book.Book
+    writer: buyer_model.OrderWriter
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.seller_id = "test_group_commit_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_group_commit_store_id_{}".format(str(uuid.uuid1()))
+        self.seller = register_new_seller(self.seller_id, self.seller_id)
+        assert self.seller.create_store(self.store_id) == 200
+        self.book = book.BookDB(conf.Use_Large_DB).get_book_info(0, 1)[0]
+        assert self.seller.add_book(self.store_id, 10, self.book) == 200
+        self.buyers = []
+        for _ in range(8):
+            buyer_id = "test_group_commit_buyer_id_{}".format(str(uuid.uuid1()))
+            self.buyers.append(register_new_buyer(buyer_id, buyer_id))
+
+        # 后端与测试在同一进程中：换上窗口较宽的写入线程，并发的下单请求落入同一批次
+        previous = buyer_model.order_writer
+        self.writer = buyer_model.OrderWriter(window_ms=200)
+        self.writer.start()
+        buyer_model.order_writer = self.writer
+        yield
+        buyer_model.order_writer = previous
+        self.writer.stop()
+
+    def burst(self, counts) -> list:
+        results = [None] * len(counts)
+
+        def place(i):
+            results[i] = self.buyers[i].new_order(self.store_id, [(self.book.id, counts[i])])
+
+        threads = [threading.Thread(target=place, args=(i,)) for i in range(len(counts))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def stock(self) -> int:
+        code, data = self.seller.get_book_price_and_stock(self.store_id, self.book.id)
+        assert code == 200
+        return data["stock_quantity"]
+
+    def test_burst_is_batched(self):
+        results = self.burst([1] * 8)
+        assert [code for code, _ in results] == [200] * 8
+        assert len({order_id for _, order_id in results}) == 8
+        assert self.stock() == 2
+        assert self.writer.orders == 8
+        assert self.writer.batches < 8
+        assert self.writer.fallbacks == 0
+
+    def test_failed_order_is_undone_in_batch(self):
+        counts = [1, 1, 1, 20, 1, 20, 1, 1]
+        results = self.burst(counts)
+        for count, (code, _) in zip(counts, results):
+            assert code == (517 if count == 20 else 200)
+        # 失败的订单回滚到自己的保存点，同批其他订单照常提交
+        assert self.stock() == 10 - 6
+        assert self.writer.fallbacks == 0
+        for buyer, count in zip(self.buyers, counts):
+            code, _, orders = buyer.get_order_history()
+            assert code == 200
+            assert len(orders) == (0 if count == 20 else 1)
+
+    def test_fallback_writes_one_by_one(self, monkeypatch):
+        def failing_batch(batch):
+            raise RuntimeError("batch failed")
+
+        monkeypatch.setattr(self.writer, "_write_batch", failing_batch)
+        results = self.burst([1, 2, 1, 20])
+        assert [code for code, _ in results] == [200, 200, 200, 517]
+        assert self.stock() == 10 - 4
+        assert self.writer.fallbacks >= 1
+
+    def test_writer_survives_failed_fallback(self, monkeypatch):
+        def failing(*args):
+            raise RuntimeError("write failed")
+
+        monkeypatch.setattr(self.writer, "_write_batch", failing)
+        monkeypatch.setattr(self.writer, "_write_one", failing)
+        code, _ = self.buyers[0].new_order(self.store_id, [(self.book.id, 1)])
+        # 无法确定是否已写入，不能让客户端按可重试处理
+        assert code == 521
+        assert self.writer.is_alive()
+
+        monkeypatch.undo()
+        code, _ = self.buyers[1].new_order(self.store_id, [(self.book.id, 1)])
+        assert code == 200
+
+    def test_commit_failure_is_not_replayed(self, monkeypatch):
+        real_commit = db_conn._RequestConnection.commit
+
+        def lost_commit(conn):
+            # 批次已经提交，但客户端没收到 COMMIT 的响应
+            real_commit(conn)
+            if threading.current_thread() is self.writer:
+                raise mysql.connector.errors.OperationalError("Lost connection to MySQL server")
+
+        monkeypatch.setattr(db_conn._RequestConnection, "commit", lost_commit)
+        results = self.burst([1] * 4)
+        assert [code for code, _ in results] == [521] * 4
+        assert self.writer.fallbacks == 0
+        assert self.writer.unknown_outcomes == 4
+
+        monkeypatch.undo()
+        # 订单各写入一次，没有被逐个重做
+        assert self.stock() == 10 - 4
+        for buyer in self.buyers[:4]:
+            code, _, orders = buyer.get_order_history()
+            assert code == 200
+            assert len(orders) == 1
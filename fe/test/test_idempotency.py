@@ -0,0 +1,125 @@
+import pytest
+
+from fe import conf
+from fe.access.buyer import Buyer
+from fe.access.seller import Seller
+from fe.test.gen_book_data import GenBook
+from fe.access.new_buyer import register_new_buyer
+from fe.access.book import Book
+from be import conf as be_conf
+from be.model import db_conn
+from be.model import idempotency
+import uuid
+
+
+class TestIdempotency:
+    seller_id: str
+    store_id: str
+    buyer_id: str
+    password: str
+    buy_book_id_list: [(str, int)]
+    total_price: int
+    buyer: Buyer
+    seller: Seller
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.seller_id = "test_idempotency_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_idempotency_store_id_{}".format(str(uuid.uuid1()))
+        self.buyer_id = "test_idempotency_buyer_id_{}".format(str(uuid.uuid1()))
+        self.password = self.buyer_id
+        gen_book = GenBook(self.seller_id, self.store_id)
+        ok, self.buy_book_id_list = gen_book.gen(
+            non_exist_book_id=False, low_stock_level=False, max_book_count=5
+        )
+        assert ok
+        self.seller = gen_book.seller
+        self.buyer = register_new_buyer(self.buyer_id, self.password)
+        self.total_price = 0
+        for item in gen_book.buy_book_info_list:
+            book: Book = item[0]
+            num = item[1]
+            if book.price is not None:
+                self.total_price = self.total_price + book.price * num
+        yield
+
+    def stock(self) -> dict:
+        result = {}
+        for book_id, _ in self.buy_book_id_list:
+            code, data = self.seller.get_book_price_and_stock(self.store_id, book_id)
+            assert code == 200
+            result[book_id] = data["stock_quantity"]
+        return result
+
+    def test_new_order_replay(self):
+        key = str(uuid.uuid1())
+        code, order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list, key)
+        assert code == 200
+        stock = self.stock()
+
+        code, replay_order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list, key)
+        assert code == 200
+        assert replay_order_id == order_id
+        # 重放不应再次扣减库存
+        assert self.stock() == stock
+
+    def test_key_reused_with_other_request(self):
+        key = str(uuid.uuid1())
+        code, order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list, key)
+        assert code == 200
+        code, _ = self.buyer.new_order(self.store_id, self.buy_book_id_list[:0], key)
+        assert code == 422
+
+    def test_payment_replay(self):
+        code, order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+        code = self.buyer.add_funds(self.total_price)
+        assert code == 200
+
+        key = str(uuid.uuid1())
+        code = self.buyer.payment(order_id, key)
+        assert code == 200
+        code = self.buyer.payment(order_id, key)
+        assert code == 200
+        code = self.buyer.payment(order_id)
+        assert code != 200
+
+    def test_add_funds_replay(self):
+        key = str(uuid.uuid1())
+        code = self.buyer.add_funds(100, key)
+        assert code == 200
+        code = self.buyer.add_funds(100, key)
+        assert code == 200
+
+        code, data = Seller(conf.URL, self.buyer_id, self.password).get_balance()
+        assert code == 200
+        assert data["balance"] == pytest.approx(100)
+
+    def test_stale_pending_claim_is_reclaimed(self):
+        key = str(uuid.uuid1())
+        req_hash = idempotency.request_hash({"user_id": self.buyer_id})
+
+        def begin():
+            store = idempotency.Idempotency()
+            try:
+                return store.begin(self.buyer_id, "test", key, req_hash)[0]
+            finally:
+                store.close()
+
+        assert begin() == idempotency.NEW
+        assert begin() == idempotency.IN_PROGRESS
+
+        # 占用者没有完成（如进程崩溃），超过未完成超时后可以重新占用
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE idempotency_keys SET created_at = created_at - INTERVAL %s SECOND "
+                    "WHERE user_id = %s AND endpoint = 'test' AND idem_key = %s",
+                    (be_conf.Idempotency_Pending_Timeout + 1, self.buyer_id, key)
+                )
+            db.conn.commit()
+        finally:
+            db.close()
+        assert begin() == idempotency.NEW
+        assert begin() == idempotency.IN_PROGRESS
@@ -0,0 +1,104 @@
+import pytest
+import threading
+
+from fe import conf
+from fe.access import book
+from fe.access.new_seller import register_new_seller
+from be import conf as be_conf
+from be.model import db_conn
+from be.model import seller as seller_model
+import uuid
+
+
+class TestInventoryConcurrency:
+    seller_id: str
+    store_id: str
+    book: book.Book
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self, monkeypatch):
+        self.seller_id = "test_inventory_cas_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_inventory_cas_store_id_{}".format(str(uuid.uuid1()))
+        self.seller = register_new_seller(self.seller_id, self.seller_id)
+        assert self.seller.create_store(self.store_id) == 200
+        self.book = book.BookDB(conf.Use_Large_DB).get_book_info(0, 1)[0]
+        assert self.seller.add_book(self.store_id, 10, self.book) == 200
+        monkeypatch.setitem(be_conf.Inventory_Concurrency, "add_stock_level", "optimistic")
+        yield
+
+    def stock(self) -> int:
+        code, data = self.seller.get_book_price_and_stock(self.store_id, self.book.id)
+        assert code == 200
+        return data["stock_quantity"]
+
+    def bump_version(self):
+        # 另一个事务抢先修改了该行
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE store_inventory SET version = version + 1 WHERE store_id = %s AND book_id = %s",
+                    (self.store_id, self.book.id)
+                )
+            db.conn.commit()
+        finally:
+            db.close()
+
+    def write(self, update):
+        s = seller_model.Seller()
+        try:
+            return s._write_inventory("add_stock_level", self.store_id, self.book.id, update)
+        finally:
+            s.close()
+
+    def test_conflict_is_retried(self):
+        calls = []
+
+        def update(stock, price):
+            calls.append(stock)
+            if len(calls) == 1:
+                self.bump_version()
+            return stock + 5, price
+
+        code, _ = self.write(update)
+        assert code == 200
+        assert len(calls) == 2
+        assert self.stock() == 15
+
+    def test_exhausted_retries(self, monkeypatch):
+        monkeypatch.setattr(be_conf, "Inventory_Cas_Retries", 2)
+        before = seller_model.inventory_stats.snapshot().get("add_stock_level.optimistic", {})
+        calls = []
+
+        def update(stock, price):
+            calls.append(stock)
+            self.bump_version()
+            return stock + 5, price
+
+        code, message = self.write(update)
+        assert code == 530
+        assert "too many concurrent updates" in message
+        assert len(calls) == 3
+        assert self.stock() == 10
+        after = seller_model.inventory_stats.snapshot()["add_stock_level.optimistic"]
+        assert after["exhausted"] == before.get("exhausted", 0) + 1
+
+    @pytest.mark.parametrize("mode", seller_model.INVENTORY_MODES)
+    def test_concurrent_adds_are_not_lost(self, monkeypatch, mode):
+        monkeypatch.setitem(be_conf.Inventory_Concurrency, "add_stock_level", mode)
+        codes = []
+        lock = threading.Lock()
+
+        def add():
+            for _ in range(5):
+                code = self.seller.add_stock_level(self.seller_id, self.store_id, self.book.id, 1)
+                with lock:
+                    codes.append(code)
+
+        threads = [threading.Thread(target=add) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert set(codes) <= {200, 530}
+        assert self.stock() == 10 + codes.count(200)
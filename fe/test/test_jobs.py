@@ -0,0 +1,103 @@
+import pytest
+import threading
+import time
+
+from be import jobs
+from be.model import leader
+
+
+def wait_until(predicate, timeout=5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestJobRunner:
+    runner: jobs.JobRunner
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        # 独立的运行器，不影响后端正在运行的后台任务
+        self.runner = jobs.JobRunner(workers=2)
+        self.runner.start()
+        yield
+        self.runner.stop(timeout=5)
+
+    def test_periodic_job_never_overlaps(self):
+        lock = threading.Lock()
+        state = {"active": 0, "max_active": 0, "runs": 0}
+
+        def work():
+            with lock:
+                state["active"] += 1
+                state["max_active"] = max(state["max_active"], state["active"])
+            time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+                state["runs"] += 1
+            return 1
+
+        self.runner.register(jobs.Job("test_periodic", work, 0.001, leader_only=False))
+        assert wait_until(lambda: state["runs"] >= 5)
+        assert state["max_active"] == 1
+
+        stats = self.runner.stats()["test_periodic"]
+        assert stats["runs"] >= 5
+        assert stats["rows"] == stats["runs"]
+        # 直方图是累计计数，最后一档等于总次数
+        assert stats["duration_histogram"]["le_inf"] == stats["runs"]
+
+    def test_wake_runs_job_early(self):
+        runs = []
+        self.runner.register(jobs.Job("test_wake", lambda: runs.append(1) or 0, 60,
+                                      leader_only=False), delay=60)
+        time.sleep(0.1)
+        assert runs == []
+
+        self.runner.wake("test_wake")
+        assert wait_until(lambda: len(runs) == 1)
+        assert self.runner.stats()["test_wake"]["next_run_in"] > 30
+
+    def test_failure_is_recorded_and_job_keeps_running(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("first run fails")
+            return 0
+
+        self.runner.register(jobs.Job("test_flaky", flaky, 0.01, leader_only=False))
+        assert wait_until(lambda: len(calls) >= 2)
+        stats = self.runner.stats()["test_flaky"]
+        assert stats["failures"] == 1
+        assert stats["runs"] >= 2
+
+    def test_stop_waits_for_running_job(self):
+        started = threading.Event()
+        finished = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.3)
+            finished.set()
+            return 0
+
+        self.runner.register(jobs.Job("test_slow", slow, 60, leader_only=False))
+        assert started.wait(5)
+        self.runner.stop(timeout=5)
+        assert finished.is_set()
+
+    def test_standby_when_not_leader(self):
+        if leader.election is None:
+            pytest.skip("leader election is disabled")
+        runs, standby = [], []
+        # 选举线程不竞选这个任务，本进程不是它的 leader
+        self.runner.register(jobs.Job("test_not_led", lambda: runs.append(1) or 0, 0.01,
+                                      on_standby=lambda: standby.append(1)))
+        assert wait_until(lambda: len(standby) >= 1)
+        assert runs == []
+        assert self.runner.stats()["test_not_led"]["standby"] >= 1
@@ -0,0 +1,90 @@
+import pytest
+import time
+
+from be.model import db_conn
+from be.model import leader
+import uuid
+
+
+def wait_until(predicate, timeout=5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+class TestLeaderElection:
+    job: str
+    nodes: list
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        # 同一进程里的两个选举线程各用一个连接，相当于两个后端进程
+        self.job = "test_leader_{}".format(str(uuid.uuid1()))
+        self.nodes = [leader.LeaderElection([self.job], 0.1) for _ in range(2)]
+        for node in self.nodes:
+            node.start()
+        yield
+        for node in self.nodes:
+            node.stop()
+        for node in self.nodes:
+            node.join()
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                cursor.execute("DELETE FROM job_status WHERE job_name = %s", (self.job,))
+            db.conn.commit()
+        finally:
+            db.close()
+
+    def leaders(self) -> list:
+        return [node for node in self.nodes if node.is_leader(self.job)]
+
+    def test_single_leader(self):
+        assert wait_until(lambda: len(self.leaders()) == 1)
+        # 多次心跳之后仍然只有一个 leader
+        time.sleep(0.5)
+        assert len(self.leaders()) == 1
+
+        status = [row for row in leader.cluster_status() if row["job_name"] == self.job]
+        assert len(status) == 1
+        assert status[0]["leader"] == leader.NODE_NAME
+        assert status[0]["alive"]
+
+    def test_standby_takes_over(self):
+        assert wait_until(lambda: len(self.leaders()) == 1)
+        current = self.leaders()[0]
+        standby = next(node for node in self.nodes if node is not current)
+
+        current.stop()
+        current.join()
+        # 原 leader 退出时关闭连接，锁随之释放，另一个节点在下一次心跳接手
+        assert not current.is_leader(self.job)
+        assert wait_until(lambda: standby.is_leader(self.job))
+        assert standby.elections_won == 1
+
+    def test_confirm_rechecks_lock(self):
+        # 不启动线程，手动心跳，避免后台心跳在断开后马上重新抢到锁
+        job = self.job + "_confirm"
+        node = leader.LeaderElection([job], 60)
+        db = db_conn.DBConn()
+        try:
+            node._heartbeat()
+            assert node.is_leader(job)
+            assert node.confirm(job)
+
+            # 会话被断开，服务器已释放锁，但上一次心跳的结果仍认为持有
+            with db.conn.cursor() as cursor:
+                cursor.execute("KILL %s", (node._conn.connection_id,))
+            assert node.is_leader(job)
+            assert not node.confirm(job)
+            assert not node.is_leader(job)
+            assert node.sessions_lost == 1
+        finally:
+            node._step_down()
+            with db.conn.cursor() as cursor:
+                cursor.execute("DELETE FROM job_status WHERE job_name = %s", (job,))
+            db.conn.commit()
+            db.close()
@@ -0,0 +1,131 @@
+import pytest
+import time
+
+from fe.access.buyer import Buyer
+from fe.access.book import Book
+from fe.test.gen_book_data import GenBook
+from fe.access.new_buyer import register_new_buyer
+from be import conf as be_conf
+from be.model import buyer as buyer_model
+from be.model import db_conn
+import uuid
+
+
+class TestOrderExpiry:
+    seller_id: str
+    store_id: str
+    buyer_id: str
+    buy_book_id_list: [(str, int)]
+    total_price: int
+    buyer: Buyer
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.seller_id = "test_order_expiry_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_order_expiry_store_id_{}".format(str(uuid.uuid1()))
+        self.buyer_id = "test_order_expiry_buyer_id_{}".format(str(uuid.uuid1()))
+        gen_book = GenBook(self.seller_id, self.store_id)
+        ok, self.buy_book_id_list = gen_book.gen(
+            non_exist_book_id=False, low_stock_level=False, max_book_count=5
+        )
+        assert ok
+        self.seller = gen_book.seller
+        self.buyer = register_new_buyer(self.buyer_id, self.buyer_id)
+        self.total_price = 0
+        for item in gen_book.buy_book_info_list:
+            book: Book = item[0]
+            num = item[1]
+            if book.price is not None:
+                self.total_price = self.total_price + book.price * num
+        yield
+
+    def stock(self) -> dict:
+        result = {}
+        for book_id, _ in self.buy_book_id_list:
+            code, data = self.seller.get_book_price_and_stock(self.store_id, book_id)
+            assert code == 200
+            result[book_id] = data["stock_quantity"]
+        return result
+
+    def wait_for_status(self, order_id, status, timeout) -> str:
+        deadline = time.monotonic() + timeout
+        while True:
+            code, current = self.buyer.get_order_status(order_id)
+            assert code == 200
+            if current == status or time.monotonic() >= deadline:
+                return current
+            time.sleep(0.5)
+
+    @staticmethod
+    def execute(sql, params=()):
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall() if cursor.with_rows else None
+            db.conn.commit()
+            return rows
+        finally:
+            db.close()
+
+    def reservations(self, order_id) -> set:
+        rows = self.execute("SELECT status FROM stock_reservations WHERE order_id = %s", (order_id,))
+        return {row[0] for row in rows}
+
+    def test_unpaid_order_cancelled_at_deadline(self):
+        before = self.stock()
+        placed_at = time.monotonic()
+        code, order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+        # 新订单提交后即进入截止时间堆，不必等下一次从数据库重新加载
+        assert buyer_model.order_expiry.stats()["next_due_in"] <= be_conf.Unpaid_Order_Timeout
+
+        status = self.wait_for_status(order_id, "cancelled", be_conf.Unpaid_Order_Timeout + 5)
+        assert status == "cancelled"
+        assert time.monotonic() - placed_at >= be_conf.Unpaid_Order_Timeout - 1
+        # 预留的库存已归还
+        assert self.stock() == before
+
+    def test_paid_order_not_cancelled(self):
+        code, order_id = self.buyer.new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+        assert self.buyer.add_funds(self.total_price) == 200
+        assert self.buyer.payment(order_id) == 200
+
+        time.sleep(be_conf.Unpaid_Order_Timeout + 2)
+        code, status = self.buyer.get_order_status(order_id)
+        assert code == 200
+        assert status == "paid"
+
+    def test_bulk_cancel_only_touches_expired_orders(self):
+        before = self.stock()
+        code, expired = self.buyer.new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+        # 同一买家在同一店铺的未支付订单会合并，另开一个买家下新订单
+        other_id = "test_order_expiry_other_buyer_id_{}".format(str(uuid.uuid1()))
+        other = register_new_buyer(other_id, other_id)
+        code, fresh = other.new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+
+        # order_ids 记录着订单的完整主键，两边一起改
+        self.execute(
+            "UPDATE orders o JOIN order_ids i ON i.order_key = o.order_key "
+            "SET o.create_time = o.create_time - INTERVAL %s SECOND, "
+            "i.create_time = i.create_time - INTERVAL %s SECOND "
+            "WHERE o.order_id = %s",
+            (be_conf.Unpaid_Order_Timeout + 60, be_conf.Unpaid_Order_Timeout + 60, expired)
+        )
+        db = db_conn.DBConn()
+        try:
+            # 每批一个订单，走完多个批次
+            assert buyer_model.cancel_expired_orders(db.conn, 1) >= 1
+        finally:
+            db.close()
+
+        assert self.buyer.get_order_status(expired) == (200, "cancelled")
+        assert other.get_order_status(fresh) == (200, "unpaid")
+        assert self.reservations(expired) == {"released"}
+        assert self.reservations(fresh) == {"held"}
+        # 只有未过期订单的预留仍占着库存
+        assert self.stock() == {book_id: before[book_id] - count
+                                for book_id, count in self.buy_book_id_list}
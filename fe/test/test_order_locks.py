@@ -0,0 +1,75 @@
+import pytest
+import time
+
+from fe.access.buyer import Buyer
+from fe.test.gen_book_data import GenBook
+from fe.access.new_buyer import register_new_buyer
+from be.model import buyer as buyer_model
+from be.model import db_conn
+from be.model import order_keys
+import uuid
+
+
+class TestOrderLocks:
+    seller_id: str
+    store_id: str
+    buy_book_id_list: [(str, int)]
+    buyers: [Buyer]
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.seller_id = "test_order_locks_seller_id_{}".format(str(uuid.uuid1()))
+        self.store_id = "test_order_locks_store_id_{}".format(str(uuid.uuid1()))
+        gen_book = GenBook(self.seller_id, self.store_id)
+        ok, self.buy_book_id_list = gen_book.gen(
+            non_exist_book_id=False, low_stock_level=False, max_book_count=5
+        )
+        assert ok
+        # 每种书的库存至少为 2，两个买家各买一本
+        self.buy_book_id_list = [(book_id, 1) for book_id, _ in self.buy_book_id_list]
+        self.buyers = []
+        for _ in range(2):
+            buyer_id = "test_order_locks_buyer_id_{}".format(str(uuid.uuid1()))
+            self.buyers.append(register_new_buyer(buyer_id, buyer_id))
+        yield
+
+    def test_primary_key_matches_order(self):
+        code, order_id = self.buyers[0].new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                pks = order_keys.primary_keys(cursor, [order_id, "no_such_order"])
+                assert list(pks) == [order_id]
+                cursor.execute(
+                    f"SELECT order_id FROM orders WHERE {order_keys.pk_condition(1)}", pks[order_id])
+                assert cursor.fetchall() == [(order_id,)]
+        finally:
+            db.close()
+
+    def test_locked_order_does_not_block_new_orders(self):
+        code, order_id = self.buyers[0].new_order(self.store_id, self.buy_book_id_list)
+        assert code == 200
+
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                # 像 payment 一样锁住最新的订单，事务不提交
+                pk = order_keys.primary_keys(cursor, [order_id])[order_id]
+                cursor.execute(buyer_model._LOCK_ORDER.sql, pk)
+                assert cursor.fetchone()[2] == "unpaid"
+
+                # 新订单的 order_id 紧跟在被锁的订单之后；只锁记录时插入不用等待，
+                # 经 order_id 的非唯一索引加锁则要等到 innodb_lock_wait_timeout
+                start = time.monotonic()
+                code, new_order_id = self.buyers[1].new_order(self.store_id, self.buy_book_id_list)
+                assert code == 200
+                assert time.monotonic() - start < 5
+                assert int(new_order_id) > int(order_id)
+        finally:
+            db.conn.rollback()
+            db.close()
+
+        # 锁释放后原订单照常可以取消
+        code, _ = self.buyers[0].cancel_order(order_id)
+        assert code == 200
@@ -24,6 +24,7 @@ class TestPayment:
         self.buyer_id = "test_payment_buyer_id_{}".format(str(uuid.uuid1()))
         self.password = self.seller_id
         gen_book = GenBook(self.seller_id, self.store_id)
+        self.seller = gen_book.seller
         ok, buy_book_id_list = gen_book.gen(
             non_exist_book_id=False, low_stock_level=False, max_book_count=5
         )
@@ -49,6 +50,19 @@ class TestPayment:
         code = self.buyer.payment(self.order_id)
         assert code == 200
 
+    def test_seller_balance(self):
+        code, before = self.seller.get_balance()
+        assert code == 200
+        code = self.buyer.add_funds(self.total_price)
+        assert code == 200
+        code = self.buyer.payment(self.order_id)
+        assert code == 200
+
+        # 收入可能仍在账本中未合并，查询结果应已包含
+        code, after = self.seller.get_balance()
+        assert code == 200
+        assert after["balance"] == pytest.approx(before["balance"] + self.total_price)
+
     def test_authorization_error(self):
         code = self.buyer.add_funds(self.total_price)
         assert code == 200
@@ -0,0 +1,109 @@
+import pytest
+import threading
+import time
+
+from be.model import pool
+
+
+class FakeConnection:
+    """Stands in for a mysql.connector connection; the pool only needs these calls."""
+
+    def __init__(self):
+        self.rollbacks = 0
+        self.closed = False
+        self.alive = True
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise RuntimeError("server has gone away")
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool:
+    created: list
+    pool: pool.ConnectionPool
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.created = []
+        self.pool = pool.ConnectionPool(self.factory, min_size=1, max_size=2, timeout=0.2)
+        yield
+        self.pool.close()
+
+    def factory(self) -> FakeConnection:
+        conn = FakeConnection()
+        self.created.append(conn)
+        return conn
+
+    def test_checkout_reuses_idle_connection(self):
+        # min_size 个连接在创建时预先打开
+        assert len(self.created) == 1
+        conn = self.pool.acquire()
+        assert conn.rollbacks == 0
+        assert self.pool.stats()["in_use"] == 1
+        conn.close()
+
+        with self.pool.acquire() as again:
+            assert again.rollbacks == 1
+        assert len(self.created) == 1
+        stats = self.pool.stats()
+        assert stats["checkouts"] == 2
+        assert stats["in_use"] == 0
+        assert stats["idle"] == 1
+
+    def test_release_rolls_back(self):
+        conn = self.pool.acquire()
+        raw = self.created[0]
+        conn.close()
+        # 归还时结束未提交的事务
+        assert raw.rollbacks == 1
+        assert not raw.closed
+        with pytest.raises(pool.PoolError):
+            conn.rollback()
+
+    def test_invalidated_connection_is_destroyed(self):
+        conn = self.pool.acquire()
+        conn.invalidate()
+        conn.close()
+        raw = self.created[0]
+        assert raw.closed
+        assert raw.rollbacks == 0
+        assert self.pool.stats()["size"] == 0
+
+        with self.pool.acquire():
+            assert len(self.created) == 2
+        assert self.pool.stats()["destroyed"] == 1
+
+    def test_dead_connection_is_replaced_on_borrow(self):
+        self.created[0].alive = False
+        with self.pool.acquire():
+            assert len(self.created) == 2
+        assert self.created[0].closed
+        assert self.pool.stats()["size"] == 1
+
+    def test_exhausted_pool_times_out(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        start = time.monotonic()
+        with pytest.raises(pool.PoolTimeout):
+            self.pool.acquire()
+        assert time.monotonic() - start >= 0.2
+        assert self.pool.stats()["timeouts"] == 1
+        assert len(self.created) == 2
+        first.close()
+        second.close()
+
+    def test_waiter_gets_released_connection(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        threading.Timer(0.05, first.close).start()
+        # 等待期间有连接归还，不会超时
+        with self.pool.acquire():
+            assert self.pool.stats()["wait_time_max"] > 0
+        second.close()
+        assert self.pool.stats()["timeouts"] == 0
@@ -126,4 +126,73 @@ class TestSearchBooks:
             per_page=10
         )
         assert code == 200
-        assert len(result['books']) > 0, f"未找到内容匹配项: {query}"
\ No newline at end of file
+        assert len(result['books']) > 0, f"未找到内容匹配项: {query}"
+
+    def test_search_books_with_cursor(self):
+        query = ' '.join(book.title for book, _ in self.buy_book_info_list)
+
+        code, first = self.buyer.search_books(
+            query=query, search_field='all', store_id=self.store_id, per_page=100)
+        assert code == 200
+        expected = [(book['store_id'], book['book_id']) for book in first['books']]
+        assert first['next_cursor'] is None
+
+        seen = []
+        cursor = None
+        while True:
+            code, result = self.buyer.search_books(
+                query=query, search_field='all', store_id=self.store_id,
+                per_page=2, cursor=cursor)
+            assert code == 200
+            assert len(result['books']) <= 2
+            seen.extend((book['store_id'], book['book_id']) for book in result['books'])
+            cursor = result['next_cursor']
+            if cursor is None:
+                break
+            assert len(seen) <= len(expected)
+
+        assert seen == expected
+        assert len(seen) == first['total']
+
+    def test_search_books_invalid_cursor(self):
+        book_obj = self.buy_book_info_list[0][0]
+        code, result = self.buyer.search_books(
+            query=book_obj.title, search_field='title', store_id=self.store_id, per_page=1)
+        assert code == 200
+
+        code, _ = self.buyer.search_books(
+            query=book_obj.title, search_field='title', store_id=self.store_id,
+            per_page=1, cursor="not-a-cursor")
+        assert code == 400
+
+        if result['next_cursor'] is not None:
+            # 游标只能用于生成它的那次搜索
+            code, _ = self.buyer.search_books(
+                query=book_obj.publisher, search_field='publisher', store_id=self.store_id,
+                per_page=1, cursor=result['next_cursor'])
+            assert code == 400
+
+    def test_search_books_count_modes(self):
+        query = ' '.join(book.title for book, _ in self.buy_book_info_list)
+
+        code, exact = self.buyer.search_books(
+            query=query, search_field='all', store_id=self.store_id, per_page=1)
+        assert code == 200
+        assert exact['total_exact'] is True
+        assert exact['total'] >= len(exact['books'])
+
+        code, approx = self.buyer.search_books(
+            query=query, search_field='all', store_id=self.store_id, per_page=1, count='approx')
+        assert code == 200
+        assert approx['total'] == exact['total']
+
+        code, skipped = self.buyer.search_books(
+            query=query, search_field='all', store_id=self.store_id, per_page=1, count='none')
+        assert code == 200
+        assert skipped['total'] is None
+        assert skipped['total_pages'] is None
+        assert skipped['books'] == exact['books']
+
+        code, _ = self.buyer.search_books(
+            query=query, search_field='all', store_id=self.store_id, count='maybe')
+        assert code == 400
@@ -0,0 +1,87 @@
+import pytest
+import mysql.connector
+
+from be import conf as be_conf
+from be.model import db_conn
+
+
+class FakeConnection:
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class Flaky:
+    """A model whose transaction deadlocks on its first `failures` attempts."""
+
+    def __init__(self, failures, errno=1213):
+        self.conn = FakeConnection()
+        self.failures = failures
+        self.errno = errno
+        self.attempts = 0
+
+    @db_conn.transactional("")
+    def write(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise mysql.connector.Error("Deadlock found when trying to get lock", errno=self.errno)
+        return 200, "ok", "written"
+
+
+class TestTransactional:
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self, monkeypatch):
+        # 独立的预算，不影响后端正在处理的请求
+        self.budget = db_conn.RetryBudget(be_conf.Tx_Retry_Budget_Ratio)
+        monkeypatch.setattr(db_conn, "retry_budget", self.budget)
+        monkeypatch.setattr(db_conn, "_backoff", lambda attempt: 0)
+        monkeypatch.setattr(be_conf, "Tx_Max_Attempts", 4)
+        yield
+
+    @staticmethod
+    def stats() -> dict:
+        return db_conn.tx_stats.snapshot()["methods"].get("Flaky.write", {
+            "calls": 0, "retries": 0, "exhausted": 0, "budget_denied": 0})
+
+    def test_deadlock_is_retried(self):
+        before = self.stats()
+        model = Flaky(failures=2)
+        assert model.write() == (200, "ok", "written")
+        assert model.attempts == 3
+        # 每次重试前回滚失败的事务
+        assert model.conn.rollbacks == 2
+        after = self.stats()
+        assert after["retries"] == before["retries"] + 2
+        assert after["errors"]["1213"] >= 2
+
+    def test_attempts_are_capped(self):
+        before = self.stats()
+        model = Flaky(failures=10)
+        code, message, extra = model.write()
+        assert code == 530
+        assert "Deadlock" in message
+        assert extra == ""
+        assert model.attempts == be_conf.Tx_Max_Attempts
+        assert model.conn.rollbacks == be_conf.Tx_Max_Attempts
+        assert self.stats()["exhausted"] == before["exhausted"] + 1
+
+    def test_empty_budget_stops_retries(self):
+        while self.budget.withdraw():
+            pass
+        before = self.stats()
+        model = Flaky(failures=1)
+        code, _, _ = model.write()
+        # 每次调用存入的 ratio 不足一次重试
+        assert code == 530
+        assert model.attempts == 1
+        assert model.conn.rollbacks == 1
+        assert self.stats()["budget_denied"] == before["budget_denied"] + 1
+
+    def test_other_errors_are_not_retried(self):
+        model = Flaky(failures=1, errno=1062)
+        with pytest.raises(mysql.connector.Error):
+            model.write()
+        assert model.attempts == 1
+        assert model.conn.rollbacks == 0
@@ -0,0 +1,56 @@
+import pytest
+from flask import Flask
+from flask import jsonify
+from be.model import db_conn
+from fe.access.new_buyer import register_new_buyer
+import uuid
+
+
+class TestUnitOfWork:
+    user_id: str
+    client: object
+
+    @pytest.fixture(autouse=True)
+    def pre_run_initialization(self):
+        self.user_id = "test_unit_of_work_user_id_{}".format(str(uuid.uuid1()))
+        register_new_buyer(self.user_id, self.user_id)
+
+        # 与后端相同的请求钩子；视图写入后不提交，由请求结束时决定提交还是回滚
+        app = Flask(__name__)
+        app.after_request(db_conn.note_response_status)
+        app.teardown_request(db_conn.teardown_unit_of_work)
+
+        @app.route("/add_funds/<int:status>", methods=["POST"])
+        def add_funds(status):
+            db = db_conn.DBConn()
+            with db.conn.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE users SET balance = balance + 100 WHERE user_id = %s", (self.user_id,))
+            return jsonify({"message": "ok" if status == 200 else "failed"}), status
+
+        self.client = app.test_client()
+        yield
+
+    def balance(self):
+        db = db_conn.DBConn()
+        try:
+            with db.conn.cursor() as cursor:
+                cursor.execute("SELECT balance FROM users WHERE user_id = %s", (self.user_id,))
+                return cursor.fetchone()[0]
+        finally:
+            db.close()
+
+    def test_success_commits(self):
+        before = self.balance()
+        assert self.client.post("/add_funds/200").status_code == 200
+        assert self.balance() == before + 100
+
+    def test_error_response_rolls_back(self):
+        before = self.balance()
+        assert self.client.post("/add_funds/519").status_code == 519
+        assert self.balance() == before
+
+    def test_client_error_rolls_back(self):
+        before = self.balance()
+        assert self.client.post("/add_funds/400").status_code == 400
+        assert self.balance() == before
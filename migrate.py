@@ -24,11 +24,13 @@ def migrate():
 
     # 删除所有旧表（有依赖关系，注意顺序）
     drop_order = [
+        "idempotency_keys", "seller_credits", "stock_reservations", "order_ids",
+        "order_details_archive", "orders_archive",
         "order_details", "orders",
         "store_inventory", "stores",
         "book_search_index",
         "book_tags", "tags", "books",
-        "users"
+        "users", "job_status", "schema_version"
     ]
 
     for table in drop_order: